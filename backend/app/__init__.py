@@ -1,37 +1,102 @@
 import os
-from dotenv import load_dotenv
-from flask import Flask
-from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 
-# 環境変数をロード
-load_dotenv()
-
 db = SQLAlchemy()
 
-# ---------- 1) まずアプリ本体を生成 ----------
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///todos.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-# ---------- 2) 拡張を初期化 ----------
-db.init_app(app)
-
-# ---------- 3) ここで routes / models を読み込む ----------
-#    この時点では app・db が完全に出来ているので循環しない
-from . import routes, models  # noqa: E402
-
-# ---------- 4) テーブルを用意 ----------
-with app.app_context():
-    db.create_all()
-
-# ---------- 5) 通知スケジューラーを初期化・開始 ----------
-try:
-    from .scheduler import NotificationScheduler
-    app.scheduler = NotificationScheduler()
-    app.scheduler.start()
-    print("Notification scheduler initialized and started.")
-except Exception as e:
-    print(f"Failed to initialize notification scheduler: {e}")
+
+# ---------- アプリケーションファクトリ ----------
+#   import app だけでは DB の作成・スケジューラーの起動などの副作用は起きない。
+#   起動スクリプト（wsgi.py）が create_app → setup_database → start_scheduler の
+#   順に明示的に呼び出す。LINE / APScheduler / pytz / requests は、それを使う
+#   処理（start_scheduler や /chat）で初めて import される。
+
+def create_app(config=None):
+    """Flask アプリを生成して拡張と API を登録する（DB・スケジューラーには触れない）
+
+    config を渡すと環境変数由来の設定を上書きする（ベンチマーク・スクリプト用）。
+    """
+    from dotenv import load_dotenv
+    from flask import Flask
+    from flask_cors import CORS
+    from .logging_config import setup_logging
+
+    # 環境変数をロード
+    load_dotenv()
+
+    app = Flask(__name__)
+    setup_logging(app)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///todos.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if config:
+        app.config.update(config)
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    # ---------- 拡張を初期化 ----------
+    db.init_app(app)
+
+    from .sql_profiler import SQLProfiler
+    app.sql_profiler = SQLProfiler()
+    app.sql_profiler.init_app(app)
+
+    from .request_profiler import RequestProfiler
+    app.request_profiler = RequestProfiler(os.path.join(app.instance_path, "profiles"))
+    app.request_profiler.init_app(app)
+
+    from . import tenancy
+    tenancy.init_app(app)
+
+    from .cache import read_cache
+    app.read_cache = read_cache
+    app.read_cache.init_app(app)
+
+    from .change_feed import change_feed
+    app.change_feed = change_feed
+    app.change_feed.init_app(app)
+
+    from .dedupe import duplicate_index
+    app.duplicate_index = duplicate_index
+    app.duplicate_index.init_app(app)
+
+    from .ical import FeedVersions
+    app.ics_versions = FeedVersions()
+
+    from .chat_gate import ChatGate
+    app.chat_gate = ChatGate.from_env()
+
+    from .chat_history import HistoryCompactor
+    app.chat_history = HistoryCompactor.from_env(os.getenv("OPENAI_MODEL", "gpt-4o-2024-08-06"))
+
+    # ---------- routes / models を登録 ----------
+    from . import models  # noqa: F401
+    from .routes import api
+    app.register_blueprint(api)
+
+    # start_scheduler を呼ぶまではスケジューラー無し（デバッグ用エンドポイントは 500 を返す）
     app.scheduler = None
+    return app
+
+
+def setup_database(app):
+    """テーブル・不足カラム・インデックス・検索インデックス・既定テナントを用意する"""
+    from . import tenancy
+    from .migrations import ensure_schema
+    from .search import ensure_search_index
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema(db)
+        ensure_search_index(db)
+        tenancy.ensure_default_tenant(db)
+
+
+def start_scheduler(app):
+    """通知・アーカイブのスケジューラーを起動して app.scheduler に設定する"""
+    try:
+        from .scheduler import NotificationScheduler
+        app.scheduler = NotificationScheduler(app)
+        app.scheduler.start()
+        app.logger.info("Notification scheduler initialized and started.")
+    except Exception as e:
+        app.logger.exception("Failed to initialize notification scheduler: %s", e)
+        app.scheduler = None
+    return app.scheduler
@@ -3,7 +3,9 @@ import re
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Any, Optional
 from .models import Todo
-from . import db
+from .search import find_todo_id_by_title
+from .dedupe import duplicate_index
+from . import db, dependencies, recurrence
 
 class ActionParser:
     """ChatGPTの応答を解析してタスク操作を実行するクラス"""
@@ -13,7 +15,8 @@ class ActionParser:
             'split_task': self._split_task,
             'adjust_deadline': self._adjust_deadline,
             'create_tasks': self._create_tasks,
-            'update_tasks': self._update_tasks
+            'update_tasks': self._update_tasks,
+            'create_recurring_task': self._create_recurring_task
         }
     
     def parse_and_execute(self, response_text: str) -> Dict[str, Any]:
@@ -107,7 +110,7 @@ class ActionParser:
     
     def _split_task(self, action: Dict[str, Any]) -> Dict[str, Any]:
         """タスク分割を実行"""
-        task_id = action.get('task_id')
+        task_id = self._resolve_task_id(action)
         new_tasks = action.get('new_tasks', [])
         
         if not task_id or not new_tasks:
@@ -123,6 +126,7 @@ class ActionParser:
         
         # 新しいサブタスクを作成
         created_tasks = []
+        subtasks = []
         for i, task_data in enumerate(new_tasks):
             subtask_date = None
             if task_data.get('date'):
@@ -135,22 +139,42 @@ class ActionParser:
                 done=False
             )
             db.session.add(subtask)
+            subtasks.append(subtask)
             created_tasks.append({
                 'title': subtask.title,
                 'date': subtask.date.isoformat() if subtask.date else None,
                 'priority': subtask.priority
             })
-        
-        # 元のタスクを削除
+        db.session.flush()
+
+        # 元のタスクの依存関係を引き継ぐ。sequential なら new_tasks の順に前のタスクが次をブロックする
+        sequential = bool(action.get('sequential'))
+        blockers, blocked = dependencies.graph.neighbours(task_id)
+        edges = []
+        for i, subtask in enumerate(subtasks):
+            if not sequential or i == 0:
+                edges += [(blocker, subtask.id) for blocker in blockers]
+            if not sequential or i == len(subtasks) - 1:
+                edges += [(subtask.id, target) for target in blocked]
+            if sequential and i > 0:
+                edges.append((subtasks[i - 1].id, subtask.id))
+        if edges:
+            dependencies.graph.add_edges(edges, commit=False)
+        
+        # 元のタスクを削除（元のタスクの依存関係も同じトランザクションで削除される）
         db.session.delete(original_task)
         
         db.session.commit()
         
+        for created, subtask in zip(created_tasks, subtasks):
+            created['id'] = subtask.id
+        
         return {
             'type': 'split_task',
             'success': True,
             'original_task_id': task_id,
             'created_tasks': created_tasks,
+            'sequential': sequential,
             'message': f"タスク「{original_title}」を削除して{len(created_tasks)}個のタスクを追加しました"
         }
     
@@ -164,7 +188,7 @@ class ActionParser:
         updated_tasks = []
         
         for update in updates:
-            task_id = update.get('task_id')
+            task_id = self._resolve_task_id(update)
             new_date = update.get('new_date')
             
             if not task_id:
@@ -198,15 +222,19 @@ class ActionParser:
         }
     
     def _create_tasks(self, action: Dict[str, Any]) -> Dict[str, Any]:
-        """新しいタスクを作成"""
+        """新しいタスクを作成（既存の未完了タスクとほぼ同じタイトルのものは DEDUPE_CHAT_MODE に従う）"""
         tasks = action.get('tasks', [])
         
         if not tasks:
             raise ValueError("tasksが必要です")
         
         created_tasks = []
+        skipped_duplicates = []
+        mode = duplicate_index.chat_mode
+        titles = [task_data.get('title', '').strip() for task_data in tasks]
+        duplicates = duplicate_index.check_batch(titles) if mode != 'off' else [None] * len(tasks)
         
-        for task_data in tasks:
+        for task_data, duplicate in zip(tasks, duplicates):
             task_date = None
             if task_data.get('date'):
                 task_date = self._parse_date(task_data['date'])
@@ -215,6 +243,11 @@ class ActionParser:
             title = task_data.get('title', '').strip()
             if not title:
                 continue  # タイトルが空の場合はスキップ
+
+            # 言い回しが違うだけの既存タスクを作り直さない
+            if duplicate is not None and mode == 'skip':
+                skipped_duplicates.append({'title': title, 'duplicate_of': duplicate})
+                continue
             
             task = Todo(
                 title=title,
@@ -223,13 +256,23 @@ class ActionParser:
                 done=False
             )
             db.session.add(task)
-            created_tasks.append({
+            created = {
                 'title': task.title,
                 'date': task.date.isoformat() if task.date else None,
                 'priority': task.priority
-            })
+            }
+            if duplicate is not None:
+                created['duplicate_of'] = duplicate
+            created_tasks.append(created)
         
         if not created_tasks:
+            if skipped_duplicates:
+                return {
+                    'type': 'create_tasks',
+                    'success': False,
+                    'skipped_duplicates': skipped_duplicates,
+                    'message': f"{len(skipped_duplicates)}個のタスクは既に同じようなタスクがあるため作成しませんでした"
+                }
             return {
                 'type': 'create_tasks',
                 'success': False,
@@ -237,14 +280,39 @@ class ActionParser:
             }
         
         db.session.commit()
-        
-        return {
+
+        message = f"{len(created_tasks)}個の新しいタスクを作成しました"
+        if skipped_duplicates:
+            message += f"（{len(skipped_duplicates)}個は既存のタスクと重複するため作成しませんでした）"
+        result = {
             'type': 'create_tasks',
             'success': True,
             'created_tasks': created_tasks,
-            'message': f"{len(created_tasks)}個の新しいタスクを作成しました"
+            'message': message
         }
+        if skipped_duplicates:
+            result['skipped_duplicates'] = skipped_duplicates
+        return result
     
+    def _create_recurring_task(self, action: Dict[str, Any]) -> Dict[str, Any]:
+        """繰り返しタスク（シリーズ）を作成"""
+        start_date = self._parse_date(action['start_date']) if action.get('start_date') else date.today()
+
+        series = recurrence.create_series(
+            action.get('title'),
+            action.get('rrule'),
+            start_date,
+            action.get('priority', 0),
+        )
+        db.session.commit()
+
+        return {
+            'type': 'create_recurring_task',
+            'success': True,
+            'series': series.to_dict(),
+            'message': f"繰り返しタスク「{series.title}」を作成しました"
+        }
+
     def _update_tasks(self, action: Dict[str, Any]) -> Dict[str, Any]:
         """既存タスクを更新"""
         updates = action.get('updates', [])
@@ -255,7 +323,7 @@ class ActionParser:
         updated_tasks = []
         
         for update in updates:
-            task_id = update.get('task_id')
+            task_id = self._resolve_task_id(update)
             if not task_id:
                 continue
             
@@ -299,6 +367,17 @@ class ActionParser:
             'message': f"{len(updated_tasks)}個のタスクを更新しました"
         }
     
+    def _resolve_task_id(self, data: Dict[str, Any]) -> Optional[int]:
+        """task_id が無い場合は task_title から全文検索でタスクを特定する"""
+        task_id = data.get('task_id')
+        if task_id:
+            return task_id
+
+        task_title = (data.get('task_title') or '').strip()
+        if task_title:
+            return find_todo_id_by_title(task_title)
+        return None
+
     def _parse_date(self, date_str: str) -> date:
         """日付文字列を解析"""
         if not date_str:
@@ -0,0 +1,74 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import exists, func, insert, literal, select
+from . import db
+from .dependencies import remove_dependencies_of
+from .models import Todo, ArchivedTodo
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVED_COLUMNS = ['id', 'tenant_id', 'title', 'date', 'done', 'parent_id', 'priority', 'completed_at']
+
+
+def _eligible_ids_query(cutoff, batch_size):
+    """アーカイブ対象の id を選ぶクエリ
+
+    - 完了済みで、完了日時（未記録なら期日）が cutoff より古い
+    - todos 側に子タスクが残っていない（子から順に移すので親子が分断されない）
+
+    id は todos の AUTOINCREMENT で再利用されないので、todos_archive と重ならない。
+    """
+    todos = Todo.__table__
+    child = todos.alias('child')
+
+    return (
+        select(todos.c.id)
+        .where(
+            todos.c.done.is_(True),
+            func.coalesce(todos.c.completed_at, todos.c.date) < cutoff,
+            ~exists().where(child.c.parent_id == todos.c.id),
+        )
+        .order_by(todos.c.id)
+        .limit(batch_size)
+    )
+
+
+def archive_completed_todos(older_than_days=90, batch_size=500, max_batches=None, pause=0.0):
+    """古い完了済み Todo を todos_archive に小分けに移動する
+
+    全テナントが対象（Core のテーブル式で書いているのでテナントの自動スコープは掛からない）。
+    1 バッチごとにコミットするので、書き込みロックは短時間で解放される。
+    子タスクを持つ親は、子がすべて移動された後のバッチで移動される。
+    移動したタスクが関わる依存関係は同じバッチのトランザクションで削除する。
+    移動した件数を返す。
+    """
+    todos = Todo.__table__
+    archive = ArchivedTodo.__table__
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    total = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        ids = db.session.execute(_eligible_ids_query(cutoff, batch_size)).scalars().all()
+        if not ids:
+            break
+
+        source = select(
+            *[todos.c[name] for name in _ARCHIVED_COLUMNS],
+            literal(datetime.now()).label('archived_at'),
+        ).where(todos.c.id.in_(ids))
+        db.session.execute(insert(archive).from_select(_ARCHIVED_COLUMNS + ['archived_at'], source))
+        db.session.execute(todos.delete().where(todos.c.id.in_(ids)))
+        # Core の DELETE では after_delete が呼ばれないので、依存関係もここで消す
+        remove_dependencies_of(db.session.connection(), ids)
+        db.session.commit()
+
+        total += len(ids)
+        batches += 1
+        if pause:
+            time.sleep(pause)
+
+    if total:
+        logger.info("Archived %d completed todos in %d batches", total, batches)
+    return total
@@ -0,0 +1,333 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from sqlalchemy import inspect as sa_inspect
+from . import commit_hooks
+from .tenancy import current_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# 書き込みで一覧の内容が変わるテーブル
+_WATCHED_TABLES = {"todos", "todos_archive", "todo_series", "todo_series_exceptions"}
+
+# 日付で月を特定できないテーブル（繰り返しタスクはどの月にも発生しうる）
+_TENANT_WIDE_TABLES = {"todo_series", "todo_series_exceptions"}
+
+
+def _months_between(start, end):
+    """start〜end に含まれる月（YYYY-MM）"""
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _month_of(value):
+    return f"{value.year:04d}-{value.month:02d}" if isinstance(value, date) else None
+
+
+class MemoryBackend:
+    """プロセス内の LRU（件数とバイト数の両方で上限を掛ける）
+
+    値はエンコード済みの bytes で持つので、サイズは len() で正確に数えられる。
+    バージョン番号（無効化用）は件数が少ないので LRU の対象外。
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._versions = {}
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class RedisBackend:
+    """Redis（互換サーバー）を使う共有キャッシュ（複数ワーカーで無効化も共有される）
+
+    メモリの上限と LRU での追い出しはサーバー側（maxmemory / allkeys-lru）に任せ、
+    こちらでは古いバージョンのキーが残り続けないよう TTL を付ける。
+    """
+
+    name = "redis"
+
+    def __init__(self, url, ttl_seconds=3600, prefix="todo-cache:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, value, ex=self.ttl_seconds)
+
+    def get_versions(self, tags):
+        values = self._client.mget([self.prefix + "v:" + tag for tag in tags])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump(self, tags):
+        pipe = self._client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(self.prefix + "v:" + tag)
+        pipe.execute()
+
+    def clear(self):
+        # バージョンを上げれば既存のキーは参照されなくなり、TTL で消える
+        self.bump(["global"])
+
+    def get_status(self):
+        info = self._client.info("memory")
+        return {
+            "used_memory": info.get("used_memory"),
+            "maxmemory": info.get("maxmemory"),
+            "maxmemory_policy": info.get("maxmemory_policy"),
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class ReadCache(commit_hooks.CommitHook):
+    """一覧・月表示（GET /todos, /todos/calendar）の read-through キャッシュ
+
+    キーには依存するタグのバージョン番号を含める。書き込みはコミット時に
+    該当するタグのバージョンを上げるだけで、古いエントリは参照されなくなり
+    LRU（Redis では TTL）で消える。タグは次のとおり。
+
+    - global: 全テナントに影響する書き込み（アーカイブなど）
+    - tenant:<id>: 月を特定できない書き込み（一括 UPDATE・繰り返しタスク・インポート）
+    - all:<id>: テナントの何らかの Todo の変更（期間指定なしの一覧が依存）
+    - month:<id>:<YYYY-MM>: その月に日付がある（あった）Todo の変更
+
+    ORM のフラッシュで変わった Todo は変更前後の date から月を求めるので、
+    ある月の変更が別の月のキャッシュを消すことはない。
+    """
+
+    info_key = "read_cache_tags"
+    tables = _WATCHED_TABLES
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def init_app(self, app):
+        kind = os.getenv("CACHE_BACKEND", "memory").lower()
+        if kind in ("", "none", "off", "false"):
+            logger.info("Read cache is disabled")
+            return
+        if kind == "redis":
+            self.backend = RedisBackend(
+                os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"),
+                ttl_seconds=int(os.getenv("CACHE_TTL_SECONDS", "3600")),
+            )
+        elif kind == "memory":
+            self.backend = MemoryBackend(
+                max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+                max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            )
+        else:
+            raise ValueError(f"unknown CACHE_BACKEND: {kind}")
+        self.enabled = True
+        commit_hooks.register(self)
+        logger.info("Read cache enabled (%s backend)", self.backend.name)
+
+    # ---------- 読み込み ----------
+
+    def _tags(self, tenant_id, window):
+        tags = ["global", f"tenant:{tenant_id}"]
+        if window is None:
+            tags.append(f"all:{tenant_id}")
+        else:
+            tags.extend(f"month:{tenant_id}:{month}" for month in _months_between(*window))
+        return tags
+
+    def fetch(self, name, params, window, build):
+        """キャッシュ済みのエンコード結果を返し、無ければ build() で作って保存する
+
+        name はエンドポイント名、params はキーに含める正規化済みのパラメータ、
+        window は (start, end) か None（全期間）。build は bytes を返す関数。
+        バージョンは DB を読む前に取得するので、読んでいる間にコミットされた
+        書き込みの結果は古いバージョンのキーに入り、以後は参照されない。
+        """
+        if not self.enabled:
+            return build()
+
+        tenant_id = current_tenant_id()
+        try:
+            tags = self._tags(tenant_id, window)
+            versions = self.backend.get_versions(tags)
+            key = f"{name}:{tenant_id}:{params}:" + ".".join(map(str, versions))
+            value = self.backend.get(key)
+        except Exception:
+            logger.exception("Read cache lookup failed")
+            return build()
+
+        self._count(name, value is not None)
+        if value is not None:
+            return value
+
+        value = build()
+        try:
+            self.backend.set(key, value)
+        except Exception:
+            logger.exception("Read cache store failed")
+        return value
+
+    def version_token(self, window):
+        """window の内容が依存するタグのバージョンを連結した文字列（無効・失敗時は None）
+
+        DB を読まずに「前回から変わったか」を判定できるので、ETag に使う。
+        """
+        if not self.enabled:
+            return None
+        try:
+            versions = self.backend.get_versions(self._tags(current_tenant_id(), window))
+        except Exception:
+            logger.exception("Read cache version lookup failed")
+            return None
+        return ".".join(map(str, versions))
+
+    def _count(self, name, hit):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+
+    # ---------- 無効化 ----------
+
+    def invalidate_tenant(self, tenant_id=None):
+        """テナントの一覧キャッシュをすべて無効化する（ORM を通らない書き込みの後に呼ぶ）"""
+        if self.enabled:
+            self.backend.bump([f"tenant:{current_tenant_id() if tenant_id is None else tenant_id}"])
+
+    def invalidate_all(self):
+        if self.enabled:
+            self.backend.bump(["global"])
+
+    def new_pending(self):
+        return set()
+
+    def collect_flush(self, session):
+        """フラッシュされた変更から、無効化するタグを集める（反映はコミット時）"""
+        pending = None
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            table = getattr(obj, "__tablename__", None)
+            if table not in _WATCHED_TABLES:
+                continue
+            if pending is None:
+                pending = self.pending(session)
+            tenant_id = getattr(obj, "tenant_id", None) or current_tenant_id()
+            if table in _TENANT_WIDE_TABLES:
+                pending.add(f"tenant:{tenant_id}")
+                continue
+
+            pending.add(f"all:{tenant_id}")
+            state = sa_inspect(obj)
+            if "date" in state.unloaded:
+                # 変更前の日付が分からない
+                pending.add(f"tenant:{tenant_id}")
+                continue
+            history = state.attrs.date.history
+            for value in (*history.added, *history.unchanged, *history.deleted):
+                month = _month_of(value)
+                if month is not None:
+                    pending.add(f"month:{tenant_id}:{month}")
+
+    def collect_statement(self, session, table, tenant_id):
+        """session.execute() での一括 INSERT / UPDATE / DELETE（対象の月は分からない）"""
+        self.pending(session).add("global" if tenant_id is commit_hooks.ALL_TENANTS else f"tenant:{tenant_id}")
+
+    def apply(self, tags):
+        try:
+            self.backend.bump(sorted(tags))
+        except Exception:
+            # 無効化に失敗したら古い内容を返さないよう全体を捨てる
+            logger.exception("Read cache invalidation failed")
+            try:
+                self.backend.clear()
+            except Exception:
+                logger.exception("Read cache clear failed")
+
+    # ---------- 統計 ----------
+
+    def get_status(self):
+        with self._lock:
+            endpoints = {
+                name: dict(stats, hit_ratio=round(stats["hits"] / (stats["hits"] + stats["misses"]), 4))
+                for name, stats in self._stats.items()
+                if stats["hits"] + stats["misses"]
+            }
+        hits = sum(s["hits"] for s in endpoints.values())
+        misses = sum(s["misses"] for s in endpoints.values())
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name if self.backend else None,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            "endpoints": endpoints,
+            "storage": self.backend.get_status() if self.backend else None,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+read_cache = ReadCache()
@@ -0,0 +1,407 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from . import commit_hooks
+from .commit_hooks import ALL_TENANTS
+from .serializers import TODO_FIELDS, dumps, row_to_dict, todo_to_dict
+from .tenancy import current_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# 変更があればクライアントに一覧の再取得を促すテーブル（1 件ずつの差分は送らない）
+_INVALIDATING_TABLES = {"todos_archive", "todo_series", "todo_series_exceptions"}
+
+
+def _parse_event_id(value):
+    """"<エポック>-<連番>" 形式のイベント ID を比較用のタプルにする（不正なら None）"""
+    try:
+        epoch, seq = value.split("-", 1)
+        return int(epoch), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _snapshot(todo, is_new):
+    """送信する Todo の内容（コミット後は属性が期限切れになるのでフラッシュ時に作る）
+
+    読み込まれていない属性は SELECT し直さない。INSERT したばかりの行で値が無い
+    カラムは NULL なので None とし、既存の行なら id だけを送る。
+    """
+    values = todo.__dict__
+    if all(name in values for name in TODO_FIELDS):
+        return todo_to_dict(todo)
+    if is_new:
+        return row_to_dict(tuple(values.get(name) for name in TODO_FIELDS))
+    return {"id": todo.id}
+
+
+def _format_event(event_id, kind, data):
+    """SSE の 1 イベント（data は JSON の bytes で改行を含まない）"""
+    head = f"id: {event_id}\nevent: {kind}\n" if event_id is not None else f"event: {kind}\n"
+    return head.encode("utf-8") + b"data: " + data + b"\n\n"
+
+
+class FeedGap(Exception):
+    """再接続時に、Last-Event-ID 以降のイベントがもう残っていない"""
+
+
+class MemoryLog:
+    """プロセス内のイベントログ（直近 history_size 件を保持）
+
+    イベント ID は "<起動時刻ms>-<連番>"。再起動後に古い ID で再接続されたら
+    起動時刻が一致しないので取りこぼしとして扱う。
+    """
+
+    name = "memory"
+
+    def __init__(self, history_size=1000):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=history_size)
+        self._epoch = int(time.time() * 1000)
+        self._seq = 0
+        self.on_event = None
+
+    def append(self, tenant_id, kind, data):
+        with self._lock:
+            self._seq += 1
+            event_id = f"{self._epoch}-{self._seq}"
+            self._events.append((event_id, tenant_id, kind, data))
+            # ロック内で配ることで、購読者には ID 順に届く
+            if self.on_event is not None:
+                self.on_event(event_id, tenant_id, kind, data)
+        return event_id
+
+    def since(self, last_event_id):
+        """last_event_id より後のイベント（残っていなければ FeedGap）"""
+        last = _parse_event_id(last_event_id)
+        with self._lock:
+            if last is None or last[0] != self._epoch or last[1] > self._seq:
+                raise FeedGap(last_event_id)
+            if last[1] == self._seq:
+                return []
+            oldest = _parse_event_id(self._events[0][0])[1] if self._events else self._seq + 1
+            if last[1] + 1 < oldest:
+                raise FeedGap(last_event_id)
+            return [e for e in self._events if _parse_event_id(e[0])[1] > last[1]]
+
+    def get_status(self):
+        with self._lock:
+            return {"events": len(self._events), "history_size": self._events.maxlen, "last_seq": self._seq}
+
+
+class RedisLog:
+    """Redis Stream を使うイベントログ（複数ワーカーで同じ変更を配信できる）
+
+    どのワーカーで発生した変更も XADD で 1 本のストリームに入り、各ワーカーの
+    読み取りスレッドが XREAD で受け取って自分の購読者に配る。イベント ID は
+    Redis Stream の ID（"<ms>-<連番>"）をそのまま使うので、別のワーカーに
+    再接続しても Last-Event-ID から再開できる。
+    """
+
+    name = "redis"
+
+    def __init__(self, url, history_size=1000, stream="todo-feed"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CHANGE_FEED_BACKEND=redis requires the redis package") from e
+        self._client = redis.Redis.from_url(url)
+        self.history_size = history_size
+        self.stream = stream
+        self.on_event = None
+        self._reader = None
+        self._reader_lock = threading.Lock()
+
+    @staticmethod
+    def _encode(tenant_id, kind, data):
+        return {"tenant": "" if tenant_id is None else str(tenant_id), "kind": kind, "data": data}
+
+    @staticmethod
+    def _decode(entry_id, fields):
+        tenant = fields[b"tenant"].decode()
+        return entry_id.decode(), int(tenant) if tenant else None, fields[b"kind"].decode(), fields[b"data"]
+
+    def append(self, tenant_id, kind, data):
+        # 配信は読み取りスレッドが行う（自分のワーカーの変更もストリーム経由で届く）
+        entry_id = self._client.xadd(
+            self.stream, self._encode(tenant_id, kind, data), maxlen=self.history_size, approximate=True,
+        )
+        return entry_id.decode()
+
+    def since(self, last_event_id):
+        if _parse_event_id(last_event_id) is None:
+            raise FeedGap(last_event_id)
+        oldest = self._client.xrange(self.stream, count=1)
+        if oldest and _parse_event_id(oldest[0][0].decode()) > _parse_event_id(last_event_id):
+            # 間のイベントが切り詰められた可能性がある
+            raise FeedGap(last_event_id)
+        entries = self._client.xrange(self.stream, min=f"({last_event_id}")
+        return [self._decode(entry_id, fields) for entry_id, fields in entries]
+
+    def start_reader(self):
+        """購読者が現れたときに読み取りスレッドを 1 本だけ起動する"""
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = threading.Thread(target=self._read_loop, name="change-feed-redis", daemon=True)
+                self._reader.start()
+
+    def _read_loop(self):
+        last = "$"
+        while True:
+            try:
+                for _, entries in self._client.xread({self.stream: last}, block=5000, count=100) or []:
+                    for entry_id, fields in entries:
+                        last = entry_id
+                        if self.on_event is not None:
+                            self.on_event(*self._decode(entry_id, fields))
+            except Exception:
+                logger.exception("Change feed reader failed; retrying")
+                time.sleep(1)
+
+    def get_status(self):
+        return {"stream": self.stream, "length": self._client.xlen(self.stream), "history_size": self.history_size}
+
+
+class Subscriber:
+    """1 本の SSE 接続の送信待ちイベント
+
+    配信（publish 側）はキューに積むだけで待たない。max_pending 件を超えたら
+    溜まっていた分を捨てて lagged に印を付け、接続側は reset を送って
+    クライアントに再取得を促す（遅い購読者が他の購読者や書き込みを止めない）。
+    """
+
+    def __init__(self, tenant_id, max_pending):
+        self.tenant_id = tenant_id
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self.lagged_at = None
+        self.dropped = 0
+        self.closed = False
+
+    def deliver(self, item):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += len(self._pending) + 1
+                self._pending.clear()
+                self.lagged_at = item[0]
+            else:
+                self._pending.append(item)
+            self._cond.notify()
+
+    def next_batch(self, timeout):
+        """(lagged_at, イベントの一覧) を返す。timeout 秒何も無ければ (None, [])"""
+        with self._cond:
+            if not self._pending and self.lagged_at is None and not self.closed:
+                self._cond.wait(timeout)
+            lagged_at, self.lagged_at = self.lagged_at, None
+            items = list(self._pending)
+            self._pending.clear()
+            return lagged_at, items
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class ChangeFeed(commit_hooks.CommitHook):
+    """Todo の変更を SSE（GET /todos/stream）の購読者に配信する
+
+    ORM の書き込みは、コミットされた時点でテナントごとに 1 件の changes イベント
+    （作成・更新された Todo と削除された id）になる。書き込み系のルートも
+    ActionParser のハンドラーも同じセッションを通るので、個別に通知する必要はない。
+    一括 UPDATE やアーカイブ・繰り返しタスクなど、1 件ずつの差分にできない変更は
+    invalidate イベント（クライアントは一覧を再取得する）になる。
+    """
+
+    info_key = "change_feed"
+    tables = _INVALIDATING_TABLES | {"todos"}
+
+    def __init__(self):
+        self.enabled = False
+        self.log = None
+        self.max_pending = 256
+        self.max_subscribers = 100
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._stats = {"published": 0, "delivered": 0, "lagged": 0, "rejected": 0}
+
+    def init_app(self, app):
+        kind = os.getenv("CHANGE_FEED_BACKEND", "memory").lower()
+        if kind in ("", "none", "off", "false"):
+            logger.info("Change feed is disabled")
+            return
+        history_size = int(os.getenv("CHANGE_FEED_HISTORY", "1000"))
+        if kind == "redis":
+            self.log = RedisLog(os.getenv("CHANGE_FEED_REDIS_URL", "redis://localhost:6379/0"), history_size)
+        elif kind == "memory":
+            self.log = MemoryLog(history_size)
+        else:
+            raise ValueError(f"unknown CHANGE_FEED_BACKEND: {kind}")
+        self.log.on_event = self._fan_out
+        self.max_pending = int(os.getenv("CHANGE_FEED_MAX_PENDING", "256"))
+        self.max_subscribers = int(os.getenv("CHANGE_FEED_MAX_SUBSCRIBERS", "100"))
+        self.enabled = True
+        commit_hooks.register(self)
+        logger.info("Change feed enabled (%s backend)", self.log.name)
+
+    # ---------- 発行 ----------
+
+    def publish(self, tenant_id, kind, payload):
+        """イベントを記録して購読者に配る（発行できなくても書き込みは失敗させない）"""
+        if not self.enabled:
+            return None
+        try:
+            event_id = self.log.append(tenant_id, kind, dumps(payload))
+        except Exception:
+            logger.exception("Change feed publish failed")
+            return None
+        with self._lock:
+            self._stats["published"] += 1
+        return event_id
+
+    def invalidate_tenant(self, tenant_id=None, reason="bulk"):
+        """テナントの購読者に一覧の再取得を促す（ORM を通らない書き込みの後に呼ぶ）"""
+        return self.publish(current_tenant_id() if tenant_id is None else tenant_id, "invalidate", {"reason": reason})
+
+    def collect_flush(self, session):
+        """フラッシュされた Todo の変更をテナントごとに集める（発行はコミット時）"""
+        for objects, deleted in ((list(session.new) + list(session.dirty), False), (session.deleted, True)):
+            for obj in objects:
+                table = getattr(obj, "__tablename__", None)
+                if table == "todos":
+                    changes = self.pending(session).setdefault(obj.tenant_id or current_tenant_id(), {})
+                    if deleted:
+                        changes[obj.id] = None
+                    elif obj in session.new or session.is_modified(obj, include_collections=False):
+                        changes[obj.id] = _snapshot(obj, obj in session.new)
+                elif table in _INVALIDATING_TABLES:
+                    tenant_id = getattr(obj, "tenant_id", None) or current_tenant_id()
+                    self.pending(session).setdefault(tenant_id, {})[None] = "invalidate"
+
+    def collect_statement(self, session, table, tenant_id):
+        """session.execute() での一括 INSERT / UPDATE / DELETE（対象の行は分からない）"""
+        self.pending(session).setdefault(tenant_id, {})[None] = "invalidate"
+
+    def apply(self, pending):
+        for tenant_id, changes in pending.items():
+            if changes.pop(None, None) == "invalidate":
+                self.publish(tenant_id, "invalidate", {"reason": "bulk"})
+                continue
+            upserted, deleted = [], []
+            for todo_id, todo in changes.items():
+                if todo is None:
+                    deleted.append(todo_id)
+                else:
+                    upserted.append(todo)
+            self.publish(tenant_id, "changes", {"upserted": upserted, "deleted": deleted})
+
+    # ---------- 購読 ----------
+
+    def subscribe(self, tenant_id):
+        """購読者を登録する（上限に達していれば None）"""
+        with self._lock:
+            count = sum(len(subs) for subs in self._subscribers.values())
+            if count >= self.max_subscribers:
+                self._stats["rejected"] += 1
+                return None
+            subscriber = Subscriber(tenant_id, self.max_pending)
+            self._subscribers.setdefault(tenant_id, set()).add(subscriber)
+        if hasattr(self.log, "start_reader"):
+            self.log.start_reader()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            subs = self._subscribers.get(subscriber.tenant_id)
+            if subs is not None:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[subscriber.tenant_id]
+            self._stats["lagged"] += 1 if subscriber.dropped else 0
+
+    def replay(self, tenant_id, last_event_id):
+        """last_event_id より後のテナントのイベント（取りこぼしがあれば FeedGap）"""
+        return [e for e in self.log.since(last_event_id) if e[1] in (tenant_id, ALL_TENANTS)]
+
+    def _fan_out(self, event_id, tenant_id, kind, data):
+        with self._lock:
+            if tenant_id is ALL_TENANTS:
+                targets = [s for subs in self._subscribers.values() for s in subs]
+            else:
+                targets = list(self._subscribers.get(tenant_id, ()))
+            self._stats["delivered"] += len(targets)
+        item = (event_id, kind, data)
+        for subscriber in targets:
+            subscriber.deliver(item)
+
+    def stream(self, subscriber, last_event_id=None, heartbeat=15.0, max_seconds=300.0):
+        """SSE の本文を返すジェネレーター（終了・切断時に購読を解除する）
+
+        Last-Event-ID があればそれ以降のイベントを先に送り直す。残っていなければ
+        reset を送ってクライアントに再取得を促す。購読の登録は呼び出し前に
+        済んでいるので、送り直しと並行して届いたイベントは ID で重複を除く。
+        max_seconds で接続を閉じ、クライアントの自動再接続に任せる（リクエスト
+        スレッドを 1 本の接続が占有し続けないようにする）。
+        """
+        try:
+            replayed = self.replay(subscriber.tenant_id, last_event_id) if last_event_id else []
+            gap = False
+        except FeedGap:
+            replayed, gap = [], True
+        except Exception:
+            logger.exception("Change feed replay failed")
+            replayed, gap = [], True
+
+        def generate():
+            try:
+                yield b"retry: 3000\n\n"
+                newest = _parse_event_id(last_event_id)
+                if gap:
+                    yield _format_event(None, "reset", b'{"reason":"resume_gap"}')
+                for event_id, _, kind, data in replayed:
+                    newest = _parse_event_id(event_id)
+                    yield _format_event(event_id, kind, data)
+
+                deadline = time.monotonic() + max_seconds
+                while time.monotonic() < deadline:
+                    lagged_at, items = subscriber.next_batch(heartbeat)
+                    if lagged_at is not None:
+                        newest = _parse_event_id(lagged_at)
+                        yield _format_event(lagged_at, "reset", b'{"reason":"lagged"}')
+                    elif not items:
+                        yield b": ping\n\n"
+                        continue
+                    for event_id, kind, data in items:
+                        parsed = _parse_event_id(event_id)
+                        if newest is not None and parsed is not None and parsed <= newest:
+                            continue
+                        yield _format_event(event_id, kind, data)
+            finally:
+                self.unsubscribe(subscriber)
+
+        return generate()
+
+    # ---------- 統計 ----------
+
+    def get_status(self):
+        with self._lock:
+            subscribers = [s for subs in self._subscribers.values() for s in subs]
+            stats = dict(self._stats)
+        return {
+            "enabled": self.enabled,
+            "backend": self.log.name if self.log else None,
+            "subscribers": len(subscribers),
+            "max_subscribers": self.max_subscribers,
+            "max_pending": self.max_pending,
+            "dropped_events": sum(s.dropped for s in subscribers),
+            "log": self.log.get_status() if self.log else None,
+            **stats,
+        }
+
+
+change_feed = ChangeFeed()
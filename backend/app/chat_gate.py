@@ -0,0 +1,180 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRejected(Exception):
+    """同時実行数と待ち行列が埋まっている（retry_after 秒後の再試行を促す）"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("client", "event", "granted")
+
+    def __init__(self, client):
+        self.client = client
+        self.event = threading.Event()
+        self.granted = False
+
+
+class ChatGate:
+    """LLM 呼び出しの流量制御（同時実行数の上限・短い待ち行列・クライアント間の公平性）
+
+    LLM の呼び出しは専用の ThreadPoolExecutor（max_in_flight スレッド）で実行するので、
+    同時に外部 API を待つのは最大 max_in_flight 件。空きが無いときは待ち行列に入り、
+    待ち行列（全体 max_queue 件、1 クライアント max_queue_per_client 件）が埋まって
+    いれば即座に ChatRejected（429）になる。待ち時間が queue_timeout を超えた場合も同じ。
+    こうして /chat が占有するリクエストスレッドを max_in_flight + max_queue 本までに
+    抑え、残りのスレッドで Todo の読み書きを処理できるようにする。
+
+    空きができたときはクライアントごとの待ち行列をラウンドロビンで回るので、
+    1 つのクライアントが連投しても他のクライアントの順番は後ろに回されない。
+    """
+
+    def __init__(self, max_in_flight=4, max_queue=8, max_queue_per_client=2, queue_timeout=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout
+        self.enabled = max_in_flight > 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._queues = {}
+        self._rotation = deque()
+        self._queued = 0
+        # Retry-After の見積もりに使う直近の所要時間（指数移動平均、秒）
+        self._service_time = 5.0
+        self._stats = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_timeout": 0, "failed": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_in_flight=int(os.getenv("CHAT_MAX_IN_FLIGHT", "4")),
+            max_queue=int(os.getenv("CHAT_QUEUE_SIZE", "8")),
+            max_queue_per_client=int(os.getenv("CHAT_QUEUE_PER_CLIENT", "2")),
+            queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "5")),
+        )
+
+    # ---------- 実行 ----------
+
+    def run(self, client, func, timeout=None):
+        """空きを待って func() を専用スレッドで実行し、結果を返す
+
+        空きが無く待ち行列にも入れなければ ChatRejected。timeout 秒で結果が
+        返らなければ concurrent.futures.TimeoutError（呼び出し自体は続き、
+        終わった時点で枠を返す）。
+        """
+        if not self.enabled:
+            return func()
+
+        self._acquire(client)
+        started = time.monotonic()
+        try:
+            future = self._get_executor().submit(func)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(lambda f: self._release(time.monotonic() - started, f))
+        return future.result(timeout=timeout)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_in_flight, thread_name_prefix="chat-llm",
+                    )
+        return self._executor
+
+    # ---------- 入場制御 ----------
+
+    def _retry_after(self):
+        """待ち行列が 1 件進むまでのおおよその秒数"""
+        waves = (self._queued + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(self._service_time * waves))
+
+    def _acquire(self, client):
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                return
+
+            queue = self._queues.get(client)
+            if self._queued >= self.max_queue or (queue and len(queue) >= self.max_queue_per_client):
+                self._stats["rejected_full"] += 1
+                raise ChatRejected("chat queue is full", self._retry_after())
+
+            waiter = _Waiter(client)
+            if queue is None:
+                queue = self._queues[client] = deque()
+                self._rotation.append(client)
+            queue.append(waiter)
+            self._queued += 1
+            self._stats["queued"] += 1
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.granted:
+                self._stats["admitted"] += 1
+                return
+            # 時間切れ: 待ち行列から外す
+            queue = self._queues.get(client)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[client]
+                    self._rotation.remove(client)
+            self._stats["rejected_timeout"] += 1
+            raise ChatRejected("timed out waiting for a chat slot", self._retry_after())
+
+    def _release(self, elapsed, future=None):
+        with self._lock:
+            if elapsed is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            if future is not None and future.exception() is not None:
+                self._stats["failed"] += 1
+
+            if not self._rotation:
+                self._in_flight -= 1
+                return
+            # 次のクライアントの先頭に枠をそのまま渡す（in_flight は変わらない）
+            client = self._rotation.popleft()
+            queue = self._queues[client]
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._rotation.append(client)
+            else:
+                del self._queues[client]
+            waiter.granted = True
+            waiter.event.set()
+
+    # ---------- 状態 ----------
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "max_queue_per_client": self.max_queue_per_client,
+                "queue_timeout": self.queue_timeout,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "waiting_clients": len(self._rotation),
+                "service_time_s": round(self._service_time, 3),
+                **self._stats,
+            }
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken が無い環境では文字種からの概算にフォールバック
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# OpenAI のチャット形式で 1 メッセージごとに加わるトークン数（role・区切り）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "これまでの会話の要約（古いやり取りを圧縮したもの）:"
+
+_CJK = re.compile(r"[　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+_WORD = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_　-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+_CODE_BLOCK = re.compile(r"```.*?```", re.S)
+
+
+class TokenCounter:
+    """ローカルでのトークン数の計算（tiktoken があれば使い、無ければ概算）
+
+    概算は、かな・漢字を 1 文字 1 トークン、英数字の並びを 4 文字ごとに 1 トークン、
+    記号を 1 トークンとして数える（日本語中心の会話で実際の値よりやや多めになる）。
+    """
+
+    def __init__(self, model=None):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+            except (KeyError, ValueError):
+                self._encoding = tiktoken.get_encoding("o200k_base")
+
+    @property
+    def exact(self):
+        return self._encoding is not None
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        tokens = len(_CJK.findall(text))
+        for word in _WORD.findall(text):
+            tokens += (len(word) + 3) // 4
+        return tokens
+
+    def count_message(self, message):
+        return MESSAGE_OVERHEAD_TOKENS + self.count_text(message.get("content") or "")
+
+    def count_messages(self, messages):
+        return sum(self.count_message(m) for m in messages)
+
+
+def extractive_summary(previous, messages, counter, budget):
+    """前回の要約に、新しく畳み込むメッセージの要点（各メッセージの冒頭）を追記する
+
+    コードブロック（アクションの JSON など）は除き、1 メッセージ 1 行にする。
+    budget を超える場合は古い行から捨てる（直近のやり取りほど残る）。
+    """
+    lines = previous.splitlines() if previous else []
+    for message in messages:
+        content = _CODE_BLOCK.sub(" ", message.get("content") or "")
+        content = " ".join(content.split())
+        if not content:
+            continue
+        label = "ユーザー" if message.get("role") == "user" else "アシスタント"
+        lines.append(f"- {label}: {content[:120]}{'…' if len(content) > 120 else ''}")
+
+    while len(lines) > 1 and counter.count_text("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class HistoryCompactor:
+    """/chat に送る会話履歴をトークン予算内に収める
+
+    直近のメッセージは最低 keep_recent 件をそのまま残し、予算に収まる範囲で
+    さらに遡って残す。それより古いメッセージは要約（system メッセージ 1 件）に
+    畳み込む。要約は畳み込んだ範囲の先頭からのハッシュ連鎖をキーにキャッシュし、
+    次のターンでは前回までの要約に新しく畳み込む分だけを追加するので、
+    会話が伸びても要約を最初から作り直すことはない。
+    """
+
+    def __init__(self, budget=3000, keep_recent=6, summary_budget=500, cache_size=1024, counter=None):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.summary_budget = summary_budget
+        self.cache_size = cache_size
+        self.counter = counter or TokenCounter()
+        self._lock = threading.Lock()
+        self._summaries = OrderedDict()
+        self._stats = {
+            "requests": 0,
+            "compacted": 0,
+            "original_tokens": 0,
+            "sent_tokens": 0,
+            "summary_hits": 0,
+            "summary_extended": 0,
+            "summary_built": 0,
+        }
+
+    @classmethod
+    def from_env(cls, model=None):
+        return cls(
+            budget=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000")),
+            keep_recent=int(os.getenv("CHAT_HISTORY_KEEP_RECENT", "6")),
+            summary_budget=int(os.getenv("CHAT_HISTORY_SUMMARY_TOKENS", "500")),
+            cache_size=int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "1024")),
+            counter=TokenCounter(model),
+        )
+
+    # ---------- 圧縮 ----------
+
+    def _split_point(self, messages, costs):
+        """そのまま残す末尾の開始位置（keep_recent 件 + 予算の残りで遡れるところまで）"""
+        start = max(len(messages) - self.keep_recent, 0)
+        used = sum(costs[start:])
+        # 要約を入れる分の予算を先に確保する
+        room = self.budget - self.summary_budget - MESSAGE_OVERHEAD_TOKENS
+        while start > 0 and used + costs[start - 1] <= room:
+            start -= 1
+            used += costs[start]
+        # 会話の途中で切らないよう、残す範囲はユーザーの発言から始める
+        while 0 < start < len(messages) and messages[start].get("role") != "user":
+            start += 1
+        return start if start < len(messages) else max(len(messages) - 1, 0)
+
+    def compact(self, messages, namespace="", summarizer=None):
+        """(送るメッセージ, 統計) を返す。予算内なら messages をそのまま返す
+
+        namespace はキャッシュをテナント等で分けるためのキー。
+        summarizer(previous_summary, new_messages) を渡すと要約の作り方を差し替えられる
+        （失敗したら抜粋による要約に戻る）。
+        """
+        costs = [self.counter.count_message(m) for m in messages]
+        original = sum(costs)
+        if original <= self.budget or len(messages) <= self.keep_recent:
+            self._record(original, original, compacted=False)
+            return messages, {"original_tokens": original, "sent_tokens": original, "folded_messages": 0}
+
+        split = self._split_point(messages, costs)
+        folded, recent = messages[:split], messages[split:]
+        summary = self._summary_for(folded, namespace, summarizer)
+        compacted = [{"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}] + list(recent)
+        sent = self.counter.count_messages(compacted)
+        self._record(original, sent, compacted=True)
+        return compacted, {"original_tokens": original, "sent_tokens": sent, "folded_messages": len(folded)}
+
+    def _summary_for(self, folded, namespace, summarizer):
+        # 先頭からのハッシュ連鎖: chain[i] は folded[:i+1] を表す
+        digest = hashlib.sha256(namespace.encode("utf-8"))
+        chain = []
+        for message in folded:
+            digest.update(b"\x00" + (message.get("role") or "").encode("utf-8") + b"\x01")
+            digest.update((message.get("content") or "").encode("utf-8"))
+            chain.append(digest.copy().hexdigest())
+
+        with self._lock:
+            cached_at, previous = -1, ""
+            for i in range(len(chain) - 1, -1, -1):
+                if chain[i] in self._summaries:
+                    cached_at, previous = i, self._summaries[chain[i]]
+                    self._summaries.move_to_end(chain[i])
+                    break
+            if cached_at == len(chain) - 1:
+                self._stats["summary_hits"] += 1
+                return previous
+
+        new_messages = folded[cached_at + 1:]
+        summary = None
+        if summarizer is not None:
+            try:
+                summary = summarizer(previous, new_messages)
+            except Exception:
+                logger.exception("Chat history summarizer failed; using extractive summary")
+        if not summary:
+            summary = extractive_summary(previous, new_messages, self.counter, self.summary_budget)
+
+        with self._lock:
+            self._stats["summary_extended" if cached_at >= 0 else "summary_built"] += 1
+            self._summaries[chain[-1]] = summary
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+        return summary
+
+    # ---------- 統計 ----------
+
+    def _record(self, original, sent, compacted):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["compacted"] += 1 if compacted else 0
+            self._stats["original_tokens"] += original
+            self._stats["sent_tokens"] += sent
+
+    def get_status(self):
+        with self._lock:
+            stats = dict(self._stats)
+            cached = len(self._summaries)
+        saved = stats["original_tokens"] - stats["sent_tokens"]
+        return {
+            "budget": self.budget,
+            "keep_recent": self.keep_recent,
+            "summary_budget": self.summary_budget,
+            "exact_token_count": self.counter.exact,
+            "cached_summaries": cached,
+            "saved_tokens": saved,
+            "saved_ratio": round(saved / stats["original_tokens"], 4) if stats["original_tokens"] else None,
+            **stats,
+        }
@@ -0,0 +1,91 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .tenancy import current_tenant_id
+
+# テナントを問わない一括書き込み（collect_statement に渡す tenant_id）
+ALL_TENANTS = None
+
+_hooks = []
+
+
+class CommitHook:
+    """書き込みをコミット時に反映するコンポーネント（一覧キャッシュ・変更フィード・重複索引）の基底クラス
+
+    フラッシュと session.execute() の一括書き込みで変わった内容を session.info[info_key] に
+    集めておき、コミットされたら apply() に渡す。ロールバックされたら捨てる。
+    サブクラスは info_key と tables を決め、collect_flush / collect_statement / apply を実装する。
+    """
+
+    # session.info に変更を溜めるキー
+    info_key = None
+    # 一括 INSERT / UPDATE / DELETE を collect_statement に渡すテーブル
+    tables = frozenset()
+    enabled = False
+
+    def new_pending(self):
+        return {}
+
+    def pending(self, session):
+        pending = session.info.get(self.info_key)
+        if pending is None:
+            pending = session.info[self.info_key] = self.new_pending()
+        return pending
+
+    def collect_flush(self, session):
+        """フラッシュされたオブジェクトの変更を pending(session) に集める"""
+
+    def collect_statement(self, session, table, tenant_id):
+        """一括書き込み（対象の行は分からない）を pending(session) に記録する
+
+        tenant_id はテナントで絞られた ORM の文なら現在のテナント、それ以外は ALL_TENANTS。
+        """
+
+    def apply(self, pending):
+        """コミットされた変更を反映する"""
+
+
+def register(hook):
+    """hook を登録し、Session のイベントを設定する（アプリを複数回生成しても 1 回だけ）"""
+    if hook not in _hooks:
+        _hooks.append(hook)
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
+        event.listen(Session, "do_orm_execute", _do_orm_execute)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_soft_rollback", _after_soft_rollback)
+
+
+def _after_flush(session, flush_context):
+    for hook in _hooks:
+        if hook.enabled:
+            hook.collect_flush(session)
+
+
+def _do_orm_execute(execute_state):
+    """session.execute() での一括 INSERT / UPDATE / DELETE"""
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    table = getattr(getattr(execute_state.statement, "table", None), "name", None)
+    hooks = [hook for hook in _hooks if hook.enabled and table in hook.tables]
+    if not hooks:
+        return
+    if execute_state.is_orm_statement and not execute_state.execution_options.get("all_tenants", False):
+        # ORM のエンティティに対する文はテナントで絞られている
+        tenant_id = current_tenant_id()
+    else:
+        tenant_id = ALL_TENANTS
+    for hook in hooks:
+        hook.collect_statement(execute_state.session, table, tenant_id)
+
+
+def _after_commit(session):
+    for hook in _hooks:
+        pending = session.info.pop(hook.info_key, None)
+        if pending and hook.enabled:
+            hook.apply(pending)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        for hook in _hooks:
+            session.info.pop(hook.info_key, None)
@@ -0,0 +1,347 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import unicodedata
+from collections import Counter
+from sqlalchemy import select
+from . import commit_hooks, db
+from .tenancy import current_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# 重複の扱い: off（調べない）/ flag（作成して印を付ける）/ skip（作成しない）
+MODES = ("off", "flag", "skip")
+
+# 候補の確認クエリ 1 回あたりの id 数（SQLite のパラメーター数の上限より十分小さく）
+VERIFY_CHUNK_SIZE = 500
+
+# 言い回しの違いになりやすい助詞と語尾（「資料の作成」と「資料を作成する」を同じにする）
+_PARTICLES = frozenset("のをにへがはとでもや")
+_SUFFIXES = ("します", "する")
+
+
+def normalize_title(title):
+    """比較用の正規化（全角・半角と大文字・小文字を揃え、空白・記号・助詞・語尾の「する」を除く）"""
+    text = unicodedata.normalize("NFKC", title or "").lower()
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] in "LN")
+    for suffix in _SUFFIXES:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            text = text[:-len(suffix)]
+            break
+    # 助詞だけでできたタイトル（「のに」など）は消さずにそのまま比べる
+    return "".join(ch for ch in text if ch not in _PARTICLES) or text
+
+
+class MinHashLSH:
+    """文字 n-gram の MinHash + LSH（バンド分割）による近似重複の索引
+
+    正規化したタイトルを n 文字ずつの集合（shingle）にし、bands × rows 個の MinHash を
+    1 つの署名にする。署名を bands 個に分けたそれぞれをバケットのキーにして、
+    どれか 1 バンドでも一致したものだけを候補として Jaccard 係数を正確に計算する。
+    1 件の検索は全件ではなく候補の数に比例するので、件数が増えてもほぼ一定の時間で済む。
+
+    MinHash は shingle ごとに blake2b のダイジェストを 16 ビットずつに区切って
+    bands × rows 個のハッシュ値として使う（shingle ごとの値はキャッシュする）。
+    """
+
+    def __init__(self, ngram=2, bands=8, rows=2, threshold=0.5, max_candidates=200):
+        if bands * rows > 32:
+            raise ValueError("bands * rows must be at most 32")
+        self.ngram = ngram
+        self.bands = bands
+        self.rows = rows
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self._hashes = bands * rows
+        self._format = f"<{self._hashes}H"
+        self._shingle_cache = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._titles = {}
+
+    def __len__(self):
+        return len(self._titles)
+
+    def shingles(self, normalized):
+        n = self.ngram
+        if len(normalized) <= n:
+            return frozenset([normalized]) if normalized else frozenset()
+        return frozenset(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+    def _shingle_hashes(self, shingle):
+        cached = self._shingle_cache.get(shingle)
+        if cached is None:
+            if len(self._shingle_cache) >= 1_000_000:
+                self._shingle_cache.clear()
+            digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=self._hashes * 2).digest()
+            cached = self._shingle_cache[shingle] = struct.unpack(self._format, digest)
+        return cached
+
+    def _band_keys(self, shingles):
+        if not shingles:
+            return []
+        signature = list(map(min, zip(*(self._shingle_hashes(s) for s in shingles))))
+        rows = self.rows
+        return [tuple(signature[b * rows:(b + 1) * rows]) for b in range(self.bands)]
+
+    def add(self, key, title):
+        normalized = normalize_title(title)
+        if key in self._titles:
+            if self._titles[key] == normalized:
+                return
+            self.remove(key)
+        self._titles[key] = normalized
+        for bucket, band_key in zip(self._buckets, self._band_keys(self.shingles(normalized))):
+            members = bucket.get(band_key)
+            # ほとんどのバケットは 1 件なので、2 件目からセットにする
+            if members is None:
+                bucket[band_key] = key
+            elif isinstance(members, set):
+                members.add(key)
+            else:
+                bucket[band_key] = {members, key}
+
+    def remove(self, key):
+        normalized = self._titles.pop(key, None)
+        if normalized is None:
+            return
+        for bucket, band_key in zip(self._buckets, self._band_keys(self.shingles(normalized))):
+            members = bucket.get(band_key)
+            if members == key:
+                del bucket[band_key]
+            elif isinstance(members, set):
+                members.discard(key)
+                if len(members) == 1:
+                    bucket[band_key] = next(iter(members))
+
+    def query(self, title, limit=5):
+        """類似度が threshold 以上の (key, 類似度) を類似度の高い順に返す"""
+        normalized = normalize_title(title)
+        shingles = self.shingles(normalized)
+        if not shingles:
+            return []
+
+        hits = Counter()
+        for bucket, band_key in zip(self._buckets, self._band_keys(shingles)):
+            members = bucket.get(band_key)
+            if members is None:
+                continue
+            if isinstance(members, set):
+                hits.update(members)
+            else:
+                hits[members] += 1
+
+        matches = []
+        # 一致したバンドが多い（推定類似度が高い）候補から max_candidates 件だけ確かめる
+        for key, _ in hits.most_common(self.max_candidates):
+            other = self._titles[key]
+            if other == normalized:
+                matches.append((key, 1.0))
+                continue
+            other_shingles = self.shingles(other)
+            similarity = len(shingles & other_shingles) / len(shingles | other_shingles)
+            if similarity >= self.threshold:
+                matches.append((key, round(similarity, 3)))
+        matches.sort(key=lambda m: (-m[1], m[0]))
+        return matches[:limit]
+
+
+class _TenantIndex:
+    def __init__(self, lsh):
+        self.lsh = lsh
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class DuplicateIndex(commit_hooks.CommitHook):
+    """テナントごとの未完了タスクのタイトルの近似重複索引
+
+    索引は最初に使われたときにテナントの未完了タスクから作り、以後は ORM の
+    書き込み（作成・タイトル変更・完了・削除）をコミット時に差分で反映する。
+    一括 UPDATE などで差分が分からない場合はそのテナントの索引を捨てて作り直す。
+    他のワーカーでの書き込みは反映されないので、DEDUPE_REBUILD_SECONDS ごとに作り直す。
+    重複と判定した相手は DB で未完了のまま残っているかを確かめてから返す。
+    """
+
+    info_key = "dedupe_changes"
+    tables = frozenset({"todos"})
+
+    def __init__(self):
+        self.enabled = False
+        self.mode = "flag"
+        self.chat_mode = "skip"
+        self._lock = threading.Lock()
+        self._tenants = {}
+        self._settings = {}
+        self.rebuild_seconds = 600
+        self._stats = {"queries": 0, "duplicates": 0, "builds": 0, "build_seconds": 0.0, "invalidations": 0}
+
+    def init_app(self, app):
+        self.enabled = False
+        with self._lock:
+            self._tenants.clear()
+        if os.getenv("DEDUPE_ENABLED", "true").lower() in ("0", "false", "no", "off"):
+            logger.info("Duplicate detection is disabled")
+            return
+        self.mode = os.getenv("DEDUPE_MODE", "flag").lower()
+        self.chat_mode = os.getenv("DEDUPE_CHAT_MODE", "skip").lower()
+        for name, value in (("DEDUPE_MODE", self.mode), ("DEDUPE_CHAT_MODE", self.chat_mode)):
+            if value not in MODES:
+                raise ValueError(f"unknown {name}: {value}")
+        self._settings = {
+            "ngram": int(os.getenv("DEDUPE_NGRAM", "2")),
+            "bands": int(os.getenv("DEDUPE_BANDS", "8")),
+            "rows": int(os.getenv("DEDUPE_ROWS", "2")),
+            "threshold": float(os.getenv("DEDUPE_THRESHOLD", "0.5")),
+            "max_candidates": int(os.getenv("DEDUPE_MAX_CANDIDATES", "200")),
+        }
+        self.rebuild_seconds = float(os.getenv("DEDUPE_REBUILD_SECONDS", "600"))
+        self.enabled = True
+        commit_hooks.register(self)
+
+    def make_lsh(self):
+        return MinHashLSH(**self._settings)
+
+    # ---------- 検索 ----------
+
+    def _tenant_index(self, tenant_id):
+        with self._lock:
+            index = self._tenants.get(tenant_id)
+            if index is not None and time.monotonic() - index.built_at < self.rebuild_seconds:
+                return index
+
+        from .models import Todo
+
+        started = time.perf_counter()
+        lsh = self.make_lsh()
+        rows = db.session.execute(select(Todo.id, Todo.title).where(Todo.done.is_not(True)))
+        for todo_id, title in rows:
+            lsh.add(todo_id, title)
+        elapsed = time.perf_counter() - started
+        logger.info("Built duplicate index for tenant %s: %d titles in %.3fs", tenant_id, len(lsh), elapsed)
+
+        index = _TenantIndex(lsh)
+        with self._lock:
+            self._tenants[tenant_id] = index
+            self._stats["builds"] += 1
+            self._stats["build_seconds"] += elapsed
+        return index
+
+    def check_batch(self, titles):
+        """titles それぞれについて重複の相手 {"id", "title", "similarity"} か None を返す
+
+        現在のテナントの未完了タスクに似たものが無ければ、同じ一括作成の中の
+        先行するタイトルと比べる（その場合 id は None）。索引から得た候補は
+        まとめて 1 回のクエリで未完了のまま残っているかを確かめる。
+        """
+        if not self.enabled or not titles:
+            return [None] * len(titles)
+        from .models import Todo
+
+        index = self._tenant_index(current_tenant_id())
+        with index.lock:
+            found = [index.lsh.query(title) for title in titles]
+
+        # 索引が古い可能性があるので、候補が未完了のまま残っているかを確かめる
+        candidate_ids = sorted({todo_id for matches in found for todo_id, _ in matches})
+        open_titles = {}
+        with db.session.no_autoflush:
+            for start in range(0, len(candidate_ids), VERIFY_CHUNK_SIZE):
+                chunk = candidate_ids[start:start + VERIFY_CHUNK_SIZE]
+                open_titles.update(db.session.execute(
+                    select(Todo.id, Todo.title).where(Todo.id.in_(chunk), Todo.done.is_not(True))
+                ).all())
+
+        results = []
+        batch = self.make_lsh()
+        for position, (title, matches) in enumerate(zip(titles, found)):
+            match = next((
+                {"id": todo_id, "title": open_titles[todo_id], "similarity": similarity}
+                for todo_id, similarity in matches if todo_id in open_titles
+            ), None)
+            if match is None:
+                for earlier, similarity in batch.query(title, limit=1):
+                    match = {"id": None, "title": titles[earlier], "similarity": similarity}
+            batch.add(position, title)
+            results.append(match)
+
+        with self._lock:
+            self._stats["queries"] += len(titles)
+            self._stats["duplicates"] += sum(match is not None for match in results)
+        return results
+
+    # ---------- 差分の反映 ----------
+
+    def collect_flush(self, session):
+        """フラッシュされた Todo の変更を集める（反映はコミット時）"""
+        for objects, deleted in ((list(session.new) + list(session.dirty), False), (session.deleted, True)):
+            for obj in objects:
+                if getattr(obj, "__tablename__", None) != "todos":
+                    continue
+                key = (obj.tenant_id or current_tenant_id(), obj.id)
+                if deleted:
+                    self.pending(session)[key] = None
+                    continue
+                if obj not in session.new and not session.is_modified(obj, include_collections=False):
+                    continue
+                values = obj.__dict__
+                if "title" not in values or ("done" not in values and obj not in session.new):
+                    # 読み込まれていない属性は取りに行かず、その Todo を索引から外すだけにする
+                    self.pending(session)[key] = None
+                else:
+                    self.pending(session)[key] = None if values.get("done") else values["title"]
+
+    def collect_statement(self, session, table, tenant_id):
+        """session.execute() での一括 INSERT / UPDATE / DELETE（そのテナントの索引を捨てる）"""
+        self.pending(session)[(tenant_id, None)] = "invalidate"
+
+    def apply(self, changes):
+        for (tenant_id, todo_id), title in changes.items():
+            if todo_id is None:
+                if tenant_id is commit_hooks.ALL_TENANTS:
+                    self.clear()
+                else:
+                    self.invalidate_tenant(tenant_id)
+                continue
+            with self._lock:
+                index = self._tenants.get(tenant_id)
+            if index is None:
+                continue
+            with index.lock:
+                if title is None:
+                    index.lsh.remove(todo_id)
+                else:
+                    index.lsh.add(todo_id, title)
+
+    def invalidate_tenant(self, tenant_id=None):
+        """テナント（省略時は現在のテナント）の索引を捨てる（ORM を通らない書き込みの後に呼ぶ）"""
+        with self._lock:
+            self._tenants.pop(current_tenant_id() if tenant_id is None else tenant_id, None)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._tenants.clear()
+            self._stats["invalidations"] += 1
+
+    # ---------- 統計 ----------
+
+    def get_status(self):
+        with self._lock:
+            tenants = {str(tid): len(index.lsh) for tid, index in self._tenants.items()}
+            stats = dict(self._stats)
+        stats["build_seconds"] = round(stats["build_seconds"], 3)
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "chat_mode": self.chat_mode,
+            "settings": self._settings,
+            "rebuild_seconds": self.rebuild_seconds,
+            "indexed_titles": tenants,
+            **stats,
+        }
+
+
+duplicate_index = DuplicateIndex()
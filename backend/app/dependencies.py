@@ -0,0 +1,329 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from sqlalchemy import delete, event, insert, or_, select, update
+from sqlalchemy.orm import aliased
+from . import db
+from .models import Todo, TodoDependency, TodoDependencyVersion
+from .serializers import todo_columns
+
+logger = logging.getLogger(__name__)
+
+# 他のプロセスと同時に依存関係を変更した場合のやり直し回数
+MAX_RETRIES = 3
+
+
+class DependencyCycleError(ValueError):
+    """依存関係を追加すると閉路になる場合のエラー（path は閉路のタスク ID 列）"""
+
+    def __init__(self, path):
+        self.path = path
+        super().__init__("dependency would create a cycle: " + " -> ".join(str(n) for n in path))
+
+
+class DependencyConflictError(RuntimeError):
+    """他のプロセスの変更と競合し続けて依存関係を追加できなかった"""
+
+
+class DependencyGraph:
+    """依存関係の隣接リストと位相順序のプロセス内キャッシュ
+
+    todo_dependency_version の値が手元の version と一致する間は DB を読み直さない。
+    辺を追加するときは Pearce–Kelly の動的トポロジカル順序で、順序が逆転する
+    区間のノードだけを探索して閉路の検出と順序の修正を行う（グラフ全体は見ない）。
+    辺の削除で位相順序が壊れることはないので、削除は隣接リストから外すだけ。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._succ = defaultdict(set)
+        self._pred = defaultdict(set)
+        self._order = {}
+        self._next_order = 0
+
+    # ---------- キャッシュ ----------
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        version = db.session.execute(
+            select(TodoDependencyVersion.version).where(TodoDependencyVersion.id == 1)
+        ).scalar() or 0
+        if version != self._version:
+            self._load(version)
+
+    def _load(self, version):
+        succ = defaultdict(set)
+        pred = defaultdict(set)
+        for blocker, blocked in db.session.execute(select(TodoDependency.blocker_id, TodoDependency.blocked_id)):
+            succ[blocker].add(blocked)
+            pred[blocked].add(blocker)
+
+        # 初期の位相順序は Kahn 法で決める
+        nodes = set(succ) | set(pred)
+        indegree = {node: len(pred.get(node, ())) for node in nodes}
+        queue = deque(sorted(node for node, degree in indegree.items() if degree == 0))
+        order = {}
+        while queue:
+            node = queue.popleft()
+            order[node] = len(order)
+            for successor in succ.get(node, ()):
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    queue.append(successor)
+        if len(order) < len(nodes):
+            logger.error("Dependency graph contains a cycle (%d tasks)", len(nodes) - len(order))
+            for node in sorted(nodes - set(order)):
+                order[node] = len(order)
+
+        self._succ, self._pred, self._order = succ, pred, order
+        self._next_order = len(order)
+        self._version = version
+        logger.info("Loaded dependency graph: %d tasks, %d edges (version %d)",
+                    len(nodes), sum(len(s) for s in succ.values()), version)
+
+    # ---------- Pearce–Kelly ----------
+
+    def _node_order(self, node):
+        if node not in self._order:
+            self._order[node] = self._next_order
+            self._next_order += 1
+        return self._order[node]
+
+    def _insert_edge(self, blocker, blocked):
+        """キャッシュに辺を追加し、位相順序を保つ（既にあれば False）"""
+        if blocker == blocked:
+            raise DependencyCycleError([blocker, blocked])
+        if blocked in self._succ.get(blocker, ()):
+            return False
+
+        lower, upper = self._node_order(blocked), self._node_order(blocker)
+        if lower < upper:
+            # blocked が blocker より前に並んでいる: 区間 [lower, upper] だけを探索する
+            forward = self._search_forward(blocked, upper, blocker)
+            backward = self._search_backward(blocker, lower)
+            self._reorder(backward, forward)
+
+        self._succ[blocker].add(blocked)
+        self._pred[blocked].add(blocker)
+        return True
+
+    def _search_forward(self, start, upper, target):
+        """start から後続を辿る（順序が upper 未満のノードのみ）。target に届けば閉路"""
+        parents = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for successor in self._succ.get(node, ()):
+                if successor == target:
+                    path = [node]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    raise DependencyCycleError([target] + path[::-1] + [target])
+                if successor not in parents and self._order[successor] < upper:
+                    parents[successor] = node
+                    stack.append(successor)
+        return list(parents)
+
+    def _search_backward(self, start, lower):
+        """start から先行を辿る（順序が lower より大きいノードのみ）"""
+        visited = {start}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for predecessor in self._pred.get(node, ()):
+                if predecessor not in visited and self._order[predecessor] > lower:
+                    visited.add(predecessor)
+                    stack.append(predecessor)
+        return list(visited)
+
+    def _reorder(self, backward, forward):
+        """探索したノードの順序番号を並べ替え、backward 側を forward 側より前にする"""
+        nodes = sorted(backward, key=self._order.get) + sorted(forward, key=self._order.get)
+        slots = sorted(self._order[node] for node in nodes)
+        for node, slot in zip(nodes, slots):
+            self._order[node] = slot
+
+    # ---------- 変更 ----------
+
+    def add_edges(self, edges, commit=True):
+        """依存関係 (blocker_id, blocked_id) を追加し、新しく追加した組を返す
+
+        閉路になる場合は DependencyCycleError（何も書き込まない）。
+        commit=False のときは呼び出し側のトランザクションに含め、キャッシュは次回読み直す。
+        """
+        edges = list(dict.fromkeys(edges))
+        with self._lock:
+            for _ in range(MAX_RETRIES):
+                self._ensure_fresh()
+                expected = self._version
+                try:
+                    added = [edge for edge in edges if self._insert_edge(*edge)]
+                except DependencyCycleError:
+                    # 途中まで追加した辺を捨てる
+                    self._version = None
+                    raise
+                if not added:
+                    return []
+
+                try:
+                    db.session.execute(insert(TodoDependency), [
+                        {"blocker_id": blocker, "blocked_id": blocked} for blocker, blocked in added
+                    ])
+                    if not commit:
+                        _bump_version(db.session.connection())
+                        self._version = None
+                        return added
+                    if _bump_version(db.session.connection(), expected):
+                        db.session.commit()
+                        self._version = expected + 1
+                        return added
+                    db.session.rollback()
+                except Exception:
+                    db.session.rollback()
+                    self._version = None
+                    raise
+                # 他のプロセスが先に依存関係を変更した: 読み直して判定し直す
+                self._version = None
+        raise DependencyConflictError("dependency graph changed concurrently")
+
+    def remove_edge(self, blocker, blocked):
+        """依存関係を削除する（存在しなければ False）"""
+        with self._lock:
+            self._ensure_fresh()
+            expected = self._version
+            result = db.session.execute(delete(TodoDependency).where(
+                TodoDependency.blocker_id == blocker, TodoDependency.blocked_id == blocked,
+            ))
+            if not result.rowcount:
+                db.session.rollback()
+                return False
+
+            matched = _bump_version(db.session.connection(), expected)
+            if not matched:
+                _bump_version(db.session.connection())
+            db.session.commit()
+            if matched:
+                self._succ[blocker].discard(blocked)
+                self._pred[blocked].discard(blocker)
+                self._version = expected + 1
+            else:
+                self._version = None
+            return True
+
+    # ---------- 参照 ----------
+
+    def neighbours(self, todo_id):
+        """(このタスクをブロックしているタスク, このタスクがブロックしているタスク)"""
+        with self._lock:
+            self._ensure_fresh()
+            return sorted(self._pred.get(todo_id, ())), sorted(self._succ.get(todo_id, ()))
+
+    def critical_path(self, root_id, default_minutes):
+        """root_id 配下（サブタスクを再帰的に含む）の未完了タスクのクリティカルパス
+
+        見積もり時間（未設定は default_minutes）の合計が最大になる依存関係の経路を返す。
+        サブタスクを持つタスクはまとめ役とみなして経路に含めない。
+        キャッシュの位相順序で並べて 1 回走査するので O(V log V + E)。
+        """
+        subtree = select(Todo.id).where(Todo.id == root_id).cte("subtree", recursive=True)
+        child = aliased(Todo)
+        subtree = subtree.union_all(select(child.id).where(child.parent_id == subtree.c.id))
+        rows = db.session.execute(
+            select(Todo.id, Todo.title, Todo.parent_id, Todo.estimated_minutes)
+            .where(Todo.id.in_(select(subtree.c.id)), Todo.done.is_not(True))
+        ).all()
+        containers = {row.parent_id for row in rows}
+        tasks = {row.id: row for row in rows if row.id not in containers}
+
+        with self._lock:
+            self._ensure_fresh()
+            best = {}
+            previous = {}
+            for node in sorted(tasks, key=lambda n: self._order.get(n, -1)):
+                row = tasks[node]
+                minutes = row.estimated_minutes if row.estimated_minutes is not None else default_minutes
+                before = max(((best[p], p) for p in self._pred.get(node, ()) if p in best), default=None)
+                best[node] = minutes + (before[0] if before else 0)
+                previous[node] = before[1] if before else None
+
+        if not best:
+            return [], 0
+        node = max(best, key=lambda n: (best[n], -n))
+        total = best[node]
+        path = []
+        while node is not None:
+            path.append(tasks[node])
+            node = previous[node]
+        return path[::-1], total
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "version": self._version,
+                "tasks": len(self._order),
+                "edges": sum(len(s) for s in self._succ.values()),
+            }
+
+
+def _bump_version(connection, expected=None):
+    """依存関係の変更回数を 1 増やす（expected 指定時は一致した場合だけ）"""
+    table = TodoDependencyVersion.__table__
+    query = update(table).where(table.c.id == 1).values(version=table.c.version + 1)
+    if expected is not None:
+        query = query.where(table.c.version == expected)
+    if connection.execute(query).rowcount:
+        return True
+    if connection.execute(select(table.c.version).where(table.c.id == 1)).first() is not None:
+        return False
+    # 初回の変更（まだ行が無い）
+    connection.execute(insert(table).values(id=1, version=1))
+    return True
+
+
+graph = DependencyGraph()
+
+
+def remove_dependencies_of(connection, todo_ids):
+    """todo_ids のタスクが関わる依存関係を削除する（呼び出し側のトランザクション内）
+
+    ORM を通さずにタスクを消す処理（アーカイブなど）は、同じトランザクションでこれを呼ぶ。
+    """
+    table = TodoDependency.__table__
+    result = connection.execute(delete(table).where(
+        or_(table.c.blocker_id.in_(todo_ids), table.c.blocked_id.in_(todo_ids))
+    ))
+    if result.rowcount:
+        _bump_version(connection)
+
+
+@event.listens_for(Todo, "after_delete")
+def _remove_dependencies_of_deleted_todo(mapper, connection, target):
+    """タスクの削除と同じトランザクションで、そのタスクの依存関係も削除する"""
+    remove_dependencies_of(connection, [target.id])
+
+
+def unblocked_todos(limit, offset=0):
+    """未完了のブロッカーが 1 つも無い未完了タスク（期日 → 優先度の順）
+
+    完了状態は頻繁に変わるのでキャッシュせず、依存関係のインデックスを使った
+    NOT EXISTS で DB に問い合わせる。
+    """
+    blocker = aliased(Todo)
+    blocked = (
+        select(TodoDependency.id)
+        .join(blocker, blocker.id == TodoDependency.blocker_id)
+        .where(TodoDependency.blocked_id == Todo.id, blocker.done.is_not(True))
+        .exists()
+    )
+    query = (
+        select(*todo_columns(Todo))
+        .where(Todo.done.is_not(True), ~blocked)
+        .order_by(Todo.date.is_(None), Todo.date, Todo.priority.desc(), Todo.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    return db.session.execute(query).all()
@@ -0,0 +1,176 @@
+import hashlib
+import hmac
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import select
+from . import db, recurrence
+from .cache import read_cache
+from .models import Todo
+from .tenancy import current_tenant_id
+
+# component クエリと iCalendar のコンポーネント名
+COMPONENTS = {"event": "VEVENT", "todo": "VTODO"}
+
+PRODID = "-//todo-scheduler//Todo Scheduler//JA"
+
+
+def _escape(text):
+    """TEXT 値のエスケープ（RFC 5545 3.3.11）"""
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line):
+    """75 オクテットを超える行を折り返す（マルチバイト文字の途中では切らない）"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return encoded + b"\r\n"
+    parts, current, size = [], [], 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        # 2 行目以降は先頭の空白 1 オクテットを含めて 75 オクテット
+        if size + width > (75 if not parts else 74):
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts).encode("utf-8") + b"\r\n"
+
+
+def _lines(lines):
+    return b"".join(_fold(line) for line in lines)
+
+
+def _ical_date(value):
+    return value.strftime("%Y%m%d")
+
+
+def _ical_priority(priority):
+    """アプリの優先度（0: なし、大きいほど重要）を iCalendar の PRIORITY（1 が最高、9 が最低）に変換
+
+    範囲外（負の値や整数以外）の優先度は 0（未定義）として出力する。
+    """
+    if isinstance(priority, bool) or not isinstance(priority, int) or priority <= 0:
+        return 0
+    return min(9, max(1, 10 - 3 * priority))
+
+
+def month_segments(today, past_months, future_months):
+    """今月を基準に past_months か月前〜future_months か月後の月ごとの (初日, 末日)"""
+    year, month = today.year, today.month - past_months
+    while month < 1:
+        year, month = year - 1, month + 12
+    segments = []
+    for _ in range(past_months + future_months + 1):
+        start = date(year, month, 1)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        segments.append((start, date(year, month, 1) - timedelta(days=1)))
+    return segments
+
+
+def header(name):
+    return _lines([
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+        # 購読側に更新間隔の目安を伝える
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M",
+        "X-PUBLISHED-TTL:PT15M",
+    ])
+
+
+FOOTER = b"END:VCALENDAR\r\n"
+
+
+def render_segment(component, start, end):
+    """start〜end（1 か月分）の日付付き Todo と繰り返しタスクの発生分を iCalendar の行にする"""
+    tenant_id = current_tenant_id()
+    domain = os.getenv("ICS_UID_DOMAIN", "todo-scheduler")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = []
+
+    def entry(uid, title, day, done, priority, completed_at=None, parent_id=None):
+        lines.append(f"BEGIN:{component}")
+        lines.append(f"UID:{uid}@{domain}")
+        lines.append(f"DTSTAMP:{stamp}")
+        if component == "VEVENT":
+            lines.append(f"DTSTART;VALUE=DATE:{_ical_date(day)}")
+            lines.append(f"DTEND;VALUE=DATE:{_ical_date(day + timedelta(days=1))}")
+            lines.append(f"SUMMARY:{'✓ ' if done else ''}{_escape(title)}")
+            lines.append("TRANSP:TRANSPARENT")
+        else:
+            lines.append(f"DUE;VALUE=DATE:{_ical_date(day)}")
+            lines.append(f"SUMMARY:{_escape(title)}")
+            lines.append(f"STATUS:{'COMPLETED' if done else 'NEEDS-ACTION'}")
+            if done and completed_at is not None:
+                lines.append(f"COMPLETED:{completed_at.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}")
+            if parent_id is not None:
+                lines.append(f"RELATED-TO;RELTYPE=PARENT:todo-{tenant_id}-{parent_id}@{domain}")
+        if _ical_priority(priority):
+            lines.append(f"PRIORITY:{_ical_priority(priority)}")
+        lines.append(f"END:{component}")
+
+    rows = db.session.execute(
+        select(Todo.id, Todo.title, Todo.date, Todo.done, Todo.priority, Todo.completed_at, Todo.parent_id)
+        .where(Todo.date >= start, Todo.date <= end)
+        .order_by(Todo.date, Todo.id)
+    )
+    for todo_id, title, day, done, priority, completed_at, parent_id in rows:
+        entry(f"todo-{tenant_id}-{todo_id}", title, day, done, priority, completed_at, parent_id)
+
+    for occurrence in recurrence.expand_occurrences(start, end):
+        uid = f"series-{tenant_id}-{occurrence.series_id}-{occurrence.occurrence_date:%Y%m%d}"
+        entry(uid, occurrence.title, occurrence.date, occurrence.done, occurrence.priority)
+
+    return _lines(lines)
+
+
+def iter_feed(component, segments, name="Todo Scheduler"):
+    """VCALENDAR 全体を月ごとに返すジェネレーター
+
+    各月の描画結果は一覧キャッシュ（read_cache）に月のタグ付きで保存されるので、
+    その月の Todo が変わった月だけが描画し直される。
+    """
+    yield header(name)
+    for start, end in segments:
+        yield read_cache.fetch(
+            f"ics_{component.lower()}", start.strftime("%Y-%m"), (start, end),
+            lambda start=start, end=end: render_segment(component, start, end),
+        )
+    yield FOOTER
+
+
+def sign_tenant(secret, tenant_id):
+    """購読 URL に含めるテナントの署名"""
+    return hmac.new(secret.encode(), f"ics:{tenant_id}".encode(), hashlib.sha256).hexdigest()
+
+
+def verify_tenant(secret, tenant_id, signature):
+    return bool(secret) and hmac.compare_digest(sign_tenant(secret, tenant_id), signature or "")
+
+
+class FeedVersions:
+    """フィードの ETag ごとの Last-Modified（ETag が変わった時刻）を覚えておく
+
+    Todo には更新日時が無いので、内容のバージョン（ETag）が初めて変わったのを
+    見た時刻を Last-Modified とする。プロセスごとの値なので、複数ワーカーでは
+    ワーカーによって数秒ずれることがある（If-None-Match が優先されるので実害は無い）。
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def last_modified(self, key, etag):
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None or seen[0] != etag:
+                if len(self._seen) >= self.max_entries:
+                    self._seen.clear()
+                seen = self._seen[key] = (etag, datetime.now(timezone.utc).replace(microsecond=0))
+            return seen[1]
@@ -1,10 +1,16 @@
+import logging
 import os
 from datetime import datetime, date
 import pytz
 from linebot import LineBotApi
 from linebot.models import TextSendMessage
 from linebot.exceptions import LineBotApiError
-from .models import Todo
+from .models import Tenant, Todo
+from . import db, ranking
+from .recurrence import expand_occurrences
+from .tenancy import current_tenant_id, tenant_scope, tenants_with_line_user
+
+logger = logging.getLogger(__name__)
 
 
 class LineNotificationService:
@@ -21,12 +27,40 @@ class LineNotificationService:
         else:
             self.line_bot_api = None
             self.enabled = False
-            print("LINE Bot is disabled. Set LINE_CHANNEL_ACCESS_TOKEN to enable notifications.")
+            logger.warning("LINE Bot is disabled. Set LINE_CHANNEL_ACCESS_TOKEN to enable notifications.")
     
-    def send_daily_task_notification(self):
-        """今日のタスク一覧をLINEに送信"""
-        if not self.enabled or not self.user_id:
-            print("LINE notification is disabled or USER_ID is not set.")
+    def _recipient(self, user_id=None):
+        """送信先: 指定が無ければ現在のテナントの LINE ユーザー、それも無ければ LINE_USER_ID"""
+        if user_id:
+            return user_id
+        tenant = db.session.get(Tenant, current_tenant_id())
+        if tenant is not None and tenant.line_user_id:
+            return tenant.line_user_id
+        return self.user_id
+
+    def send_daily_notifications(self):
+        """LINE の通知先を持つ全テナントに、それぞれのタスクの日次通知を送る
+
+        テナントごとに tenant_scope 内で集計し、テナントをまたいで ORM の
+        インスタンスが再利用されないよう、1 テナントごとにセッションを破棄する。
+        戻り値は (送信成功数, 失敗数)。
+        """
+        sent = failed = 0
+        for tenant_id, line_user_id in list(tenants_with_line_user(db)):
+            with tenant_scope(tenant_id):
+                if self.send_daily_task_notification(line_user_id):
+                    sent += 1
+                else:
+                    failed += 1
+                db.session.remove()
+        logger.info("Daily notifications: %d sent, %d failed", sent, failed)
+        return sent, failed
+
+    def send_daily_task_notification(self, user_id=None):
+        """今日のタスク一覧をLINEに送信（現在のテナントのタスク）"""
+        user_id = self._recipient(user_id) if self.enabled else None
+        if not self.enabled or not user_id:
+            logger.warning("LINE notification is disabled or USER_ID is not set.")
             return False
         
         try:
@@ -38,54 +72,57 @@ class LineNotificationService:
                 Todo.date == today,
                 Todo.done == False
             ).order_by(Todo.priority.desc()).all()
+
+            # 今日発生する繰り返しタスク（今日の分だけ展開）
+            today_tasks += expand_occurrences(today, today, include_done=False)
+            today_tasks.sort(key=lambda task: task.priority or 0, reverse=True)
             
-            # 期限なしのタスクも取得（完了していないもの）
-            no_deadline_tasks = Todo.query.filter(
-                Todo.date == None,
-                Todo.done == False
-            ).order_by(Todo.priority.desc()).limit(5).all()
+            # 今日のタスク以外で次にやるべきタスク（/todos/next と同じスコア）
+            today_ids = [task.id for task in today_tasks if getattr(task, 'id', None)]
+            next_tasks = [row for row, _, _ in ranking.next_tasks(5, exclude_ids=today_ids, today=today)]
             
             # メッセージを構築
-            message = self._build_daily_message(today, today_tasks, no_deadline_tasks)
+            message = self._build_daily_message(today, today_tasks, next_tasks)
             
             # LINE メッセージを送信
             self.line_bot_api.push_message(
-                self.user_id,
+                user_id,
                 TextSendMessage(text=message)
             )
             
-            print(f"Daily notification sent successfully to {self.user_id}")
+            logger.info(f"Daily notification sent successfully to {user_id}")
             return True
             
         except LineBotApiError as e:
-            print(f"LINE Bot API Error: {e}")
+            logger.exception(f"LINE Bot API Error: {e}")
             return False
         except Exception as e:
-            print(f"Error sending daily notification: {e}")
+            logger.exception(f"Error sending daily notification: {e}")
             return False
     
-    def send_custom_notification(self, message):
+    def send_custom_notification(self, message, user_id=None):
         """カスタムメッセージをLINEに送信（デバッグ用）"""
-        if not self.enabled or not self.user_id:
-            print("LINE notification is disabled or USER_ID is not set.")
+        user_id = user_id or self.user_id
+        if not self.enabled or not user_id:
+            logger.warning("LINE notification is disabled or USER_ID is not set.")
             return False
         
         try:
             self.line_bot_api.push_message(
-                self.user_id,
+                user_id,
                 TextSendMessage(text=message)
             )
-            print(f"Custom notification sent successfully to {self.user_id}")
+            logger.info(f"Custom notification sent successfully to {user_id}")
             return True
             
         except LineBotApiError as e:
-            print(f"LINE Bot API Error: {e}")
+            logger.exception(f"LINE Bot API Error: {e}")
             return False
         except Exception as e:
-            print(f"Error sending custom notification: {e}")
+            logger.exception(f"Error sending custom notification: {e}")
             return False
     
-    def _build_daily_message(self, today, today_tasks, no_deadline_tasks):
+    def _build_daily_message(self, today, today_tasks, next_tasks):
         """日次通知メッセージを構築"""
         # 日付をJSTで表示
         jst = pytz.timezone('Asia/Tokyo')
@@ -106,14 +143,16 @@ class LineNotificationService:
         else:
             message_lines.append("\n✅ 今日は予定されたタスクがありません！")
         
-        # 期限なしのタスク（参考）
-        if no_deadline_tasks:
-            message_lines.append("\n💡 期限なしタスク（参考）:")
-            for i, task in enumerate(no_deadline_tasks[:3], 1):  # 最大3つまで表示
-                priority_icon = "🔥" if task.priority >= 3 else "⭐" if task.priority >= 1 else "📌"
-                message_lines.append(f"• {priority_icon} {task.title}")
-            if len(no_deadline_tasks) > 3:
-                message_lines.append(f"...他{len(no_deadline_tasks) - 3}件")
+        # 次にやるべきタスク（参考）
+        if next_tasks:
+            message_lines.append("\n💡 次にやるべきタスク（参考）:")
+            for i, task in enumerate(next_tasks[:3], 1):  # 最大3つまで表示
+                priority = task.priority or 0
+                priority_icon = "🔥" if priority >= 3 else "⭐" if priority >= 1 else "📌"
+                due = f" ({task.date.strftime('%m/%d')})" if task.date else ""
+                message_lines.append(f"• {priority_icon} {task.title}{due}")
+            if len(next_tasks) > 3:
+                message_lines.append(f"...他{len(next_tasks) - 3}件")
         
         # フッター
         message_lines.extend([
@@ -0,0 +1,133 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """ログレコードにリクエストIDを付与するフィルタ（呼び出し元スレッドで実行される）"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id', '-')
+        else:
+            record.request_id = '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードの JSON 形式で出力するフォーマッタ"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """キューが満杯の場合は待たずに破棄する QueueHandler"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(app):
+    """アプリケーションのロガーを非同期（キュー + 書き込みスレッド）構成にする
+
+    ハンドラはレコードをキューに積むだけで、標準出力への書き込みは
+    QueueListener のバックグラウンドスレッドが行う。これにより
+    リクエストスレッドが stdout のロック待ちで直列化されない。
+    """
+    global _listener
+
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_format = os.getenv('LOG_FORMAT', 'json').lower()
+    queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    logger = logging.getLogger(app.import_name)
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    # create_app() が再度呼ばれた場合は、前のキューを書き出してから新しいキューで起動し直す
+    if _listener is None:
+        atexit.register(_stop_listener)
+    else:
+        _listener.stop()
+    _listener = QueueListener(log_queue, writer, respect_handler_level=False)
+    _listener.start()
+
+    app.before_request(_assign_request_id)
+    app.after_request(_attach_request_id)
+    app.log_queue_handler = queue_handler
+
+
+def _stop_listener():
+    """終了時に、キューに残ったレコードを書き出して書き込みスレッドを止める"""
+    if _listener is not None:
+        _listener.stop()
+
+
+def _assign_request_id():
+    # クライアントの ID はレスポンスとログにそのまま出るので、安全な形式のものだけを引き継ぐ
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    g.request_id = request_id if _VALID_REQUEST_ID.fullmatch(request_id) else uuid.uuid4().hex[:16]
+
+
+def _attach_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+    return response
+
+
+def should_log_payload():
+    """詳細なペイロードログをサンプリングするかどうか（LOG_PAYLOAD_SAMPLE_RATE）"""
+    rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+    return rate > 0 and random.random() < rate
+
+
+def log_payload(logger, message, payload):
+    """サンプリングされた場合のみ DEBUG レベルでペイロードを出力する"""
+    if logger.isEnabledFor(logging.DEBUG) and should_log_payload():
+        logger.debug(message, extra={'fields': {'payload': payload}})
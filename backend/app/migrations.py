@@ -0,0 +1,83 @@
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_schema(db):
+    """既存テーブルに不足しているカラム・インデックスを追加する
+
+    db.create_all() は新規テーブルしか作らないため、既存の todos.db に
+    後から追加したカラム（NULL 許容 / デフォルト付き）とインデックスを
+    ここで補う。アプリケーションコンテキスト内で呼び出すこと。
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, str):
+                        default = "'" + default.replace("'", "''") + "'"
+                    else:
+                        default = default.text
+                    ddl += f' DEFAULT {default}'
+                conn.execute(text(ddl))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+            if table.kwargs.get('sqlite_autoincrement') and engine.dialect.name == 'sqlite':
+                _ensure_autoincrement(conn, table)
+
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+# AUTOINCREMENT の採番の起点に含める、id を引き継ぐ退避先のテーブル
+_ID_HOLDERS = {'todos': ('todos_archive',)}
+
+
+def _ensure_autoincrement(conn, table):
+    """AUTOINCREMENT 無しで作られた既存テーブルを AUTOINCREMENT 付きで作り直す
+
+    SQLite の AUTOINCREMENT は後から付けられないので、新しいテーブルに行をコピーして
+    置き換える（id はそのまま）。インデックスとトリガーはテーブルと一緒に消えるので、
+    呼び出し側（ensure_schema / ensure_search_index）で作り直す。
+    採番の起点（sqlite_sequence）は、退避先のテーブルに移した id も含めた最大値にする。
+    """
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+    ).scalar()
+    if sql is None or 'AUTOINCREMENT' in sql.upper():
+        return
+
+    temp_name = f'{table.name}__rebuild'
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    conn.execute(text(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {temp_name} ', 1)))
+    columns = ', '.join(column.name for column in table.columns)
+    conn.execute(text(f'INSERT INTO {temp_name} ({columns}) SELECT {columns} FROM {table.name}'))
+    conn.execute(text(f'DROP TABLE {table.name}'))
+    conn.execute(text(f'ALTER TABLE {temp_name} RENAME TO {table.name}'))
+
+    existing_tables = set(inspect(conn).get_table_names())
+    sources = [table.name] + [name for name in _ID_HOLDERS.get(table.name, ()) if name in existing_tables]
+    high_water = max(
+        conn.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {name}')).scalar() for name in sources
+    )
+    conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+    conn.execute(
+        text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+        {'name': table.name, 'seq': high_water},
+    )
+    logger.info("Rebuilt %s with AUTOINCREMENT (next id > %d)", table.name, high_water)
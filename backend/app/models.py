@@ -1,26 +1,50 @@
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm.base import NEVER_SET, NO_VALUE
 from . import db
+from .serializers import todo_to_dict
+from .tenancy import TenantScoped
 
-class Todo(db.Model):
+# 優先度の上限（SQLite の INTEGER に収まり、並べ替えの重みとして十分な範囲）
+MAX_PRIORITY = 2**31 - 1
+
+
+def parse_priority(value):
+    """priority を検証して返す（null は 0、不正なら ValueError）"""
+    if value is None:
+        return 0
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= MAX_PRIORITY:
+        raise ValueError("priority must be a non-negative integer")
+    return value
+
+
+class Todo(TenantScoped, db.Model):
     __tablename__ = "todos"
+    __table_args__ = (
+        db.Index('ix_todos_parent_id', 'parent_id'),
+        db.Index('ix_todos_done_completed_at', 'done', 'completed_at'),
+        # テナント内の一覧（id 順）と期間指定の一覧・カレンダー
+        db.Index('ix_todos_tenant_id', 'tenant_id', 'id'),
+        db.Index('ix_todos_tenant_date', 'tenant_id', 'date'),
+        # 削除・アーカイブした id を再利用しない（todos_archive と id が重ならないように）
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     date = db.Column(db.Date, nullable=True)
     done = db.Column(db.Boolean, default=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('todos.id'), nullable=True)
     priority = db.Column(db.Integer, default=0)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    # スケジューラ用: 見積もり時間（分）と締め切り（date は着手予定日として割り当てられる）
+    estimated_minutes = db.Column(db.Integer, nullable=True)
+    deadline = db.Column(db.Date, nullable=True)
 
     # リレーションシップ
     parent = db.relationship('Todo', remote_side=[id], backref='children')
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "date": self.date.isoformat() if self.date else None,
-            "done": self.done,
-            "parent_id": self.parent_id,
-            "priority": self.priority,
-        }
+        return todo_to_dict(self)
 
     def split_into_tasks(self, new_tasks_data):
         """
@@ -57,4 +81,127 @@ class Todo(db.Model):
             return 1.0 if self.done else 0.0
         
         completed = sum(1 for task in subtasks if task.done)
-        return completed / len(subtasks)
\ No newline at end of file
+        return completed / len(subtasks)
+
+
+# 「次にやるべきタスク」（ranking.next_tasks）用の未完了タスクだけの部分インデックス。
+# テナントごとに優先度ごと・期日順に id 昇順で読み進めて途中で打ち切れるようにする。
+db.Index(
+    'ix_todos_tenant_open_priority', Todo.tenant_id, Todo.priority, Todo.id,
+    sqlite_where=Todo.done.is_not(True),
+)
+db.Index(
+    'ix_todos_tenant_open_date', Todo.tenant_id, Todo.date, Todo.id,
+    sqlite_where=db.and_(Todo.done.is_not(True), Todo.date.is_not(None)),
+)
+
+
+@event.listens_for(Todo.done, 'set', active_history=True)
+def _track_completed_at(target, value, oldvalue, initiator):
+    """done の変更に合わせて完了日時を記録（アーカイブ対象の判定に使う）"""
+    was_done = oldvalue is not NO_VALUE and oldvalue is not NEVER_SET and bool(oldvalue)
+    if value and not was_done:
+        target.completed_at = datetime.now()
+    elif not value:
+        target.completed_at = None
+
+
+class ArchivedTodo(TenantScoped, db.Model):
+    """完了済みで古くなった Todo の退避先
+
+    id は元の todos.id をそのまま保持するので、parent_id による親子関係は
+    todos / todos_archive のどちらに親があっても辿れる。
+    """
+    __tablename__ = "todos_archive"
+    __table_args__ = (
+        db.Index('ix_todos_archive_parent_id', 'parent_id'),
+        db.Index('ix_todos_archive_tenant_id', 'tenant_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(120), nullable=False)
+    date = db.Column(db.Date, nullable=True)
+    done = db.Column(db.Boolean, default=True)
+    parent_id = db.Column(db.Integer, nullable=True)
+    priority = db.Column(db.Integer, default=0)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def to_dict(self):
+        return dict(todo_to_dict(self), archived=True)
+
+
+class TodoSeries(TenantScoped, db.Model):
+    """繰り返しタスクのシリーズ（発生ごとの行は作らず、問い合わせ期間に応じて展開する）"""
+    __tablename__ = "todo_series"
+    __table_args__ = (
+        db.Index('ix_todo_series_tenant_window', 'tenant_id', 'start_date', 'end_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(120), nullable=False)
+    priority = db.Column(db.Integer, default=0)
+    rrule = db.Column(db.String(200), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    # UNTIL / COUNT から求めた最終日（無期限なら NULL）
+    end_date = db.Column(db.Date, nullable=True)
+
+    exceptions = db.relationship('TodoSeriesException', backref='series', cascade='all, delete-orphan')
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "priority": self.priority,
+            "rrule": self.rrule,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat() if self.end_date else None,
+        }
+
+
+class TodoSeriesException(db.Model):
+    """シリーズの 1 回分に対する変更（完了・タイトル変更・日付移動・取消）"""
+    __tablename__ = "todo_series_exceptions"
+    __table_args__ = (
+        db.UniqueConstraint('series_id', 'occurrence_date', name='uq_series_occurrence'),
+        db.Index('ix_todo_series_exceptions_date', 'series_id', 'date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('todo_series.id'), nullable=False)
+    # 本来の発生日
+    occurrence_date = db.Column(db.Date, nullable=False)
+    # 移動先の日付（移動していなければ NULL）
+    date = db.Column(db.Date, nullable=True)
+    title = db.Column(db.String(120), nullable=True)
+    done = db.Column(db.Boolean, default=False)
+    cancelled = db.Column(db.Boolean, default=False)
+
+
+class TodoDependency(db.Model):
+    """タスク間の依存関係（blocker が完了するまで blocked に着手できない）"""
+    __tablename__ = "todo_dependencies"
+    __table_args__ = (
+        db.UniqueConstraint('blocker_id', 'blocked_id', name='uq_todo_dependency'),
+        db.Index('ix_todo_dependencies_blocked', 'blocked_id', 'blocker_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    blocker_id = db.Column(db.Integer, db.ForeignKey('todos.id'), nullable=False)
+    blocked_id = db.Column(db.Integer, db.ForeignKey('todos.id'), nullable=False)
+
+
+class TodoDependencyVersion(db.Model):
+    """依存関係の変更回数（1 行のみ）。プロセス内のグラフキャッシュの鮮度判定に使う"""
+    __tablename__ = "todo_dependency_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Tenant(db.Model):
+    """利用者（テナント）。Todo・シリーズなどは tenant_id でテナントごとに分かれる"""
+    __tablename__ = "tenants"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=True)
+    # 日次通知の送り先（LINE のユーザー ID）
+    line_user_id = db.Column(db.String(64), nullable=True, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "line_user_id": self.line_user_id}
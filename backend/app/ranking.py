@@ -0,0 +1,186 @@
+import heapq
+import os
+from datetime import date
+from sqlalchemy import case, func, select, tuple_
+from . import db
+from .models import Todo
+from .serializers import row_to_dict, todo_columns
+
+MAX_K = 100
+MAX_PAGE_SIZE = 2000
+
+
+def default_weights():
+    """スコアの重み（環境変数で調整可能）"""
+    return {
+        'priority': float(os.getenv('NEXT_WEIGHT_PRIORITY', '1.0')),
+        'due': float(os.getenv('NEXT_WEIGHT_DUE', '3.0')),
+        'progress': float(os.getenv('NEXT_WEIGHT_PROGRESS', '0.5')),
+        'horizon_days': float(os.getenv('NEXT_DUE_HORIZON_DAYS', '7')),
+    }
+
+
+def due_proximity(due_date, today, horizon_days):
+    """期日の近さ（0〜1）。期限切れ・今日は 1、遠いほど 0 に近づき、期日なしは 0。"""
+    if due_date is None:
+        return 0.0
+    days_left = max((due_date - today).days, 0)
+    return 1.0 / (1.0 + days_left / horizon_days)
+
+
+def _subtask_progress(ids):
+    """親タスクごとのサブタスク完了率（サブタスクが無ければ 0）"""
+    if not ids:
+        return {}
+    rows = db.session.execute(
+        select(Todo.parent_id, func.count(), func.sum(case((Todo.done.is_(True), 1), else_=0)))
+        .where(Todo.parent_id.in_(ids))
+        .group_by(Todo.parent_id)
+    )
+    return {parent_id: (done or 0) / total for parent_id, total, done in rows if total}
+
+
+def _open_todos():
+    return select(*todo_columns(Todo)).where(Todo.done.is_not(True))
+
+
+def _priority_buckets():
+    """未完了タスクの priority の値を降順に返す（NULL は 0 として 0 の直後に扱う）
+
+    次の値は「現在値より小さい最大値」をインデックスで 1 回ずつ引くので、
+    値の種類が少ない priority では全件を読まずに済む。
+    """
+    open_priority = select(func.max(Todo.priority)).where(Todo.done.is_not(True))
+    current = db.session.execute(open_priority).scalar()
+    has_null = db.session.execute(
+        select(Todo.id).where(Todo.done.is_not(True), Todo.priority.is_(None)).limit(1)
+    ).first() is not None
+
+    while current is not None:
+        if has_null and current < 0:
+            yield None
+            has_null = False
+        yield current
+        current = db.session.execute(open_priority.where(Todo.priority < current)).scalar()
+    if has_null:
+        yield None
+
+
+def _page_sizes(first):
+    """ページサイズを倍々に増やす（打ち切りが遅い場合の往復回数を抑える）"""
+    size = first
+    while True:
+        yield size
+        size = min(size * 2, MAX_PAGE_SIZE)
+
+
+def _priority_stream(page_size):
+    """未完了タスクを priority 降順（同順位は id 昇順）でページ単位に返す（keyset ページング）"""
+    sizes = _page_sizes(page_size)
+    for priority in _priority_buckets():
+        bucket = _open_todos().where(
+            Todo.priority.is_(None) if priority is None else Todo.priority == priority
+        )
+        last_id = None
+        while True:
+            query = bucket if last_id is None else bucket.where(Todo.id > last_id)
+            rows = db.session.execute(query.order_by(Todo.id).limit(next(sizes))).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            yield rows
+
+
+def _due_stream(page_size):
+    """期日付きの未完了タスクを期日昇順（同日は id 昇順）でページ単位に返す（keyset ページング）"""
+    sizes = _page_sizes(page_size)
+    last = None
+    while True:
+        query = _open_todos().where(Todo.date.is_not(None))
+        if last is not None:
+            query = query.where(tuple_(Todo.date, Todo.id) > tuple_(*last))
+        rows = db.session.execute(query.order_by(Todo.date, Todo.id).limit(next(sizes))).all()
+        if not rows:
+            return
+        last = (rows[-1].date, rows[-1].id)
+        yield rows
+
+
+def next_tasks(k=5, weights=None, exclude_ids=(), today=None):
+    """いま着手すべき未完了タスクの上位 k 件を返す
+
+    score = priority * w_priority + due_proximity * w_due + subtask_progress * w_progress
+
+    全件をスコアリングせず、priority 降順と期日昇順の 2 本のインデックス順ストリームを
+    並行して読み進める（Fagin の Threshold Algorithm）。まだ見ていないタスクが
+    取りうるスコアの上限（各ストリームの現在位置の値 + 完了率 1）を、
+    現在の k 位のスコアが上回った時点で打ち切るので、上位 k 件のスコアは全件を
+    スコアリングした場合と一致する（同点のタスク同士は先に読んだ方が残る）。
+
+    戻り値は (row, score, progress) のリスト（row は TODO_FIELDS 順、属性アクセス可）。
+    """
+    weights = dict(default_weights(), **(weights or {}))
+    today = today or date.today()
+    exclude = set(exclude_ids)
+    page_size = max(k * 2, 20)
+
+    priority_pages = _priority_stream(page_size)
+    due_pages = _due_stream(page_size)
+    priority_bound = None
+    due_bound = None
+    due_exhausted = False
+
+    seen = set()
+    top = []  # (score, -id, row, progress) の最小ヒープ
+
+    while True:
+        priority_page = next(priority_pages, None)
+        due_page = None if due_exhausted else next(due_pages, None)
+        if due_page is None:
+            due_exhausted = True
+        if priority_page is None:
+            # priority ストリームは全未完了タスクを含むので、尽きたら全件を見終えている
+            break
+
+        priority_bound = priority_page[-1].priority or 0
+        if due_page:
+            due_bound = due_page[-1].date
+
+        new_rows = []
+        for row in list(priority_page) + list(due_page or []):
+            if row.id in seen:
+                continue
+            seen.add(row.id)
+            if row.id not in exclude:
+                new_rows.append(row)
+
+        progress = _subtask_progress([row.id for row in new_rows])
+        for row in new_rows:
+            rate = progress.get(row.id, 0.0)
+            score = (
+                weights['priority'] * (row.priority or 0)
+                + weights['due'] * due_proximity(row.date, today, weights['horizon_days'])
+                + weights['progress'] * rate
+            )
+            entry = (score, -row.id, row, rate)
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif entry[:2] > top[0][:2]:
+                heapq.heapreplace(top, entry)
+
+        # まだ見ていないタスクのスコア上限
+        due_limit = 0.0 if due_exhausted else due_proximity(due_bound, today, weights['horizon_days'])
+        threshold = (
+            weights['priority'] * priority_bound
+            + weights['due'] * due_limit
+            + weights['progress'] * 1.0
+        )
+        if len(top) >= k and top[0][0] >= threshold:
+            break
+
+    ranked = sorted(top, key=lambda entry: entry[:2], reverse=True)
+    return [(row, score, rate) for score, _, row, rate in ranked]
+
+
+def ranked_to_dict(row, score, progress):
+    return dict(row_to_dict(row), score=round(score, 4), subtask_progress=round(progress, 4))
@@ -0,0 +1,319 @@
+import calendar
+import logging
+from datetime import date, timedelta
+from sqlalchemy import and_, or_
+from . import db
+from .models import TodoSeries, TodoSeriesException, parse_priority
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+# COUNT 指定時に終了日を求めるための上限（暴走防止）
+MAX_COUNT = 1000
+# INTERVAL の上限（日付の計算が date の範囲を超えないように）
+MAX_INTERVAL = 1000
+
+
+class RecurrenceRule:
+    """RRULE のサブセット（FREQ / INTERVAL / BYDAY / BYMONTHDAY / COUNT / UNTIL）
+
+    例: "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;UNTIL=20250630"
+    """
+
+    def __init__(self, freq, interval=1, byday=None, bymonthday=None, count=None, until=None):
+        self.freq = freq
+        self.interval = interval
+        self.byday = byday or []
+        self.bymonthday = bymonthday or []
+        self.count = count
+        self.until = until
+
+    @classmethod
+    def parse(cls, value):
+        """RRULE 文字列を解析する（不正な場合は ValueError）"""
+        if not value or not isinstance(value, str):
+            raise ValueError("rrule is required")
+
+        text = value.strip()
+        if text.upper().startswith("RRULE:"):
+            text = text[6:]
+
+        parts = {}
+        for part in text.split(";"):
+            if not part:
+                continue
+            key, sep, val = part.partition("=")
+            if not sep:
+                raise ValueError(f"invalid rrule part: {part}")
+            parts[key.strip().upper()] = val.strip().upper()
+
+        freq = parts.pop("FREQ", None)
+        if freq not in FREQUENCIES:
+            raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+
+        interval = int(parts.pop("INTERVAL", "1"))
+        if not 1 <= interval <= MAX_INTERVAL:
+            raise ValueError(f"INTERVAL must be between 1 and {MAX_INTERVAL}")
+
+        byday = []
+        if "BYDAY" in parts:
+            if freq != "WEEKLY":
+                raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+            for day in parts.pop("BYDAY").split(","):
+                if day not in WEEKDAYS:
+                    raise ValueError(f"invalid BYDAY value: {day}")
+                byday.append(WEEKDAYS.index(day))
+
+        bymonthday = []
+        if "BYMONTHDAY" in parts:
+            if freq not in ("MONTHLY", "YEARLY"):
+                raise ValueError("BYMONTHDAY is only supported with FREQ=MONTHLY or YEARLY")
+            for day in parts.pop("BYMONTHDAY").split(","):
+                number = int(day)
+                if number == 0 or not -31 <= number <= 31:
+                    raise ValueError(f"invalid BYMONTHDAY value: {day}")
+                bymonthday.append(number)
+
+        count = None
+        if "COUNT" in parts:
+            count = int(parts.pop("COUNT"))
+            if not 1 <= count <= MAX_COUNT:
+                raise ValueError(f"COUNT must be between 1 and {MAX_COUNT}")
+
+        until = None
+        if "UNTIL" in parts:
+            raw = parts.pop("UNTIL")[:8]
+            until = date(int(raw[:4]), int(raw[4:6]), int(raw[6:8]))
+
+        if count is not None and until is not None:
+            raise ValueError("COUNT and UNTIL cannot be combined")
+        if parts:
+            raise ValueError(f"unsupported rrule parts: {', '.join(sorted(parts))}")
+
+        return cls(freq, interval, sorted(set(byday)), sorted(set(bymonthday)), count, until)
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[d] for d in self.byday))
+        if self.bymonthday:
+            parts.append("BYMONTHDAY=" + ",".join(str(d) for d in self.bymonthday))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append(f"UNTIL={self.until.strftime('%Y%m%d')}")
+        return ";".join(parts)
+
+    # ---------- 展開 ----------
+
+    def _first_period(self, dtstart, window_start):
+        """window_start を含みうる最初の周期番号（それより前の周期は計算しない）"""
+        if window_start <= dtstart:
+            return 0
+        if self.freq == "DAILY":
+            return (window_start - dtstart).days // self.interval
+        if self.freq == "WEEKLY":
+            week0 = dtstart - timedelta(days=dtstart.weekday())
+            return (window_start - week0).days // 7 // self.interval
+        if self.freq == "MONTHLY":
+            months = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+            return max(months, 0) // self.interval
+        return max(window_start.year - dtstart.year, 0) // self.interval
+
+    def _period(self, dtstart, index):
+        """周期 index の開始日と、その周期内の候補日（昇順）"""
+        if self.freq == "DAILY":
+            day = dtstart + timedelta(days=index * self.interval)
+            return day, [day]
+
+        if self.freq == "WEEKLY":
+            week = dtstart - timedelta(days=dtstart.weekday()) + timedelta(weeks=index * self.interval)
+            weekdays = self.byday or [dtstart.weekday()]
+            return week, [week + timedelta(days=d) for d in weekdays]
+
+        if self.freq == "MONTHLY":
+            month_index = dtstart.month - 1 + index * self.interval
+            year, month = dtstart.year + month_index // 12, month_index % 12 + 1
+        else:
+            year, month = dtstart.year + index * self.interval, dtstart.month
+
+        last_day = calendar.monthrange(year, month)[1]
+        days = []
+        for day in self.bymonthday or [dtstart.day]:
+            actual = day if day > 0 else last_day + day + 1
+            # 存在しない日（2/30 など）はスキップ
+            if 1 <= actual <= last_day:
+                days.append(date(year, month, actual))
+        return date(year, month, 1), sorted(set(days))
+
+    def between(self, dtstart, window_start, window_end, end_date=None):
+        """window_start〜window_end（両端含む）に入る発生日を順に返す
+
+        end_date はシリーズの最終日（UNTIL または COUNT から求めた日）。
+        """
+        last = window_end if end_date is None else min(window_end, end_date)
+        index = self._first_period(dtstart, window_start)
+
+        while True:
+            try:
+                period_start, candidates = self._period(dtstart, index)
+            except (OverflowError, ValueError):
+                # date の範囲（9999 年）を超えた
+                return
+            if period_start > last:
+                return
+            for day in candidates:
+                if day < dtstart or day < window_start:
+                    continue
+                if day > last:
+                    return
+                yield day
+            index += 1
+
+    def end_date(self, dtstart):
+        """シリーズの最終日（無期限なら None）"""
+        if self.until is not None:
+            return self.until
+        if self.count is None:
+            return None
+
+        occurrence = None
+        generated = 0
+        # COUNT は先頭から数える必要があるが、上限 MAX_COUNT 件なので作成時に一度だけ計算する
+        for occurrence in self.between(dtstart, dtstart, date.max - timedelta(days=366)):
+            generated += 1
+            if generated >= self.count:
+                break
+        return occurrence
+
+
+class Occurrence:
+    """シリーズから展開された 1 回分のタスク（DB には保存されない）"""
+
+    def __init__(self, series, occurrence_date, exception=None):
+        self.series_id = series.id
+        self.occurrence_date = occurrence_date
+        self.title = series.title
+        self.priority = series.priority or 0
+        self.date = occurrence_date
+        self.done = False
+        self.cancelled = False
+
+        if exception is not None:
+            if exception.title:
+                self.title = exception.title
+            if exception.date:
+                self.date = exception.date
+            self.done = bool(exception.done)
+            self.cancelled = bool(exception.cancelled)
+
+    def to_dict(self):
+        return {
+            "id": None,
+            "title": self.title,
+            "date": self.date.isoformat(),
+            "done": self.done,
+            "parent_id": None,
+            "priority": self.priority,
+            "series_id": self.series_id,
+            "occurrence_date": self.occurrence_date.isoformat(),
+        }
+
+
+def expand_occurrences(window_start, window_end, include_done=True):
+    """期間内に発生する繰り返しタスクを展開する
+
+    期間と重なるシリーズと、その期間に関係する例外（完了・変更・移動・取消）だけを
+    読み込み、期間内の発生日だけを計算する。結果は日付順。
+    """
+    series_list = TodoSeries.query.filter(
+        TodoSeries.start_date <= window_end,
+        or_(TodoSeries.end_date.is_(None), TodoSeries.end_date >= window_start),
+    ).all()
+    if not series_list:
+        return []
+
+    series_by_id = {series.id: series for series in series_list}
+    exceptions = TodoSeriesException.query.filter(
+        TodoSeriesException.series_id.in_(series_by_id.keys()),
+        or_(
+            and_(TodoSeriesException.occurrence_date >= window_start,
+                 TodoSeriesException.occurrence_date <= window_end),
+            and_(TodoSeriesException.date >= window_start,
+                 TodoSeriesException.date <= window_end),
+        ),
+    ).all()
+    exception_map = {(e.series_id, e.occurrence_date): e for e in exceptions}
+
+    occurrences = []
+    for series in series_list:
+        try:
+            rule = RecurrenceRule.parse(series.rrule)
+        except ValueError:
+            # 上限を設ける前に保存された不正な RRULE のシリーズは展開しない
+            logger.warning("Skipping series %s with invalid rrule %r", series.id, series.rrule)
+            continue
+        for day in rule.between(series.start_date, window_start, window_end, series.end_date):
+            occurrences.append(Occurrence(series, day, exception_map.pop((series.id, day), None)))
+
+    # 期間外の発生日から期間内へ移動された分
+    for exception in exception_map.values():
+        series = series_by_id[exception.series_id]
+        if exception.date is not None and is_occurrence(series, exception.occurrence_date):
+            occurrences.append(Occurrence(series, exception.occurrence_date, exception))
+
+    result = [
+        o for o in occurrences
+        if not o.cancelled
+        and window_start <= o.date <= window_end  # 期間外へ移動された分を除く
+        and (include_done or not o.done)
+    ]
+    result.sort(key=lambda o: (o.date, -o.priority, o.series_id))
+    return result
+
+
+def create_series(title, rrule, start_date, priority=0):
+    """RRULE を検証してシリーズを作成する（セッションへの追加のみ、コミットは呼び出し側）"""
+    title = (title or "").strip()
+    if not title:
+        raise ValueError("title is required")
+    if start_date is None:
+        raise ValueError("start_date is required")
+    priority = parse_priority(priority)
+
+    rule = RecurrenceRule.parse(rrule)
+    series = TodoSeries(
+        title=title,
+        priority=priority,
+        rrule=str(rule),
+        start_date=start_date,
+        end_date=rule.end_date(start_date),
+    )
+    db.session.add(series)
+    return series
+
+
+def is_occurrence(series, occurrence_date):
+    """occurrence_date がシリーズの発生日かどうか（RRULE が不正なシリーズは常に False）"""
+    try:
+        rule = RecurrenceRule.parse(series.rrule)
+    except ValueError:
+        return False
+    return next(rule.between(series.start_date, occurrence_date, occurrence_date, series.end_date), None) is not None
+
+
+def upsert_exception(series, occurrence_date, **fields):
+    """1 回分の変更（完了・タイトル・日付・取消）を例外として保存する"""
+    exception = TodoSeriesException.query.filter_by(
+        series_id=series.id, occurrence_date=occurrence_date
+    ).first()
+    if exception is None:
+        exception = TodoSeriesException(series_id=series.id, occurrence_date=occurrence_date)
+        db.session.add(exception)
+    for key, value in fields.items():
+        setattr(exception, key, value)
+    return exception
@@ -0,0 +1,222 @@
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """指定スレッドのスタックを一定間隔でサンプリングし、collapsed 形式で集計する"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def render(self):
+        """flamegraph.pl / speedscope で読める collapsed stacks 形式"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RequestProfiler:
+    """リクエスト単位のオプトイン型プロファイラ
+
+    サンプリング率（PROFILER_SAMPLE_RATE）に当たったリクエスト、または
+    PROFILER_SECRET で署名された X-Debug-Profile ヘッダー付きのリクエストだけを
+    cProfile もしくはスタックサンプラーで計測する。
+    結果は PROFILER_DIR にリング状（最大 PROFILER_MAX_FILES 件）で保存する。
+    """
+
+    HEADER_NAME = "X-Debug-Profile"
+    RESULT_HEADER_NAME = "X-Profile-Id"
+    MODES = ("cprofile", "stack")
+    SIGNATURE_MAX_AGE = 300
+
+    def __init__(self, directory):
+        self.directory = os.getenv('PROFILER_DIR', directory)
+        self.sample_rate = float(os.getenv('PROFILER_SAMPLE_RATE', '0'))
+        self.mode = os.getenv('PROFILER_MODE', 'cprofile').lower()
+        self.interval = float(os.getenv('PROFILER_INTERVAL_MS', '5')) / 1000
+        self.max_files = int(os.getenv('PROFILER_MAX_FILES', '50'))
+        self.secret = os.getenv('PROFILER_SECRET', '')
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # ---------- 有効化判定 ----------
+
+    def sign(self, path, timestamp=None):
+        """X-Debug-Profile ヘッダー値 "<timestamp>:<signature>" を生成する
+
+        末尾に ":stack" / ":cprofile" を付けると計測モードを指定できる。
+        """
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        message = f"{timestamp}:{path}".encode()
+        signature = hmac.new(self.secret.encode(), message, hashlib.sha256).hexdigest()
+        return f"{timestamp}:{signature}"
+
+    def _requested_mode(self):
+        """このリクエストを計測するなら計測モードを、しないなら None を返す"""
+        header = request.headers.get(self.HEADER_NAME)
+        if header and self.secret:
+            parts = header.split(":")
+            if len(parts) >= 2 and parts[0].isdigit():
+                timestamp = int(parts[0])
+                expected = self.sign(request.path, timestamp)
+                fresh = abs(time.time() - timestamp) <= self.SIGNATURE_MAX_AGE
+                if fresh and hmac.compare_digest(f"{parts[0]}:{parts[1]}", expected):
+                    mode = parts[2] if len(parts) > 2 else self.mode
+                    return mode if mode in self.MODES else self.mode
+            logger.warning("Rejected invalid %s header", self.HEADER_NAME)
+
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    # ---------- リクエストフック ----------
+
+    def _before_request(self):
+        mode = self._requested_mode()
+        if mode is None:
+            return
+
+        if mode == "stack":
+            collector = StackSampler(threading.get_ident(), self.interval)
+            collector.start()
+        else:
+            collector = cProfile.Profile()
+            try:
+                collector.enable()
+            except ValueError:
+                # 他のプロファイラが既に動いている場合は計測しない
+                logger.warning("Profiler already active; skipping request profile")
+                return
+        g.request_profile = (mode, collector, time.time())
+
+    def _after_request(self, response):
+        profile_id = self._finish()
+        if profile_id:
+            response.headers[self.RESULT_HEADER_NAME] = profile_id
+        return response
+
+    def _teardown_request(self, exc):
+        # 例外で after_request が呼ばれなかった場合の後始末
+        self._finish()
+
+    def _finish(self):
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            return None
+
+        mode, collector, started_at = profile
+        if mode == "stack":
+            collector.stop()
+        else:
+            collector.disable()
+
+        try:
+            return self._save(mode, collector, started_at)
+        except OSError as e:
+            logger.error("Failed to save request profile: %s", e)
+            return None
+
+    # ---------- 保存（リングバッファ） ----------
+
+    def _save(self, mode, collector, started_at):
+        os.makedirs(self.directory, exist_ok=True)
+        endpoint = (request.endpoint or "unknown").replace(".", "_")
+        extension = "collapsed" if mode == "stack" else "prof"
+        # ファイル名にはクライアントの入力（X-Request-ID など）を入れず、サーバーで生成した値だけを使う。
+        # リクエスト ID との対応は下の保存ログ（request_id 付き）で分かる
+        profile_id = f"{int(started_at * 1000)}-{endpoint}-{uuid.uuid4().hex[:12]}.{extension}"
+        path = os.path.join(self.directory, profile_id)
+
+        if mode == "stack":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(collector.render())
+        else:
+            collector.dump_stats(path)
+
+        self._prune()
+        logger.info("Saved request profile %s", profile_id)
+        return profile_id
+
+    def _prune(self):
+        with self._lock:
+            files = sorted(self._profile_files())
+            for name in files[:max(len(files) - self.max_files, 0)]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _profile_files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory) if name.endswith((".prof", ".collapsed"))]
+
+    def list_profiles(self):
+        """保存済みプロファイルの一覧（新しい順）"""
+        profiles = []
+        for name in sorted(self._profile_files(), reverse=True):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            profiles.append({
+                'id': name,
+                'format': 'collapsed' if name.endswith('.collapsed') else 'pstats',
+                'size': stat.st_size,
+                'created_at': stat.st_mtime,
+            })
+        return profiles
+
+    def profile_path(self, profile_id):
+        """一覧に存在するプロファイルのパスを返す（存在しなければ None）"""
+        if profile_id not in self._profile_files():
+            return None
+        return os.path.join(self.directory, profile_id)
+
+    def get_status(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'mode': self.mode,
+            'interval_ms': self.interval * 1000,
+            'max_files': self.max_files,
+            'signed_header_enabled': bool(self.secret),
+            'directory': self.directory,
+        }
@@ -1,10 +1,25 @@
 from datetime import date, datetime
+import hashlib
+import heapq
+import logging
+import math
 import os
-import requests
-from flask import request, jsonify
-from . import app, db
-from .models import Todo
+import time
+from flask import Blueprint, Response, abort, current_app, request, jsonify, send_file, stream_with_context
+from sqlalchemy import case, func, select
+from . import db, dependencies, ical, ranking, recurrence, scheduling, tenancy, transfer
+from .models import Todo, ArchivedTodo, Tenant, TodoSeries, parse_priority
 from .action_parser import ActionParser
+from .cache import read_cache
+from .chat_gate import ChatRejected
+from .dedupe import MODES
+from .logging_config import log_payload
+from .search import search_todos
+from .serializers import dumps, json_response, row_to_dict, todo_columns, todo_to_dict
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint("api", __name__)
 
 # --------------------------------------
 # ヘルパ関数
@@ -28,27 +43,397 @@ def _parse_iso_date(value):
     except ValueError:
         return None
 
-def _todo_to_dict(todo: Todo):
-    """Todo モデルをフロント側へ返却する dict に変換する"""
-    return {
-        "id": todo.id,
-        "title": todo.title,
-        "date": todo.date.isoformat() if todo.date else None,
-        "done": todo.done,
-    }
+def _is_truthy(value):
+    """クエリパラメータの真偽値を解釈する"""
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+# 繰り返しタスクを展開する期間の上限
+MAX_WINDOW_DAYS = 366
+
+def _parse_window(args, required=False):
+    """start / end クエリ（YYYY-MM-DD）から期間を取得する。
+    指定が無ければ None、不正なら ValueError。"""
+    start, end = args.get("start"), args.get("end")
+    if not start and not end and not required:
+        return None
+    if not start or not end:
+        raise ValueError("start and end are required")
+
+    start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+    if end_date < start_date:
+        raise ValueError("end must not be before start")
+    if (end_date - start_date).days > MAX_WINDOW_DAYS:
+        raise ValueError(f"window must be at most {MAX_WINDOW_DAYS} days")
+    return start_date, end_date
 
 # --------------------------------------
 # ルーティング
 # --------------------------------------
 
-@app.route("/todos", methods=["GET"])
+def _parse_scheduling_fields(data):
+    """スケジューラ用の estimated_minutes / deadline を取り出す（null で解除、不正なら ValueError）"""
+    fields = {}
+    if "estimated_minutes" in data:
+        minutes = data["estimated_minutes"]
+        if minutes is not None:
+            if isinstance(minutes, bool) or not isinstance(minutes, int) or minutes < 0:
+                raise ValueError("estimated_minutes must be a non-negative integer")
+        fields["estimated_minutes"] = minutes
+    if "deadline" in data:
+        deadline = data["deadline"]
+        if deadline not in (None, ""):
+            deadline = _parse_iso_date(str(deadline))
+            if isinstance(deadline, datetime):
+                deadline = deadline.date()
+            if deadline is None:
+                raise ValueError("deadline must be YYYY-MM-DD")
+        fields["deadline"] = deadline or None
+    return fields
+
+
+@api.route("/todos", methods=["GET"])
 def list_todos():
-    """Todo 一覧を id 昇順で返却"""
-    todos = Todo.query.order_by(Todo.id).all()
-    return jsonify([_todo_to_dict(t) for t in todos])
+    """Todo 一覧を id 昇順で返却
+
+    ORM インスタンスを生成せず、必要なカラムだけをタプルで読み出して
+    そのまま JSON にエンコードする。
+    include_archived=true の場合はアーカイブ済みの Todo も
+    "archived": true 付きで id 順に混ぜて返す。
+    start / end を指定した場合はその期間の Todo に加え、期間内に発生する
+    繰り返しタスク（id は null、series_id / occurrence_date 付き）を日付順で末尾に返す。
+    """
+    try:
+        window = _parse_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    include_archived = _is_truthy(request.args.get("include_archived", ""))
+
+    def _windowed(query, model):
+        if window is None:
+            return query
+        return query.where(model.date >= window[0], model.date <= window[1])
+
+    def build():
+        rows = db.session.execute(_windowed(select(*todo_columns(Todo)), Todo).order_by(Todo.id))
+        result = [row_to_dict(row) for row in rows]
+
+        if include_archived:
+            archived_rows = db.session.execute(
+                _windowed(select(*todo_columns(ArchivedTodo)), ArchivedTodo).order_by(ArchivedTodo.id)
+            )
+            archived = [dict(row_to_dict(row), archived=True) for row in archived_rows]
+            result = list(heapq.merge(result, archived, key=lambda t: t["id"]))
+
+        if window is not None:
+            result.extend(o.to_dict() for o in recurrence.expand_occurrences(*window))
+        return dumps(result)
+
+    params = f"{window[0]}..{window[1]}" if window else "all"
+    body = read_cache.fetch("list_todos", f"{params}:{int(include_archived)}", window, build)
+    return Response(body, mimetype="application/json")
+
+
+@api.route("/todos/calendar", methods=["GET"])
+def calendar_summary():
+    """start〜end の日ごとのタスク数・完了数（繰り返しタスクの発生分を含む）"""
+    try:
+        window = _parse_window(request.args, required=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build():
+        rows = db.session.execute(
+            select(Todo.date, func.count(), func.sum(case((Todo.done.is_(True), 1), else_=0)))
+            .where(Todo.date >= window[0], Todo.date <= window[1])
+            .group_by(Todo.date)
+        )
+        days = {day: {"total": total, "done": int(done or 0)} for day, total, done in rows}
+
+        for occurrence in recurrence.expand_occurrences(*window):
+            summary = days.setdefault(occurrence.date, {"total": 0, "done": 0})
+            summary["total"] += 1
+            summary["done"] += 1 if occurrence.done else 0
+
+        return dumps({
+            "start": window[0].isoformat(),
+            "end": window[1].isoformat(),
+            "days": [dict(date=day.isoformat(), **days[day]) for day in sorted(days)],
+        })
+
+    body = read_cache.fetch("calendar", f"{window[0]}..{window[1]}", window, build)
+    return Response(body, mimetype="application/json")
+
+
+def _ics_months(name, default):
+    value = int(request.args.get(name, os.getenv(f"ICS_{name.upper()}_MONTHS", default)))
+    if not 0 <= value <= 60:
+        raise ValueError(f"{name} must be between 0 and 60")
+    return value
+
+
+@api.route("/todos/feed.ics", methods=["GET"])
+def ics_feed():
+    """日付付きの Todo を iCalendar（カレンダーアプリの購読用）で返す
+
+    component=event（既定、VEVENT の終日予定）または todo（VTODO）。
+    今月を基準に past か月前〜future か月後を月ごとに描画してつなげる。
+    カレンダーアプリはヘッダーを付けられないので、テナントは
+    /todos/feed-url が返す署名付き URL（tenant / sig クエリ）でも指定できる。
+    ETag は一覧キャッシュのバージョンから DB を読まずに求めるので、変更が無ければ
+    If-None-Match / If-Modified-Since に対して描画せずに 304 を返す。
+    """
+    component = ical.COMPONENTS.get(request.args.get("component", "event").lower())
+    if component is None:
+        return jsonify({"error": f"component must be one of {', '.join(ical.COMPONENTS)}"}), 400
+    try:
+        past = _ics_months("past", "3")
+        future = _ics_months("future", "12")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if "sig" in request.args:
+        try:
+            tenant_id = int(request.args.get("tenant", ""))
+        except ValueError:
+            return jsonify({"error": "tenant must be an integer"}), 400
+        if not ical.verify_tenant(os.getenv("ICS_FEED_SECRET", ""), tenant_id, request.args["sig"]):
+            return jsonify({"error": "invalid feed signature"}), 403
+    elif tenancy.tenant_header() in request.headers or not tenancy.tenant_required():
+        tenant_id = tenancy.current_tenant_id()
+    else:
+        return jsonify({"error": f"{tenancy.tenant_header()} header or a signed feed URL is required"}), 400
+
+    segments = ical.month_segments(date.today(), past, future)
+    window = (segments[0][0], segments[-1][1])
+    with tenancy.tenant_scope(tenant_id):
+        token = read_cache.version_token(window)
+        if token is None:
+            # キャッシュが無効なら描画した内容から ETag を作る
+            body = b"".join(ical.iter_feed(component, segments))
+            etag = hashlib.sha256(body).hexdigest()[:32]
+        else:
+            body = None
+            etag = hashlib.sha256(f"{tenant_id}:{component}:{window}:{token}".encode()).hexdigest()[:32]
+    last_modified = current_app.ics_versions.last_modified((tenant_id, component, window), etag)
+
+    not_modified = (
+        request.if_none_match.contains(etag) if request.if_none_match
+        else request.if_modified_since is not None and request.if_modified_since >= last_modified
+    )
+    if not_modified:
+        response = Response(status=304)
+    elif body is not None:
+        response = Response(body, mimetype="text/calendar")
+    else:
+        def generate():
+            with tenancy.tenant_scope(tenant_id):
+                yield from ical.iter_feed(component, segments)
+
+        response = Response(stream_with_context(generate()), mimetype="text/calendar")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.route("/todos/feed-url", methods=["GET"])
+def ics_feed_url():
+    """現在のテナントの iCalendar 購読用の署名付き URL（ICS_FEED_SECRET が必要）"""
+    secret = os.getenv("ICS_FEED_SECRET", "")
+    if not secret:
+        return jsonify({"error": "ICS_FEED_SECRET is not configured"}), 404
+    tenant_id = tenancy.current_tenant_id()
+    signature = ical.sign_tenant(secret, tenant_id)
+    return jsonify({"url": f"{request.host_url}todos/feed.ics?tenant={tenant_id}&sig={signature}"})
+
+
+@api.route("/todos/search", methods=["GET"])
+def search_todos_route():
+    """タイトル全文検索（FTS5 trigram）
+
+    q: 検索語（空白区切りで AND）、limit / offset でページング、
+    open_only=true で未完了のみ。関連度 → 日付 → 優先度の順で返す。
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    # 次ページの有無を判定するため 1 件多く取得する
+    rows = search_todos(query, limit=limit + 1, offset=offset,
+                        open_only=_is_truthy(request.args.get("open_only", "")))
+    return json_response({
+        "items": [row_to_dict(row) for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    })
+
+
+@api.route("/todos/next", methods=["GET"])
+def next_todos_route():
+    """次にやるべき未完了タスクの上位 k 件（スコアの高い順）
+
+    score = priority × w_priority + 期日の近さ × w_due + サブタスク完了率 × w_progress
+    重みは NEXT_WEIGHT_* の環境変数が既定値で、クエリパラメータで上書きできる。
+    """
+    try:
+        k = min(max(int(request.args.get("k", 5)), 1), ranking.MAX_K)
+        weights = {}
+        for name in ("priority", "due", "progress", "horizon_days"):
+            param = name if name == "horizon_days" else f"w_{name}"
+            if param in request.args:
+                weights[name] = float(request.args[param])
+    except ValueError:
+        return jsonify({"error": "k must be an integer and weights must be numbers"}), 400
+    # float() は nan / inf も受け付けるので、有限の値だけを許す
+    if not all(math.isfinite(value) for value in weights.values()):
+        return jsonify({"error": "weights must be finite numbers"}), 400
+    if any(value < 0 for value in weights.values()) or weights.get("horizon_days") == 0:
+        return jsonify({"error": "weights must be non-negative and horizon_days positive"}), 400
+
+    ranked = ranking.next_tasks(k, weights=weights)
+    return json_response({
+        "items": [ranking.ranked_to_dict(*entry) for entry in ranked],
+        "k": k,
+        "weights": dict(ranking.default_weights(), **weights),
+    })
+
+
+@api.route("/schedule", methods=["POST"])
+def schedule_route():
+    """未完了タスクに着手日を自動で割り当てる（既定はプレビューのみ）
+
+    body: {"start_date": "YYYY-MM-DD", "capacity_minutes": 480, "default_minutes": 60,
+           "skip_weekends": false, "ids": [...], "apply": false}
+    apply=true のときだけ日付の変更を 1 トランザクションで書き込む。
+    締め切りに間に合わないタスクは infeasible に入る（書き込みは行う）。
+    """
+    data = request.get_json(silent=True) or {}
+
+    start = None
+    if data.get("start_date"):
+        start = _parse_iso_date(str(data["start_date"]))
+        if isinstance(start, datetime):
+            start = start.date()
+        if start is None:
+            return jsonify({"error": "start_date must be YYYY-MM-DD"}), 400
+
+    ids = data.get("ids")
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+
+    try:
+        capacity = int(data["capacity_minutes"]) if data.get("capacity_minutes") is not None else None
+        default_minutes = int(data["default_minutes"]) if data.get("default_minutes") is not None else None
+        plan = scheduling.build_schedule(
+            start=start,
+            capacity_minutes=capacity,
+            default_minutes=default_minutes,
+            skip_weekends=bool(data.get("skip_weekends")),
+            ids=ids,
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = plan.to_dict()
+    result["applied"] = False
+    if data.get("apply"):
+        scheduling.apply_schedule(plan)
+        result["applied"] = True
+    return json_response(result)
+
+
+@api.route("/todos/unblocked", methods=["GET"])
+def unblocked_todos_route():
+    """未完了のブロッカー（依存先）が無く、いま着手できる未完了タスク"""
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    rows = dependencies.unblocked_todos(limit + 1, offset)
+    return json_response({
+        "items": [row_to_dict(row) for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    })
+
+
+@api.route("/todos/<int:todo_id>/dependencies", methods=["GET"])
+def get_dependencies(todo_id):
+    """このタスクをブロックしているタスク（blocked_by）とブロックしているタスク（blocks）"""
+    Todo.query.get_or_404(todo_id)
+    blocked_by, blocks = dependencies.graph.neighbours(todo_id)
+    return jsonify({"id": todo_id, "blocked_by": blocked_by, "blocks": blocks})
+
+
+@api.route("/todos/<int:todo_id>/dependencies", methods=["POST"])
+def add_dependencies(todo_id):
+    """依存関係を追加。body: {"blocked_by": [id, ...]}（閉路になる場合は 409）"""
+    Todo.query.get_or_404(todo_id)
+    data = request.get_json(silent=True) or {}
+    blocker_ids = data.get("blocked_by")
+    if not isinstance(blocker_ids, list) or not blocker_ids or not all(isinstance(i, int) for i in blocker_ids):
+        return jsonify({"error": "blocked_by must be a non-empty list of integers"}), 400
+
+    found = set(db.session.execute(select(Todo.id).where(Todo.id.in_(blocker_ids))).scalars())
+    missing = sorted(set(blocker_ids) - found)
+    if missing:
+        return jsonify({"error": f"tasks not found: {missing}"}), 404
+
+    try:
+        added = dependencies.graph.add_edges([(blocker_id, todo_id) for blocker_id in blocker_ids])
+    except dependencies.DependencyCycleError as e:
+        return jsonify({"error": str(e), "cycle": e.path}), 409
+    except dependencies.DependencyConflictError as e:
+        return jsonify({"error": str(e)}), 503
 
+    blocked_by, blocks = dependencies.graph.neighbours(todo_id)
+    return jsonify({
+        "id": todo_id,
+        "added": [blocker for blocker, _ in added],
+        "blocked_by": blocked_by,
+        "blocks": blocks,
+    }), 201
 
-@app.route("/todos", methods=["POST"])
+
+@api.route("/todos/<int:todo_id>/dependencies/<int:blocker_id>", methods=["DELETE"])
+def delete_dependency(todo_id, blocker_id):
+    Todo.query.get_or_404(todo_id)
+    if not dependencies.graph.remove_edge(blocker_id, todo_id):
+        abort(404)
+    return "", 204
+
+
+@api.route("/todos/<int:todo_id>/critical-path", methods=["GET"])
+def critical_path_route(todo_id):
+    """todo_id 配下（サブタスクを含む）の未完了タスクのクリティカルパス
+
+    見積もり時間（estimated_minutes、未設定は SCHEDULE_DEFAULT_TASK_MINUTES）の
+    合計が最大になる依存関係の経路を、着手順に返す。
+    """
+    Todo.query.get_or_404(todo_id)
+    path, total = dependencies.graph.critical_path(todo_id, scheduling.default_task_minutes())
+    return jsonify({
+        "id": todo_id,
+        "total_minutes": total,
+        "path": [
+            {"id": row.id, "title": row.title, "estimated_minutes": row.estimated_minutes}
+            for row in path
+        ],
+    })
+
+
+@api.route("/todos", methods=["POST"])
 def create_todo():
     """新規 Todo を作成。title は必須。date は ISO‑8601 文字列で任意。
     指定が無い場合は None を保存。"""
@@ -65,14 +450,19 @@ def create_todo():
     else:
         parsed_date = None
 
-    todo = Todo(title=title, date=parsed_date, done=False)
+    try:
+        scheduling_fields = _parse_scheduling_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    todo = Todo(title=title, date=parsed_date, done=False, **scheduling_fields)
     db.session.add(todo)
     db.session.commit()
 
-    return jsonify(_todo_to_dict(todo)), 201
+    return jsonify(todo_to_dict(todo)), 201
 
 
-@app.route("/todos/<int:todo_id>", methods=["PATCH"])
+@api.route("/todos/<int:todo_id>", methods=["PATCH"])
 def update_todo(todo_id):
     """title, done, date の部分更新をサポート"""
     todo = Todo.query.get_or_404(todo_id)
@@ -89,12 +479,18 @@ def update_todo(todo_id):
         if new_date:
             todo.date = new_date
 
+    try:
+        for key, value in _parse_scheduling_fields(data).items():
+            setattr(todo, key, value)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     db.session.commit()
     # 204 だとフロント側が日付変更を即時表示できないので 200 で返す
-    return jsonify(_todo_to_dict(todo))
+    return jsonify(todo_to_dict(todo))
 
 
-@app.route("/todos/<int:todo_id>", methods=["DELETE"])
+@api.route("/todos/<int:todo_id>", methods=["DELETE"])
 def delete_todo(todo_id):
     todo = Todo.query.get_or_404(todo_id)
     db.session.delete(todo)
@@ -102,21 +498,223 @@ def delete_todo(todo_id):
     return "", 204
 
 
-@app.route("/todos/bulk", methods=["POST"])
+@api.route("/todos/export", methods=["GET"])
+def export_todos_route():
+    """全 Todo を NDJSON（既定）または CSV でストリーミング出力"""
+    fmt = request.args.get("format", "ndjson").lower()
+    if fmt not in transfer.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(transfer.FORMATS)}"}), 400
+
+    return Response(
+        stream_with_context(transfer.export_todos(fmt, tenancy.current_tenant_id())),
+        mimetype=transfer.MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=todos.{fmt}"},
+    )
+
+
+@api.route("/todos/stream", methods=["GET"])
+def todo_stream():
+    """Todo の変更を Server-Sent Events で配信する
+
+    イベントは changes（upserted: 作成・更新された Todo、deleted: 削除された id）、
+    invalidate（一括の変更。一覧を再取得する）、reset（取りこぼしがあった。
+    一覧を再取得する）。再接続時は Last-Event-ID ヘッダー（または last_event_id
+    クエリ）以降のイベントを送り直す。
+    """
+    feed = current_app.change_feed
+    if not feed.enabled:
+        return jsonify({"error": "change feed is disabled"}), 404
+
+    subscriber = feed.subscribe(tenancy.current_tenant_id())
+    if subscriber is None:
+        response = jsonify({"error": "too many subscribers"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+
+    body = feed.stream(
+        subscriber,
+        last_event_id=request.headers.get("Last-Event-ID") or request.args.get("last_event_id"),
+        heartbeat=float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15")),
+        max_seconds=float(os.getenv("CHANGE_FEED_MAX_SECONDS", "300")),
+    )
+    return Response(body, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # リバースプロキシでのバッファリングを止める
+        "X-Accel-Buffering": "no",
+    })
+
+
+@api.route("/todos/import", methods=["POST"])
+def import_todos_route():
+    """NDJSON / CSV を逐次読み込んで Todo を取り込む
+
+    format クエリ（省略時は Content-Type で判定）で形式を指定する。
+    id / parent_id は取り込み元の id として扱い、親子関係は新しい id に張り直す。
+    行ごとのエラーは結果の errors に含まれる。
+    """
+    fmt = request.args.get("format")
+    if not fmt:
+        fmt = "csv" if request.mimetype == "text/csv" else "ndjson"
+    fmt = fmt.lower()
+    if fmt not in transfer.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(transfer.FORMATS)}"}), 400
+
+    result = transfer.import_todos(request.stream, fmt)
+    status = 200 if result.imported or not result.failed else 400
+    return jsonify(result.to_dict()), status
+
+
+@api.route("/series", methods=["GET"])
+def list_series():
+    """繰り返しタスクのシリーズ一覧"""
+    return json_response([s.to_dict() for s in TodoSeries.query.order_by(TodoSeries.id).all()])
+
+
+@api.route("/series", methods=["POST"])
+def create_series():
+    """繰り返しタスクを作成。title, rrule, start_date は必須、priority は任意。"""
+    data = request.get_json(silent=True) or {}
+    start_date = _parse_iso_date(str(data["start_date"])) if data.get("start_date") else None
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    try:
+        series = recurrence.create_series(
+            data.get("title"),
+            data.get("rrule"),
+            start_date,
+            data.get("priority", 0),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    db.session.commit()
+    return jsonify(series.to_dict()), 201
+
+
+@api.route("/series/<int:series_id>", methods=["PATCH"])
+def update_series(series_id):
+    """シリーズ全体の title, priority, rrule を更新"""
+    series = TodoSeries.query.get_or_404(series_id)
+    data = request.get_json(silent=True) or {}
+
+    if "title" in data:
+        series.title = (data["title"] or "").strip() or series.title
+    try:
+        if "priority" in data:
+            series.priority = parse_priority(data["priority"])
+        if "rrule" in data:
+            rule = recurrence.RecurrenceRule.parse(data["rrule"])
+            series.rrule = str(rule)
+            series.end_date = rule.end_date(series.start_date)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+    db.session.commit()
+    return jsonify(series.to_dict())
+
+
+@api.route("/series/<int:series_id>", methods=["DELETE"])
+def delete_series(series_id):
+    series = TodoSeries.query.get_or_404(series_id)
+    db.session.delete(series)
+    db.session.commit()
+    return "", 204
+
+
+def _get_occurrence(series_id, occurrence_date):
+    """シリーズと発生日を検証して返す（不正なら 404）"""
+    series = TodoSeries.query.get_or_404(series_id)
+    try:
+        day = date.fromisoformat(occurrence_date)
+    except ValueError:
+        abort(404)
+    if not recurrence.is_occurrence(series, day):
+        abort(404)
+    return series, day
+
+
+@api.route("/series/<int:series_id>/occurrences/<occurrence_date>", methods=["PATCH"])
+def update_occurrence(series_id, occurrence_date):
+    """1 回分だけ done / title / date を変更（シリーズ自体は変更せず例外として保存）"""
+    series, day = _get_occurrence(series_id, occurrence_date)
+    data = request.get_json(silent=True) or {}
+
+    fields = {}
+    if "done" in data:
+        fields["done"] = bool(data["done"])
+    if "title" in data:
+        fields["title"] = (data["title"] or "").strip() or None
+    if "date" in data:
+        fields["date"] = _parse_iso_date(data["date"]) if data["date"] else None
+
+    exception = recurrence.upsert_exception(series, day, **fields)
+    db.session.commit()
+    return jsonify(recurrence.Occurrence(series, day, exception).to_dict())
+
+
+@api.route("/series/<int:series_id>/occurrences/<occurrence_date>", methods=["DELETE"])
+def delete_occurrence(series_id, occurrence_date):
+    """1 回分だけ取り消す"""
+    series, day = _get_occurrence(series_id, occurrence_date)
+    recurrence.upsert_exception(series, day, cancelled=True)
+    db.session.commit()
+    return "", 204
+
+
+@api.route("/todos/bulk", methods=["POST"])
 def bulk_create_todos():
-    """複数のTodoを一括作成"""
+    """複数のTodoを一括作成
+
+    dedupe（off / flag / skip、既定は DEDUPE_MODE）で既存の未完了タスクとの近似重複を扱う。
+    flag では作成した Todo に duplicate_of を付け、skip では重複を作成せず
+    スキップした件数を X-Duplicates-Skipped ヘッダーで返す。
+    """
     data = request.get_json(silent=True) or {}
     todos_data = data.get("todos", [])
     
     if not todos_data:
         return jsonify({"error": "todos is required"}), 400
+
+    mode = str(data.get("dedupe", current_app.duplicate_index.mode)).lower()
+    if mode not in MODES:
+        return jsonify({"error": f"dedupe must be one of: {', '.join(MODES)}"}), 400
+
+    # 親は現在のテナントの Todo に限る（他テナントの Todo の下には作らせない）
+    parent_ids = set()
+    for todo_data in todos_data:
+        parent_id = todo_data.get("parent_id")
+        if parent_id is None:
+            continue
+        if isinstance(parent_id, bool) or not isinstance(parent_id, int):
+            return jsonify({"error": "parent_id must be an integer"}), 400
+        parent_ids.add(parent_id)
+    for parent_id in sorted(parent_ids):
+        if db.session.get(Todo, parent_id) is None:
+            return jsonify({"error": f"parent {parent_id} not found"}), 404
+    
+    # 未完了で作るものだけをまとめて重複判定する
+    checked = [
+        position for position, todo_data in enumerate(todos_data)
+        if mode != "off" and todo_data.get("title", "").strip() and not todo_data.get("done", False)
+    ]
+    matches = current_app.duplicate_index.check_batch([todos_data[p]["title"].strip() for p in checked])
+    duplicate_by_position = dict(zip(checked, matches))
     
     created_todos = []
+    duplicates = []
+    skipped = 0
     
-    for todo_data in todos_data:
+    for position, todo_data in enumerate(todos_data):
         title = todo_data.get("title", "").strip()
         if not title:
             continue
+
+        duplicate = duplicate_by_position.get(position)
+        if duplicate is not None and mode == "skip":
+            skipped += 1
+            continue
         
         # 日付を解析
         date_value = todo_data.get("date")
@@ -134,13 +732,21 @@ def bulk_create_todos():
         )
         db.session.add(todo)
         created_todos.append(todo)
+        duplicates.append(duplicate)
     
     db.session.commit()
-    
-    return jsonify([_todo_to_dict(todo) for todo in created_todos]), 201
+
+    result = [todo_to_dict(todo) for todo in created_todos]
+    for todo_dict, duplicate in zip(result, duplicates):
+        if duplicate is not None:
+            todo_dict["duplicate_of"] = duplicate
+    response = json_response(result, 201)
+    if mode == "skip":
+        response.headers["X-Duplicates-Skipped"] = str(skipped)
+    return response
 
 
-@app.route("/todos/bulk", methods=["PATCH"])
+@api.route("/todos/bulk", methods=["PATCH"])
 def bulk_update_todos():
     """複数のTodoを一括更新"""
     data = request.get_json(silent=True) or {}
@@ -174,20 +780,173 @@ def bulk_update_todos():
     
     db.session.commit()
     
-    return jsonify([_todo_to_dict(todo) for todo in updated_todos])
+    return json_response([todo_to_dict(todo) for todo in updated_todos])
+
+
+MAX_BATCH_OPERATIONS = 500
+
 
+class _BatchError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
 
-@app.route("/chat", methods=["POST"])
+
+def _resolve_batch_id(value, refs):
+    """整数の id、または同じバッチで先に作成したタスクの参照（"$ref"）を id に解決"""
+    if isinstance(value, str) and value.startswith("$"):
+        if value[1:] not in refs:
+            raise _BatchError(400, f"unknown reference {value}")
+        return refs[value[1:]]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise _BatchError(400, "id must be an integer or a $reference")
+    return value
+
+
+def _apply_batch_fields(todo, data, refs):
+    """create / update 共通のフィールド設定"""
+    if "title" in data:
+        title = str(data["title"] or "").strip()
+        if not title:
+            raise _BatchError(400, "title must not be empty")
+        todo.title = title
+    if "date" in data:
+        todo.date = _parse_iso_date(data["date"]) if data["date"] else None
+        if data["date"] and todo.date is None:
+            raise _BatchError(400, "date must be ISO-8601")
+    if "done" in data:
+        todo.done = bool(data["done"])
+    if "priority" in data:
+        try:
+            todo.priority = parse_priority(data["priority"])
+        except ValueError as e:
+            raise _BatchError(400, str(e))
+    if "parent_id" in data:
+        parent_id = None if data["parent_id"] is None else _resolve_batch_id(data["parent_id"], refs)
+        if parent_id is not None and db.session.get(Todo, parent_id) is None:
+            raise _BatchError(404, f"parent {parent_id} not found")
+        todo.parent_id = parent_id
+    try:
+        for key, value in _parse_scheduling_fields(data).items():
+            setattr(todo, key, value)
+    except ValueError as e:
+        raise _BatchError(400, str(e))
+
+
+def _apply_batch_operation(operation, refs):
+    """1 件分の操作を適用して結果を返す（失敗時は _BatchError）"""
+    if not isinstance(operation, dict):
+        raise _BatchError(400, "operation must be an object")
+    op = operation.get("op")
+    data = operation.get("data") or {}
+    if not isinstance(data, dict):
+        raise _BatchError(400, "data must be an object")
+
+    if op == "create":
+        if not str(data.get("title") or "").strip():
+            raise _BatchError(400, "title is required")
+        ref = operation.get("ref")
+        if ref is not None and (not isinstance(ref, str) or not ref or ref in refs):
+            raise _BatchError(400, "ref must be a unique non-empty string")
+        todo = Todo(done=False, priority=0)
+        _apply_batch_fields(todo, data, refs)
+        db.session.add(todo)
+        # 後続の操作から参照できるよう、ここで id を採番する（コミットは最後に 1 回）
+        db.session.flush()
+        if ref is not None:
+            refs[ref] = todo.id
+        return {"status": 201, "todo": todo_to_dict(todo)}
+
+    if op not in ("update", "delete"):
+        raise _BatchError(400, "op must be create, update or delete")
+
+    todo_id = _resolve_batch_id(operation.get("id"), refs)
+    todo = db.session.get(Todo, todo_id)
+    if todo is None:
+        raise _BatchError(404, f"todo {todo_id} not found")
+
+    if op == "update":
+        _apply_batch_fields(todo, data, refs)
+        db.session.flush()
+        return {"status": 200, "todo": todo_to_dict(todo)}
+
+    db.session.delete(todo)
+    db.session.flush()
+    return {"status": 204, "id": todo_id}
+
+
+@api.route("/batch", methods=["POST"])
+def batch():
+    """create / update / delete の操作列を順に 1 トランザクションで適用する
+
+    body: {"operations": [
+        {"op": "create", "ref": "a", "data": {"title": "...", "date": "2025-01-20"}},
+        {"op": "create", "data": {"title": "...", "parent_id": "$a"}},
+        {"op": "update", "id": 12, "data": {"done": true}},
+        {"op": "delete", "id": "$a"}
+    ]}
+    "$ref" で同じバッチ内で先に作成したタスクの id を参照できる。
+    1 件でも失敗したら全体をロールバックし、失敗した操作のステータスで返す。
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"at most {MAX_BATCH_OPERATIONS} operations per batch"}), 400
+
+    refs = {}
+    results = []
+    for index, operation in enumerate(operations):
+        try:
+            result = _apply_batch_operation(operation, refs)
+        except _BatchError as e:
+            db.session.rollback()
+            # 先に成功していた操作も取り消されたので、採番済みの id などは返さない
+            results = [{"index": r["index"], "op": r["op"], "rolled_back": True} for r in results]
+            op = operation.get("op") if isinstance(operation, dict) else None
+            results.append({"index": index, "op": op, "status": e.status, "error": str(e)})
+            return json_response({
+                "applied": False,
+                "failed_index": index,
+                "error": str(e),
+                "results": results,
+            }, e.status)
+        results.append(dict({"index": index, "op": operation["op"]}, **result))
+
+    db.session.commit()
+    return json_response({"applied": True, "refs": refs, "results": results})
+
+
+def _chat_rejected(error):
+    """LLM の呼び出し枠が空いていないときの 429"""
+    logger.warning("Chat request rejected: %s", error.reason)
+    response = jsonify({"error": error.reason, "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@api.route("/chat", methods=["POST"])
 def chat():
     """ChatGPT API を呼び出してレスポンスを返す"""
+    # requests は OpenAI を呼ぶときにしか使わないので、起動時には読み込まない
+    import requests
+
     try:
         data = request.get_json(silent=True) or {}
-        print(f"Received data: {data}")  # デバッグログ
+        log_payload(logger, "chat request payload", data)
         
         messages = data.get("messages", [])
         if not messages:
-            print("No messages provided")  # デバッグログ
+            logger.info("No messages provided")
             return jsonify({"error": "messages is required"}), 400
+
+        # 古いやり取りを要約に畳み込み、会話履歴をトークン予算内に収める
+        messages, history_stats = current_app.chat_history.compact(
+            messages, namespace=str(tenancy.current_tenant_id()),
+        )
+        logger.info("Chat history compacted", extra={'fields': history_stats})
         
         # 現在月のタスク情報を取得してsystemプロンプトに追加
         current_month_tasks = data.get("current_month_tasks", "")
@@ -212,9 +971,11 @@ def chat():
   "new_tasks": [
     {{"title": "サブタスク1", "date": "2025-01-20", "priority": 1}},
     {{"title": "サブタスク2", "date": "2025-01-22", "priority": 2}}
-  ]
+  ],
+  "sequential": true
 }}
 ```
+sequential を true にすると new_tasks の順に前のタスクが終わるまで次に着手できない依存関係を作ります（順序が無関係なら省略）。
 
 ### 期限調整の場合：
 ```json
@@ -239,6 +1000,21 @@ def chat():
 }}
 ```
 
+タスクIDが分からない場合は "task_id" の代わりに "task_title" にタスク名を指定できます（タイトル検索で最も一致するタスクが選ばれます）。
+
+### 繰り返しタスク作成の場合：
+```json
+{{
+  "type": "create_recurring_task",
+  "title": "ゴミ出し",
+  "rrule": "FREQ=WEEKLY;BYDAY=MO,TH",
+  "start_date": "2025-01-20",
+  "priority": 1
+}}
+```
+rrule は FREQ（DAILY/WEEKLY/MONTHLY/YEARLY）、INTERVAL、BYDAY、BYMONTHDAY、COUNT、UNTIL に対応しています。
+繰り返しのタスクは1回ずつ create_tasks で作らず、必ずこの形式を使ってください。
+
 ### 日付の指定について：
 - ISO形式: "2025-01-20"
 - 日本語: "2025年1月20日"
@@ -249,48 +1025,60 @@ def chat():
             }
             # systemプロンプトをmessagesの先頭に挿入
             messages = [system_prompt] + messages
-            print(f"Added system prompt with {len(current_month_tasks)} chars of task context")  # デバッグログ
+            logger.debug("Added system prompt with %d chars of task context", len(current_month_tasks))
         
         # 環境変数からOpenAI設定を取得
         openai_key = os.getenv('OPENAI_API_KEY')
         openai_model = os.getenv('OPENAI_MODEL', 'gpt-4o-2024-08-06')
         mock_mode = os.getenv('CHAT_MOCK_MODE', 'false').lower() == 'true'
         
-        print(f"OpenAI key configured: {bool(openai_key)}")  # デバッグログ
-        print(f"OpenAI model: {openai_model}")  # デバッグログ
-        print(f"Mock mode: {mock_mode}")  # デバッグログ
+        logger.debug(
+            "OpenAI settings",
+            extra={'fields': {'key_configured': bool(openai_key), 'model': openai_model, 'mock_mode': mock_mode}},
+        )
         
+        # LLM の呼び出しは同時実行数を制限し、空きが無ければ 429 で早めに断る
+        client_key = f"{tenancy.current_tenant_id()}:{request.remote_addr}"
+
         # モックモードまたはAPIキーが設定されていない場合
         if mock_mode or not openai_key or openai_key == 'your_openai_api_key_here':
-            print("Using mock response")  # デバッグログ
-            # モックレスポンスを返す
+            logger.debug("Using mock response")
+            # モックレスポンスを返す（CHAT_MOCK_LATENCY_MS で LLM の待ち時間を模擬できる）
             user_message = messages[-1]['content'] if messages else "Hello"
+            mock_latency = float(os.getenv('CHAT_MOCK_LATENCY_MS', '0')) / 1000
             mock_reply = f"これはモックレスポンスです。あなたのメッセージ「{user_message}」を受け取りました。実際のOpenAI APIを使用するには、backend/.envファイルでOPENAI_API_KEYを設定し、CHAT_MOCK_MODEをfalseにしてください。"
+            try:
+                current_app.chat_gate.run(client_key, lambda: time.sleep(mock_latency))
+            except ChatRejected as e:
+                return _chat_rejected(e)
             return jsonify({"reply": mock_reply})
         
-        print(f"Sending {len(messages)} messages to OpenAI")  # デバッグログ
+        logger.info("Sending %d messages to OpenAI", len(messages))
         
-        # OpenAI API を呼び出し
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {openai_key}',
-            },
-            json={
-                'model': openai_model,
-                'messages': messages,
-                'temperature': 0.7,
-            },
-            timeout=30
-        )
+        # OpenAI API を呼び出し（専用スレッドで実行し、このスレッドは結果を待つ）
+        try:
+            response = current_app.chat_gate.run(client_key, lambda: requests.post(
+                'https://api.openai.com/v1/chat/completions',
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {openai_key}',
+                },
+                json={
+                    'model': openai_model,
+                    'messages': messages,
+                    'temperature': 0.7,
+                },
+                timeout=30
+            ))
+        except ChatRejected as e:
+            return _chat_rejected(e)
         
-        print(f"OpenAI response status: {response.status_code}")  # デバッグログ
+        logger.info("OpenAI response status: %s", response.status_code)
         
         if response.status_code == 200:
             data = response.json()
             reply = data['choices'][0]['message']['content']
-            print(f"OpenAI reply received: {len(reply)} chars")  # デバッグログ
+            logger.debug("OpenAI reply received: %d chars", len(reply))
             
             # アクション解析と実行
             action_parser = ActionParser()
@@ -309,19 +1097,17 @@ def chat():
                 })
         else:
             error_text = response.text
-            print(f"OpenAI API error: {response.status_code} - {error_text}")  # デバッグログ
+            logger.error("OpenAI API error: %s - %s", response.status_code, error_text)
             return jsonify({"error": f"OpenAI API error {response.status_code}: {error_text}"}), 500
             
     except requests.exceptions.Timeout:
-        print("OpenAI API timeout")  # デバッグログ
+        logger.warning("OpenAI API timeout")
         return jsonify({"error": "OpenAI API timeout"}), 500
     except requests.exceptions.RequestException as e:
-        print(f"Request error: {str(e)}")  # デバッグログ
+        logger.error("Request error: %s", e)
         return jsonify({"error": f"Request error: {str(e)}"}), 500
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")  # デバッグログ
-        import traceback
-        traceback.print_exc()  # スタックトレースも出力
+        logger.exception("Unexpected error: %s", e)  # スタックトレースも出力
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 
@@ -329,14 +1115,14 @@ def chat():
 # デバッグ・通知エンドポイント
 # --------------------------------------
 
-@app.route("/debug/send-notification", methods=["POST"])
+@api.route("/debug/send-notification", methods=["POST"])
 def debug_send_notification():
     """デバッグ用：手動でLINE通知を送信"""
     try:
-        if not hasattr(app, 'scheduler') or app.scheduler is None:
+        if not hasattr(current_app, 'scheduler') or current_app.scheduler is None:
             return jsonify({"error": "Scheduler not initialized"}), 500
             
-        result = app.scheduler.send_test_notification()
+        result = current_app.scheduler.send_test_notification()
         
         if result:
             return jsonify({"message": "Test notification sent successfully"}), 200
@@ -344,19 +1130,60 @@ def debug_send_notification():
             return jsonify({"error": "Failed to send test notification"}), 500
             
     except Exception as e:
-        print(f"Debug notification error: {str(e)}")
+        logger.exception("Debug notification error: %s", e)
         return jsonify({"error": f"Error: {str(e)}"}), 500
 
 
-@app.route("/debug/scheduler-status", methods=["GET"])  
+@api.route("/debug/chat-gate", methods=["GET"])
+def debug_chat_gate():
+    """デバッグ用：/chat の同時実行数・待ち行列・拒否数"""
+    return jsonify(current_app.chat_gate.get_status())
+
+
+@api.route("/debug/chat-history", methods=["GET"])
+def debug_chat_history():
+    """デバッグ用：会話履歴の圧縮で削減したトークン数・要約キャッシュの状態"""
+    return jsonify(current_app.chat_history.get_status())
+
+
+@api.route("/debug/change-feed", methods=["GET"])
+def debug_change_feed():
+    """デバッグ用：変更フィードの購読者数・配信数・取りこぼし"""
+    return jsonify(current_app.change_feed.get_status())
+
+
+@api.route("/debug/dedupe", methods=["GET"])
+def debug_dedupe():
+    """デバッグ用：重複検出の索引の件数・検索数・検出数"""
+    return jsonify(current_app.duplicate_index.get_status())
+
+
+@api.route("/debug/cache", methods=["GET", "POST"])
+def debug_cache():
+    """デバッグ用：一覧キャッシュのヒット率と使用量（POST で統計をリセット、clear=true で中身も破棄）"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        read_cache.reset_stats()
+        if data.get("clear") and read_cache.enabled:
+            read_cache.backend.clear()
+    return jsonify(read_cache.get_status())
+
+
+@api.route("/debug/dependency-graph", methods=["GET"])
+def debug_dependency_graph():
+    """デバッグ用：依存関係グラフのキャッシュの状態"""
+    return jsonify(dependencies.graph.get_status())
+
+
+@api.route("/debug/scheduler-status", methods=["GET"])  
 def debug_scheduler_status():
     """デバッグ用：スケジューラーの状態を取得"""
     try:
-        if not hasattr(app, 'scheduler') or app.scheduler is None:
+        if not hasattr(current_app, 'scheduler') or current_app.scheduler is None:
             return jsonify({"error": "Scheduler not initialized"}), 500
             
-        status = app.scheduler.get_status()
-        jobs = app.scheduler.get_jobs()
+        status = current_app.scheduler.get_status()
+        jobs = current_app.scheduler.get_jobs()
         
         return jsonify({
             "status": status,
@@ -364,58 +1191,129 @@ def debug_scheduler_status():
         }), 200
         
     except Exception as e:
-        print(f"Debug status error: {str(e)}")
+        logger.exception("Debug status error: %s", e)
         return jsonify({"error": f"Error: {str(e)}"}), 500
 
 
-@app.route("/webhook", methods=["POST"])
+@api.route("/debug/archive", methods=["POST"])
+def debug_run_archive():
+    """デバッグ用：完了済みタスクのアーカイブを手動実行"""
+    try:
+        if not hasattr(current_app, 'scheduler') or current_app.scheduler is None:
+            return jsonify({"error": "Scheduler not initialized"}), 500
+
+        archived = current_app.scheduler.run_archive()
+        return jsonify({"archived": archived}), 200
+
+    except Exception as e:
+        logger.exception("Debug archive error: %s", e)
+        return jsonify({"error": f"Error: {str(e)}"}), 500
+
+
+@api.route("/debug/sql-profiler", methods=["GET", "POST"])
+def debug_sql_profiler():
+    """デバッグ用：SQLプロファイラの状態取得・実行時切り替え"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            current_app.sql_profiler.configure(
+                enabled=data.get("enabled"),
+                sample_rate=data.get("sample_rate"),
+                slow_query_ms=data.get("slow_query_ms"),
+                n_plus_one_threshold=data.get("n_plus_one_threshold"),
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid profiler setting: {str(e)}"}), 400
+
+    return jsonify(current_app.sql_profiler.get_status()), 200
+
+
+@api.route("/debug/profiles", methods=["GET"])
+def debug_list_profiles():
+    """デバッグ用：保存済みのリクエストプロファイル一覧"""
+    return jsonify({
+        "status": current_app.request_profiler.get_status(),
+        "profiles": current_app.request_profiler.list_profiles(),
+    }), 200
+
+
+@api.route("/debug/profiles/<profile_id>", methods=["GET"])
+def debug_get_profile(profile_id):
+    """デバッグ用：プロファイル（pstats / collapsed stacks）をダウンロード"""
+    path = current_app.request_profiler.profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "profile not found"}), 404
+    return send_file(path, as_attachment=True, download_name=profile_id)
+
+
+def _tenant_for_line_user(line_user_id):
+    """LINE ユーザーのテナントを返す（無ければ作成）。戻り値は (tenant, created)"""
+    tenant = Tenant.query.filter_by(line_user_id=line_user_id).first()
+    if tenant is not None:
+        return tenant, False
+    tenant = Tenant(line_user_id=line_user_id)
+    db.session.add(tenant)
+    db.session.commit()
+    logger.info("Registered tenant %d for LINE user", tenant.id)
+    return tenant, True
+
+
+@api.route("/tenants", methods=["POST"])
+def create_tenant():
+    """テナントを作成する。body: {"name": "...", "line_user_id": "U..."}（どちらも任意）"""
+    data = request.get_json(silent=True) or {}
+    line_user_id = data.get("line_user_id") or None
+    if line_user_id is not None and Tenant.query.filter_by(line_user_id=line_user_id).first():
+        return jsonify({"error": "line_user_id is already registered"}), 409
+    tenant = Tenant(name=(data.get("name") or "").strip() or None, line_user_id=line_user_id)
+    db.session.add(tenant)
+    db.session.commit()
+    return jsonify(tenant.to_dict()), 201
+
+
+@api.route("/tenants/current", methods=["GET"])
+def current_tenant():
+    """リクエストのテナント（X-Tenant-ID）"""
+    tenant = db.session.get(Tenant, tenancy.current_tenant_id())
+    if tenant is None:
+        return jsonify({"error": "tenant not found", "id": tenancy.current_tenant_id()}), 404
+    return jsonify(tenant.to_dict())
+
+
+@api.route("/webhook", methods=["POST"])
 def webhook():
     """LINE Webhook - User IDを取得するための一時的なエンドポイント"""
-    import sys
     try:
-        # Get raw data first
-        raw_data = request.get_data(as_text=True)
-        print(f"=== RAW WEBHOOK DATA ===", flush=True)
-        sys.stdout.flush()
-        print(raw_data, flush=True)
-        sys.stdout.flush()
-        print("========================", flush=True)
-        sys.stdout.flush()
-        
         body = request.get_json()
-        print("=== LINE Webhook Event ===", flush=True)
-        sys.stdout.flush()
-        print(f"Request body: {body}", flush=True)
-        sys.stdout.flush()
-        
+        log_payload(logger, "LINE webhook payload", request.get_data(as_text=True))
+
         if body and 'events' in body:
             for event in body['events']:
-                print(f"Processing event: {event}", flush=True)
-                sys.stdout.flush()
+                logger.debug("Processing webhook event", extra={'fields': {'event_type': event.get('type')}})
                 if 'source' in event and 'userId' in event['source']:
                     user_id = event['source']['userId']
-                    print(f"*** USER ID FOUND: {user_id} ***", flush=True)
-                    sys.stdout.flush()
-                    
+                    logger.info("LINE user ID found: %s", user_id)
+
                     # User IDをファイルに保存
                     with open('/tmp/user_id.txt', 'w') as f:
                         f.write(user_id)
-                    
+
+                    # 初めての LINE ユーザーはテナントとして登録する（日次通知の送り先になる）
+                    tenant, created = _tenant_for_line_user(user_id)
+
                     # メッセージイベントの場合、確認メッセージを送信
                     if event['type'] == 'message':
-                        print(f"Sending confirmation message for User ID: {user_id}", flush=True)
-                        sys.stdout.flush()
+                        logger.info("Sending confirmation message for User ID: %s", user_id)
                         # LINE Bot APIを使って確認メッセージを送信
-                        if hasattr(app, 'scheduler') and app.scheduler and app.scheduler.line_service.enabled:
-                            confirmation_msg = f"✅ User IDを取得しました！\nYour User ID: {user_id}\n\nこのIDを.envファイルのLINE_USER_IDに設定してください。"
-                            app.scheduler.line_service.send_custom_notification(confirmation_msg)
+                        if hasattr(current_app, 'scheduler') and current_app.scheduler and current_app.scheduler.line_service.enabled:
+                            status = "登録しました" if created else "登録済みです"
+                            confirmation_msg = f"✅ User IDを取得しました！\nYour User ID: {user_id}\nTenant ID: {tenant.id}（{status}）\n\nアプリからは {tenancy.tenant_header()}: {tenant.id} を付けてアクセスしてください。"
+                            current_app.scheduler.line_service.send_custom_notification(confirmation_msg, user_id)
         else:
-            print("No events found in webhook body", flush=True)
-            sys.stdout.flush()
-                
+            logger.info("No events found in webhook body")
+
         return jsonify({"status": "ok"}), 200
-        
+
     except Exception as e:
-        print(f"Webhook error: {str(e)}", flush=True)
-        sys.stdout.flush()
+        logger.exception("Webhook error: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -1,21 +1,34 @@
 import os
+from contextlib import nullcontext
 from datetime import datetime
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor
 import atexit
+import logging
 from .line_service import LineNotificationService
 
+logger = logging.getLogger(__name__)
+
 
 class NotificationScheduler:
     """タスク通知のスケジューラー"""
     
-    def __init__(self):
-        """スケジューラーを初期化"""
+    def __init__(self, app=None):
+        """スケジューラーを初期化
+
+        app を渡すと、ジョブはそのアプリケーションコンテキスト内で実行される
+        （DB にアクセスするジョブに必要）。
+        """
+        self.app = app
         self.scheduler = None
         self.line_service = LineNotificationService()
         self.enabled = os.getenv('NOTIFICATION_SCHEDULER_ENABLED', 'true').lower() == 'true'
+        self.archive_enabled = os.getenv('ARCHIVE_ENABLED', 'true').lower() == 'true'
+        self.archive_after_days = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+        self.archive_batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+        self.archive_batch_pause = float(os.getenv('ARCHIVE_BATCH_PAUSE_MS', '50')) / 1000
         
         if self.enabled:
             # BackgroundSchedulerを設定
@@ -34,14 +47,14 @@ class NotificationScheduler:
                 timezone='Asia/Tokyo'  # 日本時間
             )
             
-            print("Notification scheduler initialized.")
+            logger.info("Notification scheduler initialized.")
         else:
-            print("Notification scheduler is disabled.")
+            logger.warning("Notification scheduler is disabled.")
     
     def start(self):
         """スケジューラーを開始"""
         if not self.enabled or not self.scheduler:
-            print("Scheduler is disabled or not initialized.")
+            logger.warning("Scheduler is disabled or not initialized.")
             return
         
         try:
@@ -53,56 +66,90 @@ class NotificationScheduler:
                 name='Daily Task Notification',
                 replace_existing=True
             )
+
+            # 毎日3:00に古い完了済みタスクをアーカイブするジョブを追加
+            if self.archive_enabled:
+                self.scheduler.add_job(
+                    func=self._archive_completed_tasks,
+                    trigger=CronTrigger(hour=3, minute=0),
+                    id='archive_completed',
+                    name='Archive Completed Tasks',
+                    replace_existing=True
+                )
             
             # スケジューラーを開始
             self.scheduler.start()
-            print("Notification scheduler started. Daily notifications at 8:00 AM JST.")
+            logger.info("Notification scheduler started. Daily notifications at 8:00 AM JST.")
             
             # アプリケーション終了時にスケジューラーを停止
             atexit.register(self.shutdown)
             
         except Exception as e:
-            print(f"Error starting scheduler: {e}")
+            logger.exception(f"Error starting scheduler: {e}")
     
     def shutdown(self):
         """スケジューラーを停止"""
         if self.scheduler and self.scheduler.running:
             self.scheduler.shutdown()
-            print("Notification scheduler shutdown.")
+            logger.info("Notification scheduler shutdown.")
     
+    def _app_context(self):
+        """ジョブ実行用のアプリケーションコンテキスト"""
+        return self.app.app_context() if self.app is not None else nullcontext()
+
     def _send_daily_notification(self):
         """日次通知を送信（内部メソッド）"""
         try:
-            print(f"Sending daily notification at {datetime.now()}")
-            result = self.line_service.send_daily_task_notification()
+            logger.info(f"Sending daily notification at {datetime.now()}")
+            with self._app_context():
+                sent, failed = self.line_service.send_daily_notifications()
             
-            if result:
-                print("Daily notification sent successfully.")
+            if failed:
+                logger.error("Failed to send daily notification to %d tenants.", failed)
             else:
-                print("Failed to send daily notification.")
+                logger.info("Daily notification sent successfully to %d tenants.", sent)
                 
         except Exception as e:
-            print(f"Error in daily notification job: {e}")
+            logger.exception(f"Error in daily notification job: {e}")
     
+    def _archive_completed_tasks(self):
+        """古い完了済みタスクをアーカイブ（内部メソッド）"""
+        try:
+            self.run_archive()
+        except Exception as e:
+            logger.exception(f"Error in archive job: {e}")
+
+    def run_archive(self, max_batches=None):
+        """完了から archive_after_days 日以上経ったタスクを小バッチでアーカイブ"""
+        from .archive import archive_completed_todos
+
+        with self._app_context():
+            return archive_completed_todos(
+                older_than_days=self.archive_after_days,
+                batch_size=self.archive_batch_size,
+                max_batches=max_batches,
+                pause=self.archive_batch_pause,
+            )
+
     def send_test_notification(self):
         """テスト通知を送信（デバッグ用）- 本番の日次通知メソッドを使用"""
         try:
             jst = pytz.timezone('Asia/Tokyo')
             now_jst = datetime.now(jst)
-            print(f"Sending test notification (using production method) at {now_jst}")
+            logger.info(f"Sending test notification (using production method) at {now_jst}")
             
             # 本番の日次通知メソッドを直接呼び出し
             result = self.line_service.send_daily_task_notification()
             
             if result:
-                print("Test notification (production method) sent successfully.")
+                logger.info("Test notification (production method) sent successfully.")
                 return True
             else:
-                print("Failed to send test notification (production method).")
+                logger.error("Failed to send test notification (production method).")
                 return False
                 
         except Exception as e:
-            print(f"Error in test notification (production method): {e}")
+            logger.exception(f"Error in test notification (production method): {e}")
             return False
     
     def get_jobs(self):
@@ -127,5 +174,10 @@ class NotificationScheduler:
             'enabled': self.enabled,
             'running': self.scheduler.running if self.scheduler else False,
             'jobs_count': len(self.scheduler.get_jobs()) if self.scheduler else 0,
+            'archive': {
+                'enabled': self.archive_enabled,
+                'after_days': self.archive_after_days,
+                'batch_size': self.archive_batch_size,
+            },
             'line_service_status': self.line_service.get_status()
         }
\ No newline at end of file
@@ -0,0 +1,202 @@
+import logging
+import os
+from datetime import date, timedelta
+from sqlalchemy import exists, select, update
+from sqlalchemy.orm import aliased
+from . import db
+from .models import Todo
+
+logger = logging.getLogger(__name__)
+
+
+def default_capacity_minutes():
+    """1 日に割り当てられる作業時間（分）"""
+    return int(os.getenv("SCHEDULE_DAILY_CAPACITY_MINUTES", "480"))
+
+
+def default_task_minutes():
+    """見積もりが無いタスクの所要時間（分）"""
+    return int(os.getenv("SCHEDULE_DEFAULT_TASK_MINUTES", "60"))
+
+
+def max_schedule_days():
+    """start_date から割り当てられる最大の日数（これを超える計画はエラーにする）"""
+    return int(os.getenv("SCHEDULE_MAX_DAYS", "3660"))
+
+
+class SchedulePlan:
+    """スケジュール計算の結果（割り当てと締め切りに間に合わないタスク）"""
+
+    def __init__(self, start, capacity_minutes):
+        self.start = start
+        self.capacity_minutes = capacity_minutes
+        self.assignments = []
+        self.infeasible = []
+
+    @property
+    def changes(self):
+        """日付が変わるタスクだけ"""
+        return [a for a in self.assignments if a["date"] != a["previous_date"]]
+
+    @property
+    def end(self):
+        return max((a["finish"] for a in self.assignments), default=self.start)
+
+    def to_dict(self):
+        return {
+            "start_date": self.start.isoformat(),
+            "end_date": self.end.isoformat(),
+            "capacity_minutes": self.capacity_minutes,
+            "scheduled": len(self.assignments),
+            "changes": [_assignment_to_dict(a) for a in self.changes],
+            "infeasible": [_assignment_to_dict(a) for a in self.infeasible],
+        }
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _assignment_to_dict(assignment):
+    return {
+        "id": assignment["id"],
+        "title": assignment["title"],
+        "date": _iso(assignment["date"]),
+        "previous_date": _iso(assignment["previous_date"]),
+        "finish": _iso(assignment["finish"]),
+        "deadline": _iso(assignment["deadline"]),
+        "estimated_minutes": assignment["minutes"],
+        "priority": assignment["priority"],
+        "days_late": assignment["days_late"],
+    }
+
+
+def _next_workday(day, skip_weekends):
+    day += timedelta(days=1)
+    while skip_weekends and day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def _schedulable_tasks(ids=None):
+    """スケジュール対象（未完了で、未完了のサブタスクを持たないタスク）をカラム射影で読む"""
+    child = aliased(Todo)
+    query = select(
+        Todo.id, Todo.title, Todo.date, Todo.deadline, Todo.priority, Todo.estimated_minutes
+    ).where(
+        Todo.done.is_not(True),
+        ~exists().where(child.parent_id == Todo.id, child.done.is_not(True)),
+    )
+    if ids is not None:
+        query = query.where(Todo.id.in_(ids))
+    return db.session.execute(query).all()
+
+
+def build_schedule(start=None, capacity_minutes=None, default_minutes=None, skip_weekends=False, ids=None):
+    """未完了タスクに着手日を割り当てる（Earliest Deadline First + 日ごとの容量で貪欲に詰める）
+
+    締め切り（deadline、無ければ既存の date を締め切りとみなす）の早い順、同じなら
+    priority の高い順に並べ、start から 1 日 capacity_minutes ずつ順に詰めていく。
+    1 日に収まらないタスクは翌日以降にまたがる（date は着手日、finish は終了日）。
+    締め切りの無いタスクは最後にまとめて priority 順に入る。
+
+    計画が start から SCHEDULE_MAX_DAYS 日を超える場合は ValueError にする。
+
+    並べ替えが O(n log n)、詰める処理は O(n + 日数)。単一作業者の EDF は最大遅延を
+    最小にするので、ここで遅れが出るならどの順序でも全件を締め切りに間に合わせることはできない。
+    """
+    start = start or date.today()
+    horizon_days = max_schedule_days()
+    # 計画の終わり（と週末の読み飛ばし）が date の範囲を超えないように
+    if start > date.max - timedelta(days=horizon_days + 7):
+        raise ValueError("start_date is too far in the future")
+    while skip_weekends and start.weekday() >= 5:
+        start += timedelta(days=1)
+    horizon = start + timedelta(days=horizon_days)
+    capacity = default_capacity_minutes() if capacity_minutes is None else capacity_minutes
+    fallback_minutes = default_task_minutes() if default_minutes is None else default_minutes
+    if capacity <= 0:
+        raise ValueError("capacity_minutes must be positive")
+    if fallback_minutes < 0:
+        raise ValueError("default_minutes must be non-negative")
+
+    # Row の属性アクセスは遅いので、ソートキー付きのタプルに一度だけ展開する
+    tasks = []
+    for todo_id, title, todo_date, deadline, priority, minutes in _schedulable_tasks(ids):
+        effective_deadline = deadline or todo_date
+        tasks.append((
+            effective_deadline is None, effective_deadline or date.max, -(priority or 0), todo_id,
+            title, todo_date, deadline is not None, minutes,
+        ))
+    tasks.sort()
+
+    plan = SchedulePlan(start, capacity)
+    day = start
+    remaining = capacity
+
+    for no_deadline, deadline, neg_priority, todo_id, title, todo_date, has_deadline_column, minutes in tasks:
+        minutes = max(fallback_minutes if minutes is None else minutes, 0)
+        if remaining == 0:
+            day = _next_workday(day, skip_weekends)
+            remaining = capacity
+        start_day = day
+
+        needed = minutes
+        while needed > remaining:
+            needed -= remaining
+            day = _next_workday(day, skip_weekends)
+            remaining = capacity
+            if day > horizon:
+                raise ValueError(
+                    f"schedule does not fit within {horizon_days} days; increase capacity_minutes"
+                )
+        remaining -= needed
+
+        if no_deadline:
+            deadline = None
+        days_late = (day - deadline).days if deadline is not None and day > deadline else 0
+        assignment = {
+            "id": todo_id,
+            "title": title,
+            "date": start_day,
+            "previous_date": todo_date,
+            "finish": day,
+            "deadline": deadline,
+            "has_deadline_column": has_deadline_column,
+            "minutes": minutes,
+            "priority": -neg_priority,
+            "days_late": days_late,
+        }
+        plan.assignments.append(assignment)
+        if days_late:
+            plan.infeasible.append(assignment)
+
+    return plan
+
+
+def apply_schedule(plan):
+    """計算したスケジュールの日付変更を 1 トランザクションで書き込む
+
+    締め切りを既存の date から推定したタスクは、date を上書きする前に
+    その日付を deadline に移して締め切りを失わないようにする。
+    """
+    params = []
+    for assignment in plan.changes:
+        values = {"id": assignment["id"], "date": assignment["date"]}
+        if not assignment["has_deadline_column"] and assignment["deadline"] is not None:
+            values["deadline"] = assignment["deadline"]
+        params.append(values)
+
+    try:
+        # キーの組み合わせごとに executemany でまとめて UPDATE する
+        for keys in ({"id", "date"}, {"id", "date", "deadline"}):
+            batch = [values for values in params if set(values) == keys]
+            if batch:
+                db.session.execute(update(Todo), batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info("Applied schedule: %d date changes (%d infeasible)", len(params), len(plan.infeasible))
+    return len(params)
@@ -0,0 +1,134 @@
+import logging
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from . import db
+from .serializers import TODO_FIELDS
+from .tenancy import current_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# trigram トークナイザは 3 文字未満の語をインデックスで引けない
+MIN_FTS_TERM_LENGTH = 3
+
+_state = {'fts_available': False}
+
+_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5(
+        title, content='todos', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_ai AFTER INSERT ON todos BEGIN
+        INSERT INTO todos_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_ad AFTER DELETE ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_au AFTER UPDATE OF title ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO todos_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+]
+
+
+def ensure_search_index(db):
+    """タイトル検索用の FTS5（trigram）仮想テーブルと同期トリガーを用意する
+
+    todos の INSERT / UPDATE / DELETE はトリガーで todos_fts に反映される。
+    テーブルを新規作成した場合は既存行からインデックスを再構築する。
+    FTS5 / trigram が使えない SQLite では LIKE 検索にフォールバックする。
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'todos_fts'")
+            ).first()
+            for ddl in _FTS_DDL:
+                conn.execute(text(ddl))
+            if not exists:
+                conn.execute(text("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')"))
+                logger.info("Built todos_fts search index")
+    except OperationalError as e:
+        logger.warning("FTS5 trigram search is unavailable, falling back to LIKE: %s", e)
+        _state['fts_available'] = False
+        return False
+
+    _state['fts_available'] = True
+    return True
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_todos(query, limit=20, offset=0, open_only=False):
+    """タイトルで Todo を検索する
+
+    現在のテナントの Todo のうち、空白区切りの各語をすべて含むものを
+    関連度（bm25）→ 日付 → 優先度の順で返す。
+    3 文字以上の語は FTS インデックスで絞り込み、短い語は LIKE で追加絞り込みする。
+    戻り値は TODO_FIELDS 順のタプルのリスト。
+    """
+    terms = [term for term in query.split() if term]
+    if not terms:
+        return []
+
+    long_terms = [t for t in terms if len(t) >= MIN_FTS_TERM_LENGTH]
+    short_terms = [t for t in terms if len(t) < MIN_FTS_TERM_LENGTH]
+    use_fts = _state['fts_available'] and bool(long_terms)
+
+    columns = ", ".join(f"t.{name}" for name in TODO_FIELDS)
+    params = {'limit': limit, 'offset': offset, 'tenant_id': current_tenant_id()}
+    # text() にはテナントの自動スコープが掛からないので明示する
+    conditions = ["t.tenant_id = :tenant_id"]
+
+    if use_fts:
+        source = "todos_fts f JOIN todos t ON t.id = f.rowid"
+        conditions.append("todos_fts MATCH :match")
+        # FTS のインデックスは全テナント共通なので、テナントの id の範囲で rowid を絞り
+        # ほかのテナントのヒットを読み飛ばす（ix_todos_tenant_id で min / max を引く）
+        conditions.append("f.rowid >= (SELECT min(id) FROM todos WHERE tenant_id = :tenant_id)")
+        conditions.append("f.rowid <= (SELECT max(id) FROM todos WHERE tenant_id = :tenant_id)")
+        params['match'] = " ".join(_fts_phrase(t) for t in long_terms)
+        like_terms = short_terms
+        rank = "bm25(todos_fts), "
+    else:
+        source = "todos t"
+        like_terms = terms
+        rank = ""
+
+    for i, term in enumerate(like_terms):
+        conditions.append(f"t.title LIKE :like{i} ESCAPE '\\'")
+        params[f'like{i}'] = f"%{_escape_like(term)}%"
+
+    if open_only:
+        conditions.append("t.done = 0")
+
+    sql = (
+        f"SELECT {columns} FROM {source} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {rank}t.date IS NULL, t.date, t.priority DESC, t.id "
+        "LIMIT :limit OFFSET :offset"
+    )
+    rows = db.session.execute(text(sql), params).all()
+    return [_coerce_row(row) for row in rows]
+
+
+def _coerce_row(row):
+    """text() クエリの結果（日付が文字列）を ORM 射影と同じ型にそろえる"""
+    values = list(row)
+    date_index = TODO_FIELDS.index('date')
+    if isinstance(values[date_index], str):
+        values[date_index] = date.fromisoformat(values[date_index][:10])
+    return tuple(values)
+
+
+def find_todo_id_by_title(title, open_only=True):
+    """タイトルに最もよく一致する Todo の id を返す（見つからなければ None）"""
+    rows = search_todos(title, limit=1, open_only=open_only)
+    return rows[0][0] if rows else None
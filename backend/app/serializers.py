@@ -0,0 +1,56 @@
+import json
+from datetime import date
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # orjson が無い環境では標準 json にフォールバック
+    orjson = None
+
+
+# 全エンドポイント共通の Todo フィールド定義（この順で返却する）
+TODO_FIELDS = ("id", "title", "date", "done", "parent_id", "priority")
+
+
+def todo_columns(model):
+    """TODO_FIELDS に対応するモデルのカラム一覧（select() 用）"""
+    return [getattr(model, name) for name in TODO_FIELDS]
+
+
+def todo_to_dict(todo):
+    """Todo（または同じカラムを持つモデル）を共通スキーマの dict に変換"""
+    return row_to_dict((todo.id, todo.title, todo.date, todo.done, todo.parent_id, todo.priority))
+
+
+def row_to_dict(row):
+    """TODO_FIELDS 順のタプル（select の結果行）を dict に変換
+
+    ORM インスタンスを作らずにカラムだけ読む高速パス用。
+    """
+    todo_id, title, todo_date, done, parent_id, priority = row
+    return {
+        "id": todo_id,
+        "title": title,
+        "date": todo_date.isoformat() if todo_date is not None else None,
+        "done": bool(done),
+        "parent_id": parent_id,
+        "priority": priority if priority is not None else 0,
+    }
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """高速 JSON エンコード（bytes を返す）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def json_response(data, status=200):
+    """dumps() でエンコードした application/json レスポンス"""
+    return Response(dumps(data), status=status, mimetype="application/json")
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+# 数値・文字列リテラルを ? に置き換えて「同じ形の SQL」をまとめるためのパターン
+_LITERAL_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_statement(statement):
+    """SQL 文からリテラルを取り除き、比較用の形（shape）に正規化する"""
+    shape = statement
+    for pattern, replacement in _LITERAL_PATTERNS:
+        shape = pattern.sub(replacement, shape)
+    return shape.strip()
+
+
+class SQLProfiler:
+    """リクエスト単位で SQL の実行回数・時間を集計するプロファイラ
+
+    SQLAlchemy のカーソル実行イベントにフックし、リクエスト中に発行された
+    ステートメントを形ごとに数える。同じ形が閾値以上繰り返された場合は
+    N+1 の疑いとして報告し、遅いクエリはログに出す。
+    実行時に有効/無効とサンプリング率を切り替えられる。
+    """
+
+    HEADER_NAME = "X-SQL-Profile"
+
+    def __init__(self):
+        self.enabled = os.getenv('SQL_PROFILER_ENABLED', 'false').lower() == 'true'
+        self.sample_rate = float(os.getenv('SQL_PROFILER_SAMPLE_RATE', '1.0'))
+        self.slow_query_ms = float(os.getenv('SQL_PROFILER_SLOW_QUERY_MS', '100'))
+        self.n_plus_one_threshold = int(os.getenv('SQL_PROFILER_N_PLUS_ONE_THRESHOLD', '5'))
+        self._lock = threading.Lock()
+        self._installed = False
+
+    # ---------- 設定 ----------
+
+    def configure(self, enabled=None, sample_rate=None, slow_query_ms=None, n_plus_one_threshold=None):
+        """実行中に設定を変更する"""
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if sample_rate is not None:
+                self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+            if slow_query_ms is not None:
+                self.slow_query_ms = float(slow_query_ms)
+            if n_plus_one_threshold is not None:
+                self.n_plus_one_threshold = max(int(n_plus_one_threshold), 2)
+
+    def get_status(self):
+        """現在の設定を取得"""
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'slow_query_ms': self.slow_query_ms,
+            'n_plus_one_threshold': self.n_plus_one_threshold,
+        }
+
+    # ---------- Flask / SQLAlchemy への組み込み ----------
+
+    def init_app(self, app):
+        """リクエストフックとエンジンイベントを登録する"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        with self._lock:
+            if not self._installed:
+                event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+                event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+                self._installed = True
+
+    def _before_request(self):
+        if self.enabled and random.random() < self.sample_rate:
+            g.sql_profile = {'queries': [], 'started_at': time.perf_counter()}
+
+    def _after_request(self, response):
+        profile = g.pop('sql_profile', None)
+        if profile is not None:
+            summary = self.summarize(profile)
+            response.headers[self.HEADER_NAME] = json.dumps(summary, ensure_ascii=True, separators=(',', ':'))
+            if summary['n_plus_one']:
+                logger.warning(
+                    "possible N+1 in %s", summary['endpoint'],
+                    extra={'fields': {'n_plus_one': summary['n_plus_one']}},
+                )
+        return response
+
+    def _current_profile(self):
+        if not has_request_context():
+            return None
+        return g.get('sql_profile')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current_profile() is not None:
+            conn.info.setdefault('sql_profiler_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self._current_profile()
+        if profile is None:
+            return
+        starts = conn.info.get('sql_profiler_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        profile['queries'].append((statement, elapsed_ms))
+
+        if elapsed_ms >= self.slow_query_ms:
+            logger.warning("slow query (%.1f ms): %s", elapsed_ms, normalize_statement(statement))
+
+    # ---------- 集計 ----------
+
+    def summarize(self, profile):
+        """収集したクエリを集計してヘッダー用のサマリーを作る"""
+        queries = profile['queries']
+        shapes = Counter()
+        for statement, _ in queries:
+            shapes[normalize_statement(statement)] += 1
+
+        n_plus_one = [
+            {'count': count, 'statement': shape[:200]}
+            for shape, count in shapes.most_common()
+            if count >= self.n_plus_one_threshold
+        ]
+
+        return {
+            'endpoint': request.endpoint,
+            'query_count': len(queries),
+            'query_ms': round(sum(elapsed for _, elapsed in queries), 3),
+            'request_ms': round((time.perf_counter() - profile['started_at']) * 1000, 3),
+            'distinct_shapes': len(shapes),
+            'slow_queries': sum(1 for _, elapsed in queries if elapsed >= self.slow_query_ms),
+            'n_plus_one': n_plus_one,
+        }
@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import os
+from contextlib import contextmanager
+from flask import g, jsonify, request
+from sqlalchemy import Column, Integer, event, select
+from sqlalchemy.orm import Session, with_loader_criteria
+
+logger = logging.getLogger(__name__)
+
+# 既存データ・ヘッダー無しのリクエスト・単一ユーザー運用で使うテナント
+DEFAULT_TENANT_ID = 1
+
+_current_tenant = contextvars.ContextVar("tenant_id", default=None)
+
+
+def current_tenant_id():
+    """現在のテナント ID（スコープ外では DEFAULT_TENANT_ID）"""
+    tenant_id = _current_tenant.get()
+    return DEFAULT_TENANT_ID if tenant_id is None else tenant_id
+
+
+@contextmanager
+def tenant_scope(tenant_id):
+    """with ブロック内のクエリ・作成する行を tenant_id に限定する（スケジューラ等のバッチ処理用）"""
+    token = _current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+class TenantScoped:
+    """tenant_id を持つモデルの mixin（ORM のクエリに自動で tenant_id の条件が付く）
+
+    作成時は現在のテナントが入る。既存の行は server_default で DEFAULT_TENANT_ID になる。
+    """
+    tenant_id = Column(Integer, nullable=False, default=current_tenant_id,
+                       server_default=str(DEFAULT_TENANT_ID))
+
+
+def _add_tenant_criteria(execute_state):
+    """ORM の SELECT / UPDATE / DELETE に現在のテナントの条件を付ける
+
+    with_loader_criteria は別名（aliased）やサブクエリ内のエンティティにも適用される。
+    テナントをまたぐ処理（アーカイブなど）は execution_options(all_tenants=True) か
+    Core のテーブル式で書く。
+    """
+    if execute_state.is_column_load or execute_state.is_relationship_load:
+        return
+    if not (execute_state.is_select or execute_state.is_update or execute_state.is_delete):
+        return
+    if execute_state.execution_options.get("all_tenants", False):
+        return
+
+    tenant_id = current_tenant_id()
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(TenantScoped, lambda cls: cls.tenant_id == tenant_id, include_aliases=True)
+    )
+
+
+def tenant_header():
+    return os.getenv("TENANT_HEADER", "X-Tenant-ID")
+
+
+def tenant_required():
+    return os.getenv("TENANT_REQUIRED", "false").lower() in ("1", "true", "yes", "on")
+
+
+# ヘッダー無しでも受け付けるエンドポイント（テナントは各ルートが自分で確かめる）
+HEADERLESS_ENDPOINTS = {"api.webhook", "api.ics_feed", "static"}
+
+
+def init_app(app):
+    """リクエストごとのテナント解決と、ORM クエリへの自動スコープを設定する
+
+    テナントは TENANT_HEADER（既定 X-Tenant-ID）ヘッダーの整数 ID で指定する。
+    認証は前段のプロキシ等で行い、このヘッダーを付け替える想定。
+    TENANT_REQUIRED=true ならヘッダー無しのリクエストを 400 にし、
+    そうでなければ DEFAULT_TENANT_ID として扱う（単一ユーザーの既存環境向け）。
+    """
+    required = tenant_required()
+    if not event.contains(Session, "do_orm_execute", _add_tenant_criteria):
+        event.listen(Session, "do_orm_execute", _add_tenant_criteria)
+
+    @app.before_request
+    def _resolve_tenant():
+        raw = request.headers.get(tenant_header())
+        if raw is None:
+            if required and request.endpoint not in HEADERLESS_ENDPOINTS:
+                return jsonify({"error": f"{tenant_header()} header is required"}), 400
+            tenant_id = DEFAULT_TENANT_ID
+        else:
+            try:
+                tenant_id = int(raw)
+            except ValueError:
+                return jsonify({"error": f"{tenant_header()} must be an integer"}), 400
+        g.tenant_id = tenant_id
+        g.tenant_token = _current_tenant.set(tenant_id)
+
+    @app.teardown_request
+    def _reset_tenant(exc=None):
+        token = g.pop("tenant_token", None)
+        if token is not None:
+            try:
+                _current_tenant.reset(token)
+            except ValueError:
+                # 別のコンテキストで作られたトークン（ストリーミング応答の終了時など）
+                _current_tenant.set(None)
+
+
+def ensure_default_tenant(db):
+    """DEFAULT_TENANT_ID のテナントを用意する（LINE_USER_ID を通知先として引き継ぐ）"""
+    from .models import Tenant
+
+    tenant = db.session.get(Tenant, DEFAULT_TENANT_ID)
+    if tenant is None:
+        db.session.add(Tenant(id=DEFAULT_TENANT_ID, name="default", line_user_id=_configured_line_user()))
+        db.session.commit()
+    elif tenant.line_user_id is None and _configured_line_user():
+        tenant.line_user_id = _configured_line_user()
+        db.session.commit()
+
+
+def _configured_line_user():
+    user_id = os.getenv("LINE_USER_ID")
+    return user_id if user_id and user_id != "your_line_user_id_here" else None
+
+
+def tenants_with_line_user(db, batch_size=500):
+    """LINE の通知先を持つテナントを id 順に (id, line_user_id) で返す"""
+    from .models import Tenant
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Tenant.id, Tenant.line_user_id)
+            .where(Tenant.line_user_id.is_not(None), Tenant.id > last_id)
+            .order_by(Tenant.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
@@ -0,0 +1,346 @@
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from sqlalchemy import bindparam, func, insert, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from . import db
+from .cache import read_cache
+from .change_feed import change_feed
+from .dedupe import duplicate_index
+from .models import Todo
+from .serializers import TODO_FIELDS, dumps, row_to_dict, todo_columns
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv")
+# Flask が charset=utf-8 を付けるので mimetype には含めない
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+
+# SQLite の INTEGER（符号付き 64 ビット）に収まる範囲
+_MIN_INTEGER, _MAX_INTEGER = -2**63, 2**63 - 1
+
+
+# --------------------------------------
+# エクスポート
+# --------------------------------------
+
+def export_todos(fmt, tenant_id):
+    """テナントの todos を NDJSON / CSV のチャンク（bytes）として順に返すジェネレータ
+
+    専用のコネクションでサーバーサイドカーソル（stream_results）を使い、
+    EXPORT_BATCH_SIZE 行ずつ読み出してはエンコードして返すので、
+    件数に関わらずメモリ使用量は一定。
+    コネクションを直接使うのでテナントの自動スコープは掛からず、tenant_id で明示的に絞る。
+    """
+    query = select(*todo_columns(Todo)).where(Todo.tenant_id == tenant_id).order_by(Todo.id)
+
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(query)
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(TODO_FIELDS)
+            for batch in result.partitions():
+                for row in batch:
+                    item = row_to_dict(row)
+                    writer.writerow([_csv_value(item[name]) for name in TODO_FIELDS])
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode("utf-8")
+        else:
+            for batch in result.partitions():
+                yield b"".join(dumps(row_to_dict(row)) + b"\n" for row in batch)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+# --------------------------------------
+# インポート
+# --------------------------------------
+
+def _parse_row(raw):
+    """1 行分の入力を検証して todos 用の値に変換する（不正なら ValueError）"""
+    title = str(raw.get("title") or "").strip()
+    if not title:
+        raise ValueError("title is required")
+    if len(title) > 120:
+        raise ValueError("title must be at most 120 characters")
+    # JSON の \ud800 などのエスケープで書かれた孤立サロゲートは保存できない
+    if any("\ud800" <= ch <= "\udfff" for ch in title):
+        raise ValueError("title must be valid UTF-8")
+
+    date_value = raw.get("date")
+    if date_value in (None, ""):
+        parsed_date = None
+    else:
+        parsed_date = date.fromisoformat(str(date_value)[:10])
+
+    done = raw.get("done")
+    if isinstance(done, str):
+        done = done.strip().lower() in _TRUE_VALUES
+    done = bool(done)
+
+    priority = _optional_int(raw.get("priority"), "priority") or 0
+
+    return {
+        "source_id": _optional_int(raw.get("id"), "id"),
+        "source_parent_id": _optional_int(raw.get("parent_id"), "parent_id"),
+        "values": {
+            "title": title,
+            "date": parsed_date,
+            "done": done,
+            "priority": priority,
+            "parent_id": None,
+            "completed_at": datetime.now() if done else None,
+        },
+    }
+
+
+def _optional_int(value, name):
+    if value in (None, ""):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} must be an integer")
+    if not _MIN_INTEGER <= number <= _MAX_INTEGER:
+        raise ValueError(f"{name} is out of range")
+    return number
+
+
+def _has_invalid_utf8(record):
+    """surrogateescape で読み込んだ値に UTF-8 として不正なバイトが含まれているか"""
+    values = record.values() if isinstance(record, dict) else [record]
+    return any(isinstance(v, str) and any("\udc80" <= ch <= "\udcff" for ch in v) for v in values)
+
+
+def _iter_records(stream, fmt):
+    """入力ストリームを 1 行ずつ (行番号, dict または例外) にして返す
+
+    UTF-8 として不正なバイトは surrogateescape で読み飛ばさずに保持し、
+    その行だけをエラーにする（ストリーム全体を失敗させない）。
+    """
+    if not isinstance(stream, io.BufferedIOBase):
+        stream = io.BufferedReader(stream)
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="surrogateescape", newline="")
+
+    if fmt == "csv":
+        reader = csv.DictReader(text_stream)
+        while True:
+            line_before = reader.line_num
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                # エラーになった行は読み捨てられるので、次の行から読み続ける
+                yield max(reader.line_num, line_before + 1), ValueError(f"invalid CSV: {e}")
+                continue
+            if _has_invalid_utf8(record):
+                yield reader.line_num, ValueError("invalid UTF-8")
+                continue
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(text_stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if _has_invalid_utf8(line):
+            yield line_number, ValueError("invalid UTF-8")
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f"invalid JSON: {e.msg}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ValueError("each line must be a JSON object")
+            continue
+        yield line_number, record
+
+
+class ImportResult:
+    """インポート結果（エラーは先頭 MAX_REPORTED_ERRORS 件のみ保持）"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.warnings = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self):
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "warnings": self.warnings,
+        }
+
+
+def import_todos(stream, fmt, chunk_size=IMPORT_CHUNK_SIZE):
+    """NDJSON / CSV のストリームを逐次読み込み、チャンクごとにコミットして取り込む
+
+    取り込んだ行は現在のテナントのもの（tenant_id のカラムデフォルト）になる。
+    入力の id / parent_id は元データ上の id として扱い、新しく採番された id との
+    対応を一時テーブル import_id_map に記録する。親子関係は全件取り込み後に
+    この対応表から一括で張り直すので、親が子より後に出てきても構わない。
+    対応表は SQLite 側に置くので、件数が増えてもプロセスのメモリは増えない。
+    """
+    result = ImportResult()
+    todos = Todo.__table__
+
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS temp.import_id_map"))
+            conn.execute(text(
+                "CREATE TEMP TABLE import_id_map ("
+                " new_id INTEGER PRIMARY KEY, source_id INTEGER UNIQUE, source_parent_id INTEGER)"
+            ))
+            conn.commit()
+
+            chunk = []
+            for line_number, record in _iter_records(stream, fmt):
+                if isinstance(record, Exception):
+                    result.add_error(line_number, str(record))
+                    continue
+                try:
+                    parsed = _parse_row(record)
+                except (TypeError, ValueError) as e:
+                    result.add_error(line_number, str(e))
+                    continue
+                chunk.append((line_number, parsed))
+                if len(chunk) >= chunk_size:
+                    _insert_chunk(conn, todos, chunk, result)
+                    chunk = []
+            if chunk:
+                _insert_chunk(conn, todos, chunk, result)
+
+            _resolve_parents(conn, result)
+            conn.execute(text("DROP TABLE IF EXISTS temp.import_id_map"))
+            conn.commit()
+    finally:
+        # セッションを通さない書き込みなので、一覧キャッシュはテナント単位で無効化し、
+        # 変更フィードの購読者には一覧の再取得を促す（重複検出の索引は作り直す）
+        read_cache.invalidate_tenant()
+        change_feed.invalidate_tenant(reason="import")
+        duplicate_index.invalidate_tenant()
+
+    logger.info("Imported %d todos (%d failed)", result.imported, result.failed)
+    return result
+
+
+def _insert_chunk(conn, todos, chunk, result):
+    """1 チャンク分を 1 トランザクションで挿入し、id 対応表に記録する"""
+    # 同じ source_id が重複している行はエラーにする
+    source_ids = [parsed["source_id"] for _, parsed in chunk if parsed["source_id"] is not None]
+    seen = set()
+    if source_ids:
+        seen = set(conn.execute(
+            text("SELECT source_id FROM import_id_map WHERE source_id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)),
+            {"ids": source_ids},
+        ).scalars())
+
+    rows = []
+    for line_number, parsed in chunk:
+        source_id = parsed["source_id"]
+        if source_id is not None:
+            if source_id in seen:
+                result.add_error(line_number, f"duplicate id {source_id}")
+                continue
+            seen.add(source_id)
+        rows.append((line_number, parsed))
+
+    if not rows:
+        return
+
+    try:
+        _insert_rows(conn, todos, [parsed for _, parsed in rows])
+    except (SQLAlchemyError, OverflowError):
+        # どの行が原因か分からないので、1 行ずつ入れ直して失敗した行だけをエラーにする
+        conn.rollback()
+        for line_number, parsed in rows:
+            try:
+                _insert_rows(conn, todos, [parsed])
+            except (SQLAlchemyError, OverflowError) as e:
+                conn.rollback()
+                logger.warning("Failed to import line %d: %s", line_number, e)
+                result.add_error(line_number, "could not be stored")
+            else:
+                result.imported += 1
+    else:
+        result.imported += len(rows)
+
+
+def _insert_rows(conn, todos, rows):
+    """rows を 1 トランザクションで挿入し、id 対応表に記録する"""
+    # id は同じトランザクション内で、これまでに採番した最大の id（アーカイブ・削除済みを含む
+    # sqlite_sequence の値）の続きから明示的に採番する（行ごとの RETURNING を避けて
+    # executemany 1 回で挿入するため）。明示した id が大きければ sqlite_sequence も進む。
+    # 他の書き込みと競合した場合は主キー制約でエラーになり、黙って重複することはない。
+    start_id = max(
+        conn.execute(select(func.max(todos.c.id))).scalar() or 0,
+        conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'todos'")).scalar() or 0,
+    )
+    new_ids = list(range(start_id + 1, start_id + 1 + len(rows)))
+    conn.execute(insert(todos), [dict(parsed["values"], id=new_id) for new_id, parsed in zip(new_ids, rows)])
+    conn.execute(
+        text("INSERT INTO import_id_map (new_id, source_id, source_parent_id) VALUES (:new_id, :source_id, :parent)"),
+        [
+            {"new_id": new_id, "source_id": parsed["source_id"], "parent": parsed["source_parent_id"]}
+            for new_id, parsed in zip(new_ids, rows)
+        ],
+    )
+    conn.commit()
+
+
+def _resolve_parents(conn, result):
+    """取り込んだ行の parent_id を新しい id に張り直す"""
+    conn.execute(text(
+        "UPDATE todos SET parent_id = ("
+        "  SELECT p.new_id FROM import_id_map c JOIN import_id_map p ON p.source_id = c.source_parent_id"
+        "  WHERE c.new_id = todos.id"
+        ") WHERE id IN ("
+        "  SELECT c.new_id FROM import_id_map c JOIN import_id_map p ON p.source_id = c.source_parent_id"
+        ")"
+    ))
+
+    missing = conn.execute(text(
+        "SELECT c.new_id, c.source_id, c.source_parent_id FROM import_id_map c"
+        " LEFT JOIN import_id_map p ON p.source_id = c.source_parent_id"
+        " WHERE c.source_parent_id IS NOT NULL AND p.new_id IS NULL"
+        f" LIMIT {MAX_REPORTED_ERRORS}"
+    )).all()
+    for new_id, source_id, source_parent_id in missing:
+        result.warnings.append({
+            "id": source_id,
+            "new_id": new_id,
+            "warning": f"parent {source_parent_id} not found in import; imported without parent",
+        })
+    conn.commit()
@@ -0,0 +1,5 @@
+"""
+ベンチマーク用ユーティリティ
+
+backend/ ディレクトリから ``python -m bench.run`` のように実行する。
+"""
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+一覧キャッシュの計測
+
+UI を模した読み込み中心の操作列（全件一覧・前後数か月の月表示・カレンダー）に
+一定割合の書き込み（PATCH で日付やタイトルを変更）を混ぜ、キャッシュを
+無効にした場合と有効にした場合の読み込みレイテンシとヒット率を比べる。
+同じ乱数シードで操作列を作るので、両者は同じ順序で同じリクエストを送る。
+
+使い方:
+    python -m bench.cache --todos 100000 --write-ratio 0.05
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, summarize, write_results
+from .seed import seed_database
+
+
+def month_window(today, offset):
+    first = (today.replace(day=1) + timedelta(days=32 * offset)).replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first, last
+
+
+def build_operations(count, write_ratio, todo_count, months, seed):
+    """(種類, パス, body) の操作列"""
+    rng = random.Random(seed)
+    today = date.today()
+    windows = [month_window(today, offset) for offset in range(-(months // 2), months - months // 2)]
+    operations = []
+    for _ in range(count):
+        if rng.random() < write_ratio:
+            todo_id = rng.randint(1, todo_count)
+            if rng.random() < 0.5:
+                day = today + timedelta(days=rng.randint(-60, 60))
+                body = {"date": day.isoformat()}
+            else:
+                body = {"title": f"更新 {rng.randint(0, 10 ** 6)}"}
+            operations.append(("write", f"/todos/{todo_id}", body))
+            continue
+
+        roll = rng.random()
+        start, end = rng.choice(windows)
+        if roll < 0.1:
+            operations.append(("list_all", "/todos", None))
+        elif roll < 0.7:
+            operations.append(("list_month", f"/todos?start={start}&end={end}", None))
+        else:
+            operations.append(("calendar", f"/todos/calendar?start={start}&end={end}", None))
+    return operations
+
+
+def run(client, operations):
+    latencies = {}
+    for kind, path, body in operations:
+        start = time.perf_counter()
+        response = client.patch(path, json=body) if kind == "write" else client.get(path)
+        elapsed = time.perf_counter() - start
+        if response.status_code not in (200, 404):
+            raise RuntimeError(f"{path}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        latencies.setdefault(kind, []).append(elapsed)
+    return {kind: summarize(values) for kind, values in sorted(latencies.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一覧キャッシュのベンチマーク")
+    parser.add_argument("--todos", type=int, default=100000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--operations", type=int, default=2000, help="操作数")
+    parser.add_argument("--write-ratio", type=float, default=0.05, help="書き込みの割合")
+    parser.add_argument("--months", type=int, default=6, help="月表示で行き来する月数")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CACHE_BACKEND", "memory")
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        todo_count = db.session.query(db.func.max(Todo.id)).scalar() or 0
+
+    client = app.test_client()
+    cache = app.read_cache
+    operations = build_operations(args.operations, args.write_ratio, todo_count, args.months, args.seed)
+
+    # 同じ操作列をキャッシュなし → あり の順に流す（書き込みは両方で同じ結果になる）
+    cache.enabled = False
+    uncached = run(client, operations)
+
+    cache.enabled = True
+    cache.backend.clear()
+    cache.reset_stats()
+    cached = run(client, operations)
+    status = cache.get_status()
+
+    write_results({
+        "environment": environment_info(),
+        "dataset": {"todos": todo_count},
+        "parameters": {
+            "operations": args.operations,
+            "write_ratio": args.write_ratio,
+            "months": args.months,
+            "backend": status["backend"],
+        },
+        "cache": {
+            "hit_ratio": status["hit_ratio"],
+            "endpoints": status["endpoints"],
+            "storage": status["storage"],
+        },
+        "scenarios": {
+            **{f"uncached_{kind}": stats for kind, stats in uncached.items()},
+            **{f"cached_{kind}": stats for kind, stats in cached.items()},
+        },
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
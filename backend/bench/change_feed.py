@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+変更フィード（GET /todos/stream）と「書き込みのたびに一覧を取り直す」方式の比較
+
+1. refetch: PATCH の後に GET /todos で全件を取り直す（従来のフロントエンドの動き）
+2. stream: SSE を購読しておき、PATCH の後に自分の変更イベントが届くまでを計る
+
+あわせて、購読者の数（--subscribers）を増やしたときの PATCH 自体のレイテンシ
+（コミット時の配信コスト）を、購読者なしの場合と比べる。
+
+使い方:
+    python -m bench.change_feed --todos 5000 --subscribers 50 --iterations 200
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from .chat_load import PooledWSGIServer
+from .common import DEFAULT_DB_PATH, environment_info, load_app, summarize, write_results
+from .seed import seed_database
+
+
+def _request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+class StreamReader(threading.Thread):
+    """SSE を読み続け、changes イベントを (受信時刻, 本文) で events に積む"""
+
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.conn.request("GET", "/todos/stream")
+        self.response = self.conn.getresponse()
+        self.events = queue.Queue()
+
+    def run(self):
+        lines = []
+        try:
+            while True:
+                line = self.response.readline()
+                if not line:
+                    return
+                if line != b"\n":
+                    lines.append(line)
+                    continue
+                if b"event: changes\n" in lines:
+                    self.events.put((time.perf_counter(), b"".join(lines)))
+                lines = []
+        except OSError:
+            return
+
+    def close(self):
+        # レスポンスもソケットを掴んでいるので、両方閉じてサーバー側の配信を終わらせる
+        self.response.close()
+        self.conn.close()
+
+
+def run_refetch(port, iterations, todo_count):
+    latencies, sizes = [], []
+    for i in range(iterations):
+        start = time.perf_counter()
+        _request(port, "PATCH", f"/todos/{1 + i % todo_count}", {"title": f"bench {i}"})
+        _, body = _request(port, "GET", "/todos")
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(body))
+    return dict(summarize(latencies), bytes_per_update=round(sum(sizes) / len(sizes)))
+
+
+def run_patch_only(port, iterations, todo_count):
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        _request(port, "PATCH", f"/todos/{1 + i % todo_count}", {"title": f"bench {i}"})
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def run_stream(port, iterations, todo_count, reader):
+    latencies, sizes = [], []
+    for i in range(iterations):
+        start = time.perf_counter()
+        _request(port, "PATCH", f"/todos/{1 + i % todo_count}", {"title": f"stream {i}"})
+        received, body = reader.events.get(timeout=10)
+        latencies.append(received - start)
+        sizes.append(len(body))
+    return dict(summarize(latencies), bytes_per_update=round(sum(sizes) / len(sizes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="変更フィードのベンチマーク")
+    parser.add_argument("--todos", type=int, default=5000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--subscribers", type=int, default=50, help="計測用とは別に接続しておく購読者数")
+    parser.add_argument("--iterations", type=int, default=200, help="各シナリオの書き込み回数")
+    parser.add_argument("--port", type=int, default=5056, help="ベンチマーク用サーバーのポート")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    # 一覧の取り直しにキャッシュの効果が混ざらないようにする
+    os.environ.setdefault("CACHE_BACKEND", "none")
+    os.environ.setdefault("CHANGE_FEED_HEARTBEAT_SECONDS", "1")
+    os.environ.setdefault("CHANGE_FEED_MAX_SUBSCRIBERS", str(args.subscribers + 10))
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        todo_count = db.session.query(db.func.max(Todo.id)).scalar() or 1
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = PooledWSGIServer("127.0.0.1", args.port, app, args.subscribers + 8)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    scenarios = {
+        "refetch": run_refetch(args.port, args.iterations, todo_count),
+        "patch_without_subscribers": run_patch_only(args.port, args.iterations, todo_count),
+    }
+
+    readers = [StreamReader(args.port) for _ in range(args.subscribers + 1)]
+    for reader in readers:
+        reader.start()
+    scenarios["stream"] = run_stream(args.port, args.iterations, todo_count, readers[0])
+    scenarios["patch_with_subscribers"] = run_patch_only(args.port, args.iterations, todo_count)
+    feed_status = app.change_feed.get_status()
+    for reader in readers:
+        reader.close()
+    server.shutdown()
+
+    write_results({
+        "environment": environment_info(),
+        "parameters": {"todos": todo_count, "subscribers": args.subscribers + 1, "iterations": args.iterations},
+        "scenarios": scenarios,
+        "change_feed": feed_status,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+/chat の会話履歴の圧縮で送信トークン数がどれだけ減るかの計測
+
+長い会話（ユーザーの依頼とアクション JSON を含むアシスタントの返答の繰り返し）を
+1 ターンずつ伸ばしながら HistoryCompactor.compact に通し、圧縮前後のトークン数と
+圧縮にかかる時間を集計する。要約キャッシュを無効にした場合（毎ターン要約を
+作り直す）とも比べる。DB やアプリは使わない。
+
+使い方:
+    python -m bench.chat_history --turns 200 --budget 3000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from .common import BACKEND_DIR, environment_info, summarize, write_results
+from .seed import synthetic_title
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.chat_history import HistoryCompactor, TokenCounter  # noqa: E402
+
+
+def build_conversation(turns, seed=42):
+    """turns 往復分の合成会話"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(turns):
+        title = synthetic_title(rng)
+        messages.append({
+            "role": "user",
+            "content": f"「{title}」を来週までに終わらせたいので、3 つくらいに分けて日程を提案してください。",
+        })
+        subtasks = ",\n".join(
+            f'    {{"title": "{title} {n + 1}", "date": "2025-01-{10 + n:02d}", "priority": {n % 3}}}'
+            for n in range(3)
+        )
+        messages.append({
+            "role": "assistant",
+            "content": (
+                f"「{title}」を 3 つのサブタスクに分割しました。前半に調査、後半に仕上げを置いています。\n"
+                f"```json\n{{\n  \"type\": \"split_task\",\n  \"task_id\": {i + 1},\n"
+                f"  \"new_tasks\": [\n{subtasks}\n  ],\n  \"sequential\": true\n}}\n```\n"
+                "ほかに調整したいタスクがあれば教えてください。"
+            ),
+        })
+    return messages
+
+
+def run_session(compactor, conversation):
+    """会話を 1 ターンずつ伸ばしながら圧縮し、ターンごとの結果を集める"""
+    latencies = []
+    original = sent = 0
+    for end in range(1, len(conversation) + 1, 2):
+        history = conversation[:end]
+        start = time.perf_counter()
+        _, stats = compactor.compact(history, namespace="bench")
+        latencies.append(time.perf_counter() - start)
+        original += stats["original_tokens"]
+        sent += stats["sent_tokens"]
+    return {
+        "compact": summarize(latencies),
+        "original_tokens": original,
+        "sent_tokens": sent,
+        "saved_ratio": round(1 - sent / original, 4) if original else None,
+        "last_turn_sent_tokens": stats["sent_tokens"],
+        "last_turn_original_tokens": stats["original_tokens"],
+        "status": compactor.get_status(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会話履歴の圧縮のベンチマーク")
+    parser.add_argument("--turns", type=int, default=200, help="会話の往復数")
+    parser.add_argument("--budget", type=int, default=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000")))
+    parser.add_argument("--keep-recent", type=int, default=6, help="そのまま残す直近のメッセージ数")
+    parser.add_argument("--summary-tokens", type=int, default=500, help="要約のトークン上限")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    conversation = build_conversation(args.turns)
+    counter = TokenCounter()
+    results = {}
+    for name, cache_size in (("rebuild_summary", 0), ("cached_summary", 1024)):
+        compactor = HistoryCompactor(
+            budget=args.budget, keep_recent=args.keep_recent,
+            summary_budget=args.summary_tokens, cache_size=cache_size, counter=counter,
+        )
+        results[name] = run_session(compactor, conversation)
+
+    write_results({
+        "environment": environment_info(),
+        "parameters": {
+            "turns": args.turns,
+            "budget": args.budget,
+            "keep_recent": args.keep_recent,
+            "summary_tokens": args.summary_tokens,
+            "exact_token_count": counter.exact,
+        },
+        "scenarios": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+/chat の急増時に Todo の読み書きのレイテンシが保たれるかの計測
+
+gunicorn の gthread ワーカーを模して、リクエストを固定本数のスレッドプールで
+処理する HTTP サーバーを立てる。多数のクライアントが /chat（モックの LLM 待ちを
+CHAT_MOCK_LATENCY_MS で模擬）を連打している間に、別のクライアントが月表示の
+一覧取得と PATCH を一定間隔で行い、そのレイテンシを計る。
+/chat の流量制御を無効にした場合と有効にした場合を同じ条件で比べる。
+
+使い方:
+    python -m bench.chat_load --server-threads 16 --chat-clients 32 --llm-latency-ms 1000
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from werkzeug.serving import BaseWSGIServer
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, summarize, write_results
+from .seed import seed_database
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """固定本数のスレッドでリクエストを処理する WSGI サーバー（空きが無ければ接続は待たされる）"""
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _request(port, method, path, body=None, timeout=60):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def run_phase(port, duration, chat_clients, probe_interval, todo_count):
+    """duration 秒間、チャットの連打と Todo の読み書きを並行して行う"""
+    stop = threading.Event()
+    chat_status = {}
+    chat_lock = threading.Lock()
+    probes = {"read": [], "write": []}
+
+    def chat_loop(index):
+        body = {"messages": [{"role": "user", "content": f"相談 {index}"}]}
+        while not stop.is_set():
+            try:
+                status = _request(port, "POST", "/chat", body)
+            except OSError:
+                status = "error"
+            with chat_lock:
+                chat_status[status] = chat_status.get(status, 0) + 1
+            if status == 429:
+                time.sleep(0.2)
+
+    today = date.today()
+    month = f"start={today.replace(day=1)}&end={today.replace(day=1) + timedelta(days=30)}"
+
+    def probe_loop():
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            if i % 2 == 0:
+                _request(port, "GET", f"/todos?{month}")
+                probes["read"].append(time.perf_counter() - start)
+            else:
+                _request(port, "PATCH", f"/todos/{1 + i % todo_count}", {"priority": i % 4})
+                probes["write"].append(time.perf_counter() - start)
+            i += 1
+            time.sleep(probe_interval)
+
+    threads = [threading.Thread(target=chat_loop, args=(i,), daemon=True) for i in range(chat_clients)]
+    threads.append(threading.Thread(target=probe_loop, daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=120)
+
+    return {
+        "chat_responses": {str(k): v for k, v in sorted(chat_status.items(), key=str)},
+        "todo_read": summarize(probes["read"]) if probes["read"] else None,
+        "todo_write": summarize(probes["write"]) if probes["write"] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat の流量制御のベンチマーク")
+    parser.add_argument("--todos", type=int, default=10000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--server-threads", type=int, default=16, help="サーバーのリクエスト処理スレッド数")
+    parser.add_argument("--chat-clients", type=int, default=32, help="/chat を連打するクライアント数")
+    parser.add_argument("--llm-latency-ms", type=int, default=1000, help="モックの LLM 応答時間")
+    parser.add_argument("--duration", type=float, default=10.0, help="各フェーズの秒数")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="Todo の読み書きの間隔（秒）")
+    parser.add_argument("--port", type=int, default=5055, help="ベンチマーク用サーバーのポート")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.environ["CHAT_MOCK_LATENCY_MS"] = str(args.llm_latency_ms)
+    # 読み込みのレイテンシにキャッシュの効果が混ざらないようにする
+    os.environ.setdefault("CACHE_BACKEND", "none")
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        todo_count = db.session.query(db.func.max(Todo.id)).scalar() or 1
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = PooledWSGIServer("127.0.0.1", args.port, app, args.server_threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    gate = app.chat_gate
+    results = {}
+    for name, enabled in (("unbounded", False), ("admission_control", True)):
+        gate.enabled = enabled
+        results[name] = run_phase(args.port, args.duration, args.chat_clients, args.probe_interval, todo_count)
+        results[name]["gate"] = gate.get_status()
+        # 前のフェーズのチャットが捌け切るのを待つ
+        time.sleep(args.llm_latency_ms / 1000 * 2)
+
+    server.shutdown()
+    write_results({
+        "environment": environment_info(),
+        "parameters": {
+            "todos": todo_count,
+            "server_threads": args.server_threads,
+            "chat_clients": args.chat_clients,
+            "llm_latency_ms": args.llm_latency_ms,
+            "duration_s": args.duration,
+        },
+        "phases": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
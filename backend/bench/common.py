@@ -0,0 +1,122 @@
+"""
+ベンチマーク共通処理（計測・集計・アプリ読み込み）
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB_PATH = os.path.join(BACKEND_DIR, "instance", "bench_todos.db")
+
+
+def load_app(db_path):
+    """ベンチマーク用 DB を指す設定でアプリを生成する（スケジューラーは起動しない）
+
+    create_app は生成時に環境変数から設定を読むため、環境変数を先に設定する。
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    os.environ.setdefault("NOTIFICATION_SCHEDULER_ENABLED", "false")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ["CHAT_MOCK_MODE"] = "true"
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    from app import create_app, db, setup_database
+    app = create_app()
+    setup_database(app)
+    return app, db
+
+
+def percentile(sorted_values, pct):
+    """ソート済みの値から線形補間でパーセンタイルを求める"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def summarize(latencies, ops_per_call=1):
+    """レイテンシ（秒）の一覧からスループットとパーセンタイルを計算"""
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        "iterations": len(values),
+        "ops_per_call": ops_per_call,
+        "throughput_per_s": round(len(values) / total, 3) if total else None,
+        "ops_per_s": round(len(values) * ops_per_call / total, 3) if total else None,
+        "mean_ms": round(total / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "min_ms": round(values[0] * 1000, 3) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def measure(func, iterations, warmup=1, ops_per_call=1):
+    """func を繰り返し実行してレイテンシを計測する
+
+    func は反復番号を受け取る。
+    """
+    for i in range(warmup):
+        func(-1 - i)
+
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, ops_per_call)
+
+
+def git_revision():
+    """現在のコミットハッシュ（取得できなければ None）"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    """結果 JSON に含める実行環境情報"""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def write_results(results, output=None):
+    """結果を JSON として出力（output 未指定なら標準出力）"""
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def compare_results(baseline, current, key="p50_ms"):
+    """2つの結果 JSON のシナリオごとの比率（current / baseline）を返す"""
+    comparison = {}
+    for name, stats in current.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not base.get(key):
+            continue
+        comparison[name] = {
+            "baseline": base[key],
+            "current": stats[key],
+            "ratio": round(stats[key] / base[key], 3),
+        }
+    return comparison
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+近似重複の検出（MinHash/LSH の索引）の計測
+
+- build: 合成タイトルから索引を作る時間
+- lsh: 索引での 1 タイトルあたりの重複検索
+- linear: 全タイトルとの Jaccard 係数を総当たりで計算する検索（索引が無い場合）
+- accuracy: 総当たりの結果を正解としたときの索引の再現率（見つけた重複は
+  Jaccard 係数を確かめているので適合率は常に 1）
+- bulk_off / bulk_flag: POST /todos/bulk（20 件）を dedupe=off / flag で呼ぶ
+
+検索には既存タイトルの言い回しを変えたもの（助詞の置き換え・空白や句読点・
+全角半角など）と、どれとも似ていない新しいタイトルを半分ずつ使う。
+
+使い方:
+    python -m bench.dedupe --titles 100000 --iterations 1000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import bindparam
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, measure, write_results
+from .seed import _CONTEXTS, _VERBS as _SEED_VERBS, seed_database
+
+# seed.synthetic_title は 1000 通りしかないので、名詞を漢字 2 文字の組み合わせにして種類を増やす
+_KANJI = (
+    "資料報告書見積議事録請求企画会設計画面発注契約予算採用面接研修旅行出張健康診断銀行役所税金保険"
+    "住所変更引越掃除洗濯料理買物病院歯医者薬局家賃電気水道携帯修理更新申請登録解約返品配送受取送付"
+    "印刷翻訳調査分析集計共有公開移行検証導入廃棄"
+)
+_VERBS = _SEED_VERBS + [
+    "見直し", "送付", "相談", "手配", "申し込み", "支払い", "返信", "共有", "調整", "下書き",
+    "問い合わせ", "キャンセル", "受け取り", "振り込み", "片付け",
+]
+_KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+_PATTERNS = [
+    "{kana}{noun}の{verb}",
+    "{noun}を{verb}する",
+    "{kana}さんに{noun}を{verb}",
+    "{noun}{noun2}の{verb}",
+    "{context}の{kana}{noun}{noun2}を{verb}",
+]
+# 言い回しの揺れ（LLM が同じタスクを少し違う表現で作り直す場合を想定）
+_REWORDINGS = [("の", "を"), ("を", "の"), ("に", "へ"), ("する", ""), ("さん", "様")]
+
+
+def synthetic_titles(count, rng):
+    """重複しない合成タイトルを count 件生成する"""
+    titles = set()
+    while len(titles) < count:
+        titles.add(rng.choice(_PATTERNS).format(
+            kana="".join(rng.choice(_KATAKANA) for _ in range(rng.randint(2, 4))),
+            noun="".join(rng.sample(_KANJI, 2)),
+            noun2="".join(rng.sample(_KANJI, 2)),
+            verb=rng.choice(_VERBS),
+            context=rng.choice(_CONTEXTS),
+        ))
+    return sorted(titles)
+
+
+def perturb(title, rng):
+    """title の言い回しを少し変える"""
+    for before, after in rng.sample(_REWORDINGS, len(_REWORDINGS)):
+        if before in title:
+            title = title.replace(before, after, 1)
+            break
+    choice = rng.random()
+    if choice < 0.3:
+        title = f"{title}。"
+    elif choice < 0.5:
+        title = title.replace("の", " の ", 1)
+    elif choice < 0.7:
+        title = title.translate(str.maketrans("ABX", "ＡＢＸ")).replace("レビュー", "ﾚﾋﾞｭｰ")
+    return title
+
+
+def main():
+    parser = argparse.ArgumentParser(description="近似重複検出のベンチマーク")
+    parser.add_argument("--titles", type=int, default=100000, help="索引に入れる合成タイトル件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--iterations", type=int, default=1000, help="索引での検索回数")
+    parser.add_argument("--linear-iterations", type=int, default=50, help="総当たりでの検索回数")
+    parser.add_argument("--accuracy-queries", type=int, default=300, help="再現率を求める検索の件数")
+    parser.add_argument("--skip-api", action="store_true", help="POST /todos/bulk の計測を省く")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.dedupe import normalize_title
+
+    rng = random.Random(42)
+    titles = synthetic_titles(args.titles, rng)
+    queries = []
+    for i in range(max(args.iterations, args.accuracy_queries)):
+        if i % 2 == 0:
+            queries.append(perturb(rng.choice(titles), rng))
+        else:
+            queries.append(synthetic_titles(1, random.Random(10**9 + i))[0])
+
+    results = {}
+    lsh = app.duplicate_index.make_lsh()
+    started = time.perf_counter()
+    for key, title in enumerate(titles):
+        lsh.add(key, title)
+    elapsed = time.perf_counter() - started
+    results["build"] = {"seconds": round(elapsed, 3), "titles_per_s": round(len(titles) / elapsed, 1)}
+
+    results["lsh"] = measure(lambda i: lsh.query(queries[i % len(queries)]), args.iterations)
+
+    shingled = [lsh.shingles(normalize_title(title)) for title in titles]
+
+    def linear(query):
+        shingles = lsh.shingles(normalize_title(query))
+        matches = []
+        for key, other in enumerate(shingled):
+            similarity = len(shingles & other) / len(shingles | other)
+            if similarity >= lsh.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda m: -m[1])
+
+    results["linear"] = measure(lambda i: linear(queries[i % len(queries)]), args.linear_iterations)
+
+    expected = found = 0
+    for query in queries[:args.accuracy_queries]:
+        truth = linear(query)
+        matches = lsh.query(query)
+        if truth:
+            expected += 1
+            found += bool(matches)
+    results["accuracy"] = {
+        "queries": args.accuracy_queries,
+        "queries_with_duplicates": expected,
+        "recall": round(found / expected, 4) if expected else None,
+        "precision": 1.0,
+    }
+
+    if not args.skip_api:
+        from app.models import Todo
+
+        table = Todo.__table__
+        with app.app_context():
+            seed_database(db, table, len(titles))
+            db.session.execute(
+                table.update().where(table.c.id == bindparam("todo_id")).values(title=bindparam("new_title")),
+                [{"todo_id": i + 1, "new_title": title} for i, title in enumerate(titles)],
+            )
+            db.session.commit()
+            open_titles = db.session.query(Todo).filter(Todo.done.is_not(True)).count()
+
+        client = app.test_client()
+
+        def bulk(mode):
+            def call(i):
+                batch = [{"title": queries[(i * 20 + j) % len(queries)]} for j in range(20)]
+                response = client.post("/todos/bulk", json={"todos": batch, "dedupe": mode})
+                assert response.status_code == 201, response.status_code
+            return call
+
+        started = time.perf_counter()
+        client.post("/todos/bulk", json={"todos": [{"title": queries[0]}], "dedupe": "flag"})
+        results["index_cold_build_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        results["bulk_off"] = measure(bulk("off"), 50, ops_per_call=20)
+        results["bulk_flag"] = measure(bulk("flag"), 50, ops_per_call=20)
+        results["open_titles_in_db"] = open_titles
+
+    write_results({
+        "environment": environment_info(),
+        "parameters": {
+            "titles": len(titles),
+            "iterations": args.iterations,
+            "linear_iterations": args.linear_iterations,
+            "settings": app.duplicate_index.get_status()["settings"],
+        },
+        "scenarios": results,
+        "dedupe": app.duplicate_index.get_status(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
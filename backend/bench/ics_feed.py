@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+iCalendar フィード（GET /todos/feed.ics）の計測
+
+- uncached: 一覧キャッシュを無効にして毎回全月を描画する
+- warm: 全月の描画結果がキャッシュにある状態
+- after_write: 毎回 1 件の Todo を更新してから取得する（その月だけ描画し直す）
+- not_modified: 前回の ETag を If-None-Match で送る（カレンダーアプリのポーリング）
+
+使い方:
+    python -m bench.ics_feed --todos 100000 --iterations 50
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, measure, write_results
+from .seed import seed_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description="iCalendar フィードのベンチマーク")
+    parser.add_argument("--todos", type=int, default=100000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--iterations", type=int, default=50, help="各シナリオの反復回数")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.environ["CACHE_BACKEND"] = "memory"
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        today = date.today()
+        # フィードの期間（既定で 3 か月前〜12 か月後）にある Todo の id
+        window_ids = [row[0] for row in db.session.query(Todo.id).filter(
+            Todo.date >= today.replace(day=1) - timedelta(days=92),
+            Todo.date <= today + timedelta(days=365),
+        )]
+
+    client = app.test_client()
+    cache = app.read_cache
+    rng = random.Random(42)
+    state = {}
+
+    def fetch(_):
+        response = client.get("/todos/feed.ics")
+        state["size"] = len(response.data)
+        state["etag"] = response.headers["ETag"]
+
+    def fetch_after_write(i):
+        client.patch(f"/todos/{rng.choice(window_ids)}", json={"title": f"更新 {i}"})
+        fetch(i)
+
+    def fetch_conditional(_):
+        response = client.get("/todos/feed.ics", headers={"If-None-Match": state["etag"]})
+        assert response.status_code == 304, response.status_code
+
+    scenarios = {}
+    cache.enabled = False
+    scenarios["uncached"] = measure(fetch, args.iterations)
+    cache.enabled = True
+    scenarios["warm"] = measure(fetch, args.iterations)
+    scenarios["after_write"] = measure(fetch_after_write, args.iterations)
+    fetch(0)
+    scenarios["not_modified"] = measure(fetch_conditional, args.iterations)
+
+    write_results({
+        "environment": environment_info(),
+        "parameters": {
+            "todos": args.todos,
+            "todos_in_feed": len(window_ids),
+            "iterations": args.iterations,
+            "feed_bytes": state["size"],
+        },
+        "scenarios": scenarios,
+        "cache": cache.get_status(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+API・ActionParser のスループット / レイテンシ計測
+
+合成データを投入した SQLite に対して Flask テストクライアント経由で
+各エンドポイントを呼び出し、p50 / p99 レイテンシとスループットを
+JSON で出力する。コミット間の比較には --compare を使う。
+
+使い方:
+    python -m bench.run --todos 100000 --output result.json
+    python -m bench.run --no-seed --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+from datetime import date, timedelta
+
+from .common import DEFAULT_DB_PATH, compare_results, environment_info, load_app, measure, write_results
+from .seed import seed_database, synthetic_title
+
+SCENARIOS = [
+    "list_todos",
+    "search",
+    "bulk_create",
+    "bulk_update",
+    "batch_mixed",
+    "action_create_tasks",
+    "action_adjust_deadline",
+    "action_update_tasks",
+    "action_split_task",
+    "chat_mock",
+]
+
+
+def _action_reply(action):
+    """ChatGPT の応答を模した、JSON アクション入りのテキスト"""
+    return f"了解しました。\n```json\n{json.dumps(action, ensure_ascii=False)}\n```"
+
+
+class BenchmarkRunner:
+    """シナリオごとの計測処理"""
+
+    def __init__(self, app, todo_count, iterations, list_iterations, batch_size, seed):
+        self.app = app
+        self.client = app.test_client()
+        self.todo_count = todo_count
+        self.iterations = iterations
+        self.list_iterations = list_iterations
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.today = date.today()
+
+    def _random_ids(self, count):
+        return [self.rng.randint(1, self.todo_count) for _ in range(count)]
+
+    def _random_date(self):
+        return (self.today + timedelta(days=self.rng.randint(-30, 60))).isoformat()
+
+    def _new_tasks(self, count):
+        return [
+            {"title": synthetic_title(self.rng), "date": self._random_date(), "priority": self.rng.randint(0, 3)}
+            for _ in range(count)
+        ]
+
+    def _check(self, response, expected=(200, 201)):
+        if response.status_code not in expected:
+            raise RuntimeError(f"unexpected status {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    # ---------- HTTP シナリオ ----------
+
+    def list_todos(self):
+        return measure(lambda _: self._check(self.client.get("/todos")), self.list_iterations)
+
+    def search(self):
+        from .seed import _CONTEXTS, _NOUNS
+
+        def call(_):
+            query = f"{self.rng.choice(_CONTEXTS)}{self.rng.choice(_NOUNS)}"
+            self._check(self.client.get("/todos/search", query_string={"q": query}))
+        return measure(call, self.iterations)
+
+    def bulk_create(self):
+        def call(_):
+            self._check(self.client.post("/todos/bulk", json={"todos": self._new_tasks(self.batch_size)}))
+        return measure(call, self.iterations, ops_per_call=self.batch_size)
+
+    def bulk_update(self):
+        def call(_):
+            updates = [
+                {"id": todo_id, "done": self.rng.random() < 0.5, "priority": self.rng.randint(0, 3)}
+                for todo_id in self._random_ids(self.batch_size)
+            ]
+            self._check(self.client.patch("/todos/bulk", json={"updates": updates}))
+        return measure(call, self.iterations, ops_per_call=self.batch_size)
+
+    def batch_mixed(self):
+        """POST /batch: 作成したタスクを同じバッチ内で参照して更新・削除する"""
+        def call(i):
+            operations = []
+            for j, task in enumerate(self._new_tasks(self.batch_size // 2)):
+                ref = f"t{i}_{j}"
+                operations.append({"op": "create", "ref": ref, "data": task})
+                operations.append({"op": "update", "id": f"${ref}", "data": {"priority": 3}})
+            operations.append({"op": "delete", "id": f"${operations[0]['ref']}"})
+            self._check(self.client.post("/batch", json={"operations": operations}), (200,))
+        return measure(call, self.iterations, ops_per_call=self.batch_size // 2 * 2 + 1)
+
+    def chat_mock(self):
+        context = "\n".join(
+            f"- ID:{todo_id} {synthetic_title(self.rng)} ({self._random_date()})"
+            for todo_id in self._random_ids(200)
+        )
+
+        def call(i):
+            payload = {
+                "messages": [{"role": "user", "content": f"タスクを整理して {i}"}],
+                "current_month_tasks": context,
+            }
+            self._check(self.client.post("/chat", json=payload))
+        return measure(call, self.iterations)
+
+    # ---------- ActionParser シナリオ ----------
+
+    def _measure_action(self, build_action, ops_per_call):
+        from app.action_parser import ActionParser
+
+        def call(_):
+            with self.app.app_context():
+                result = ActionParser().parse_and_execute(_action_reply(build_action()))
+            if not result["success"]:
+                raise RuntimeError(result.get("error"))
+        return measure(call, self.iterations, ops_per_call=ops_per_call)
+
+    def action_create_tasks(self):
+        return self._measure_action(
+            lambda: {"type": "create_tasks", "tasks": self._new_tasks(self.batch_size)},
+            self.batch_size,
+        )
+
+    def action_adjust_deadline(self):
+        return self._measure_action(
+            lambda: {
+                "type": "adjust_deadline",
+                "updates": [{"task_id": i, "new_date": self._random_date()} for i in self._random_ids(self.batch_size)],
+            },
+            self.batch_size,
+        )
+
+    def action_update_tasks(self):
+        return self._measure_action(
+            lambda: {
+                "type": "update_tasks",
+                "updates": [
+                    {"task_id": i, "priority": self.rng.randint(0, 3), "done": False}
+                    for i in self._random_ids(self.batch_size)
+                ],
+            },
+            self.batch_size,
+        )
+
+    def action_split_task(self):
+        targets = iter(self.rng.sample(range(1, self.todo_count + 1), min(self.todo_count, self.iterations + 10)))
+        return self._measure_action(
+            lambda: {"type": "split_task", "task_id": next(targets), "new_tasks": self._new_tasks(3)},
+            1,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="todo-scheduler バックエンドのベンチマーク")
+    parser.add_argument("--todos", type=int, default=10000, help="合成 Todo 件数 (10k〜1M)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    parser.add_argument("--iterations", type=int, default=50, help="各シナリオの計測回数")
+    parser.add_argument("--list-iterations", type=int, default=10, help="GET /todos の計測回数")
+    parser.add_argument("--batch-size", type=int, default=50, help="bulk / アクション1回あたりの件数")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ（カンマ区切り）")
+    parser.add_argument("--output", help="結果 JSON の出力先（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較対象の結果 JSON（p50 の比率を出力）")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos, args.seed)
+        todo_count = db.session.query(db.func.max(Todo.id)).scalar() or 0
+
+    runner = BenchmarkRunner(app, todo_count, args.iterations, args.list_iterations, args.batch_size, args.seed)
+
+    results = {
+        "environment": environment_info(),
+        "dataset": {"todos": todo_count, "seed": args.seed, "db": os.path.abspath(args.db)},
+        "parameters": {
+            "iterations": args.iterations,
+            "list_iterations": args.list_iterations,
+            "batch_size": args.batch_size,
+        },
+        "scenarios": {},
+    }
+
+    for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+        results["scenarios"][name] = getattr(runner, name)()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            results["comparison"] = compare_results(json.load(f), results)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
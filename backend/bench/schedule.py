@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+スケジューリングエンジンの計測
+
+合成データに見積もり時間と締め切りを付け、POST /schedule のプレビュー
+（計算のみ）と適用（1 トランザクションでの日付更新）の所要時間を計測する。
+
+使い方:
+    python -m bench.schedule --todos 100000
+"""
+
+import argparse
+import os
+import time
+
+from sqlalchemy import text
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, measure, write_results
+from .seed import seed_database
+
+
+def prepare_estimates(db):
+    """見積もり（15〜240 分）と、期日付きタスクの一部に明示的な締め切りを付ける"""
+    db.session.execute(text("UPDATE todos SET estimated_minutes = 15 + (abs(random()) % 16) * 15"))
+    db.session.execute(text("UPDATE todos SET deadline = date WHERE date IS NOT NULL AND id % 2 = 0"))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スケジューリングエンジンのベンチマーク")
+    parser.add_argument("--todos", type=int, default=100000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--iterations", type=int, default=5, help="プレビューの計測回数")
+    parser.add_argument("--capacity", type=int, default=480, help="1 日の作業時間（分）")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app import scheduling
+    from app.models import Todo
+
+    client = app.test_client()
+    body = {"capacity_minutes": args.capacity, "skip_weekends": True}
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        prepare_estimates(db)
+        todo_count = db.session.query(Todo).count()
+
+        # エンジン単体（HTTP・シリアライズを除く）
+        engine_only = measure(
+            lambda _: scheduling.build_schedule(capacity_minutes=args.capacity, skip_weekends=True),
+            args.iterations,
+        )
+        db.session.remove()
+
+    def preview(_):
+        response = client.post("/schedule", json=body)
+        if response.status_code != 200:
+            raise RuntimeError(response.get_data(as_text=True)[:200])
+        return response
+
+    preview_stats = measure(preview, args.iterations)
+    plan = preview(0).get_json()
+
+    start = time.perf_counter()
+    applied = client.post("/schedule", json=dict(body, apply=True))
+    apply_ms = (time.perf_counter() - start) * 1000
+    if applied.status_code != 200:
+        raise RuntimeError(applied.get_data(as_text=True)[:200])
+
+    write_results({
+        "environment": environment_info(),
+        "dataset": {"todos": todo_count},
+        "plan": {
+            "scheduled": plan["scheduled"],
+            "changes": len(plan["changes"]),
+            "infeasible": len(plan["infeasible"]),
+            "end_date": plan["end_date"],
+        },
+        "scenarios": {
+            "build_schedule": engine_only,
+            "preview_http": preview_stats,
+            "apply_http": {"ms": round(apply_ms, 3), "changes": len(plan["changes"])},
+        },
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
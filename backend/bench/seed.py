@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成データを投入する
+
+使い方:
+    python -m bench.seed --todos 100000 [--db instance/bench_todos.db] [--seed 42]
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from .common import DEFAULT_DB_PATH, load_app
+
+_VERBS = ["作成", "確認", "提出", "準備", "整理", "連絡", "修正", "レビュー", "予約", "購入"]
+_NOUNS = ["資料", "報告書", "見積書", "議事録", "請求書", "企画書", "メール", "会議", "設計書", "スライド"]
+_CONTEXTS = ["週次", "月次", "A社", "B社", "チーム", "家族", "個人", "プロジェクトX", "経理", "営業"]
+
+INSERT_BATCH_SIZE = 10000
+
+
+def synthetic_title(rng):
+    """それらしい日本語タイトルを生成"""
+    return f"{rng.choice(_CONTEXTS)}{rng.choice(_NOUNS)}の{rng.choice(_VERBS)}"
+
+
+def synthetic_date(rng, today):
+    """今日を中心にばらついた日付（約3割は期限なし）"""
+    if rng.random() < 0.3:
+        return None
+    offset = int(rng.gauss(0, 60))
+    return today + timedelta(days=max(min(offset, 365), -365))
+
+
+def generate_rows(count, rng, today=None, subtask_ratio=0.4, max_children=5):
+    """Todo 行を id 付きで生成する
+
+    約 subtask_ratio の割合でサブタスクになり、親は既に生成済みの
+    ルートタスクから選ぶ（親1件あたり最大 max_children 件）。
+    """
+    today = today or date.today()
+    roots = []
+    child_counts = {}
+
+    for todo_id in range(1, count + 1):
+        parent_id = None
+        if roots and rng.random() < subtask_ratio:
+            candidate = rng.choice(roots)
+            if child_counts.get(candidate, 0) < max_children:
+                parent_id = candidate
+                child_counts[candidate] = child_counts.get(candidate, 0) + 1
+
+        todo_date = synthetic_date(rng, today)
+        # 過去のタスクほど完了している確率が高い
+        if todo_date is not None and todo_date < today:
+            done = rng.random() < 0.8
+        else:
+            done = rng.random() < 0.1
+
+        if parent_id is None:
+            roots.append(todo_id)
+
+        yield {
+            "id": todo_id,
+            "title": synthetic_title(rng),
+            "date": todo_date,
+            "done": done,
+            "parent_id": parent_id,
+            "priority": rng.choices([0, 1, 2, 3], weights=[50, 25, 15, 10])[0],
+        }
+
+
+def seed_database(db, todo_table, count, seed=42):
+    """テーブルを作り直して count 件の Todo を投入する"""
+    from app.search import ensure_search_index
+
+    rng = random.Random(seed)
+    # 検索インデックスは投入後にまとめて再構築する（トリガー経由より速い）
+    db.session.execute(text("DROP TABLE IF EXISTS todos_fts"))
+    db.session.commit()
+    db.drop_all()
+    db.create_all()
+
+    batch = []
+    for row in generate_rows(count, rng):
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(todo_table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(todo_table.insert(), batch)
+    db.session.commit()
+    ensure_search_index(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用データの投入")
+    parser.add_argument("--todos", type=int, default=10000, help="投入する Todo 件数 (10k〜1M)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite ファイルのパス")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        seed_database(db, Todo.__table__, args.todos, args.seed)
+        total = db.session.query(Todo).count()
+    print(f"Seeded {total} todos into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+一覧取得のシリアライズ経路の比較
+
+従来の経路（ORM で Todo を全件ハイドレートして dict 化し jsonify）と、
+カラム射影したタプルを直接エンコードする経路について、
+所要時間と確保されたメモリブロック数（tracemalloc）とピークメモリを計測する。
+
+使い方:
+    python -m bench.serialization --todos 100000
+"""
+
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, percentile, write_results
+from .seed import seed_database
+
+
+def orm_path(db, Todo):
+    """従来: ORM インスタンス → dict → jsonify"""
+    from flask import jsonify
+
+    todos = Todo.query.order_by(Todo.id).all()
+    body = jsonify([
+        {"id": t.id, "title": t.title, "date": t.date.isoformat() if t.date else None, "done": t.done}
+        for t in todos
+    ]).get_data()
+    return todos, body
+
+
+def projected_path(db, Todo):
+    """新: カラム射影タプル → dict → 高速エンコーダ"""
+    from sqlalchemy import select
+    from app.serializers import dumps, row_to_dict, todo_columns
+
+    rows = db.session.execute(select(*todo_columns(Todo)).order_by(Todo.id)).all()
+    body = dumps([row_to_dict(row) for row in rows])
+    return rows, body
+
+
+def measure_path(func, db, iterations):
+    """時間（tracemalloc 無効）と確保量（tracemalloc 有効）を別々に計測
+
+    確保量は、読み出した行（ORM インスタンス / タプル）とセッションが
+    まだ生きている時点のスナップショットで数える。
+    """
+    timings = []
+    for _ in range(iterations):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        db.session.remove()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    gc.collect()
+    tracemalloc.start()
+    keepalive, body = func()
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated_blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    del keepalive
+    db.session.remove()
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "min_ms": round(timings[0] * 1000, 3),
+        "allocated_blocks": allocated_blocks,
+        "peak_traced_bytes": peak,
+        "response_bytes": len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一覧シリアライズ経路のベンチマーク")
+    parser.add_argument("--todos", type=int, default=100000, help="合成 Todo 件数")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--no-seed", action="store_true", help="既存のベンチマーク DB をそのまま使う")
+    parser.add_argument("--iterations", type=int, default=5, help="計測回数")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Todo
+
+    with app.app_context():
+        if not args.no_seed:
+            seed_database(db, Todo.__table__, args.todos)
+        row_count = db.session.query(Todo).count()
+
+        results = {
+            "environment": environment_info(),
+            "dataset": {"todos": row_count},
+            "scenarios": {
+                "orm_hydration": measure_path(lambda: orm_path(db, Todo), db, args.iterations),
+                "column_projection": measure_path(lambda: projected_path(db, Todo), db, args.iterations),
+            },
+        }
+
+    orm = results["scenarios"]["orm_hydration"]
+    projected = results["scenarios"]["column_projection"]
+    results["speedup"] = round(orm["p50_ms"] / projected["p50_ms"], 2) if projected["p50_ms"] else None
+    results["peak_memory_ratio"] = (
+        round(projected["peak_traced_bytes"] / orm["peak_traced_bytes"], 3) if orm["peak_traced_bytes"] else None
+    )
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+テナント数に対するテナントごとのクエリコストの計測
+
+1 テナントあたりの Todo 件数を固定したままテナント数を段階的に増やし
+（例: 10 → 100 → 1000）、各段階で無作為に選んだテナントとして主要な
+エンドポイントを呼び出す。テナント先頭の複合インデックスが効いていれば、
+テーブル全体の件数が増えてもテナントごとの p50 はほぼ一定になる。
+
+使い方:
+    python -m bench.tenants --tenants 10,100,1000 --todos-per-tenant 200
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert, text
+
+from .common import DEFAULT_DB_PATH, environment_info, load_app, measure, write_results
+from .seed import INSERT_BATCH_SIZE, generate_rows
+
+SCENARIOS = ["list_todos", "list_month", "calendar", "next", "unblocked", "search"]
+
+
+def add_tenants(db, tenant_model, todo_table, first_tenant, last_tenant, per_tenant, rng):
+    """first_tenant〜last_tenant のテナントと、それぞれ per_tenant 件の Todo を追加する"""
+    next_id = (db.session.execute(func.max(todo_table.c.id).select()).scalar() or 0) + 1
+    db.session.execute(insert(tenant_model), [
+        {"id": tenant_id, "name": f"bench-{tenant_id}"} for tenant_id in range(first_tenant, last_tenant + 1)
+    ])
+
+    batch = []
+    for tenant_id in range(first_tenant, last_tenant + 1):
+        offset = next_id - 1
+        for row in generate_rows(per_tenant, rng):
+            row["id"] += offset
+            if row["parent_id"] is not None:
+                row["parent_id"] += offset
+            row["tenant_id"] = tenant_id
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                db.session.execute(todo_table.insert(), batch)
+                batch = []
+        next_id += per_tenant
+    if batch:
+        db.session.execute(todo_table.insert(), batch)
+    db.session.commit()
+
+
+def reset_database(db):
+    from app import tenancy
+    from app.search import ensure_search_index
+
+    db.session.execute(text("DROP TABLE IF EXISTS todos_fts"))
+    db.session.commit()
+    db.drop_all()
+    db.create_all()
+    ensure_search_index(db)
+    tenancy.ensure_default_tenant(db)
+
+
+def run_stage(client, tenant_count, sample, iterations, rng):
+    """無作為に選んだ sample テナントで各シナリオを計測する"""
+    today = date.today()
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    month = f"start={month_start.isoformat()}&end={month_end.isoformat()}"
+    tenants = [rng.randint(2, tenant_count + 1) for _ in range(max(iterations, 1))]
+
+    def call(path):
+        def run(i):
+            headers = {"X-Tenant-ID": str(tenants[i % len(tenants)])}
+            response = client.get(path, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        return run
+
+    paths = {
+        "list_todos": "/todos",
+        "list_month": f"/todos?{month}",
+        "calendar": f"/todos/calendar?{month}",
+        "next": "/todos/next?k=5",
+        "unblocked": "/todos/unblocked?limit=20",
+        "search": "/todos/search?q=報告書&limit=20",
+    }
+    return {name: measure(call(paths[name]), sample) for name in SCENARIOS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="テナント数に対するクエリコストのベンチマーク")
+    parser.add_argument("--tenants", default="10,100,1000", help="計測するテナント数（昇順、カンマ区切り）")
+    parser.add_argument("--todos-per-tenant", type=int, default=200, help="1 テナントあたりの Todo 件数")
+    parser.add_argument("--iterations", type=int, default=50, help="各シナリオの計測回数（毎回別のテナント）")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="ベンチマーク用 SQLite ファイル")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    parser.add_argument("--output", help="結果 JSON の出力先")
+    args = parser.parse_args()
+
+    stages = sorted({int(n) for n in args.tenants.split(",") if n.strip()})
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app, db = load_app(args.db)
+    from app.models import Tenant, Todo
+
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    results = {}
+
+    with app.app_context():
+        reset_database(db)
+
+    # テナント 1 は既定テナントなので、計測用テナントは 2 から始める
+    created = 0
+    for tenant_count in stages:
+        with app.app_context():
+            add_tenants(db, Tenant, Todo.__table__, created + 2, tenant_count + 1, args.todos_per_tenant, rng)
+            db.session.execute(text("ANALYZE"))
+            total = db.session.execute(text("SELECT count(*) FROM todos")).scalar()
+            db.session.remove()
+        created = tenant_count
+
+        results[str(tenant_count)] = {
+            "total_todos": total,
+            "scenarios": run_stage(client, tenant_count, args.iterations, args.iterations, rng),
+        }
+
+    first, last = results[str(stages[0])], results[str(stages[-1])]
+    growth = {
+        name: round(last["scenarios"][name]["p50_ms"] / first["scenarios"][name]["p50_ms"], 3)
+        for name in SCENARIOS if first["scenarios"][name]["p50_ms"]
+    }
+
+    write_results({
+        "environment": environment_info(),
+        "dataset": {"todos_per_tenant": args.todos_per_tenant, "tenant_counts": stages},
+        "stages": results,
+        # 最大テナント数 / 最小テナント数 の p50 の比（1 に近いほどテナント数に依存しない）
+        "p50_growth": growth,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,14 @@ import os
 # アプリケーションのパスを追加
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
+from app import create_app, db, setup_database
 
 def create_database():
     """データベースを作成"""
+    app = create_app()
+    # 全てのテーブル・インデックスを作成（スケジューラーは起動しない）
+    setup_database(app)
     with app.app_context():
-        # 全てのテーブルを作成
-        db.create_all()
         print("Database created successfully!")
         
         # テーブル情報を表示
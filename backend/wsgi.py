@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""
+本番・開発サーバーのエントリーポイント（FLASK_APP=wsgi / gunicorn wsgi:app）
+
+アプリの生成 → スキーマの準備 → スケジューラーの起動 を明示的な手順として行う。
+"""
+
+from app import create_app, setup_database, start_scheduler
+
+app = create_app()
+setup_database(app)
+start_scheduler(app)
@@ -26,6 +26,8 @@ class _HomePageState extends State<HomePage> {
 
   late final TodoService _todoService;
   late final ChatService _chatService;
+  html.EventSource? _changeFeed;
+  bool _changeFeedConnected = false;
 
   List<Map<String, dynamic>> todos = [];
   Map<DateTime, List<Map<String, dynamic>>> _events = {};
@@ -52,10 +54,16 @@ class _HomePageState extends State<HomePage> {
     _todoService = TodoService(apiUrl: _api);
     _chatService = ChatService(apiUrl: _api);
     _fetchTodos();
+    _changeFeed = _todoService.subscribeChanges(
+      onChanges: _applyChanges,
+      onInvalidate: _fetchTodos,
+      onConnectionChange: (connected) => _changeFeedConnected = connected,
+    );
   }
 
   @override
   void dispose() {
+    _changeFeed?.close();
     _textFieldFocus.dispose();
     super.dispose();
   }
@@ -70,6 +78,25 @@ class _HomePageState extends State<HomePage> {
     });
   }
 
+  /// 変更フィードで届いた差分を反映する（内容の無い差分なら取り直す）
+  void _applyChanges(List<Map<String, dynamic>> upserted, List<int> deleted) {
+    final updated = _todoService.applyChanges(todos, upserted, deleted);
+    if (updated == null) {
+      _fetchTodos();
+      return;
+    }
+    setState(() {
+      todos = updated;
+      _events = _todoService.organizeEventsByDate(updated);
+    });
+  }
+
+  /// 書き込みの後の再取得（変更フィードに接続中なら差分が届くので取り直さない）
+  Future<void> _refreshAfterWrite() async {
+    if (_changeFeedConnected) return;
+    await _fetchTodos();
+  }
+
   Future<void> _selectDueDate() async {
     final DateTime? picked = await showDatePicker(
       context: context,
@@ -125,7 +152,7 @@ class _HomePageState extends State<HomePage> {
     
     final success = await _todoService.addTodo(raw, date);
     if (success) {
-      await _fetchTodos();
+      await _refreshAfterWrite();
       setState(() {
         _selectedDueDate = null;
       });
@@ -196,7 +223,9 @@ class _HomePageState extends State<HomePage> {
       // ChatGPTアクションの種類に応じて最適化された更新処理
       final needsFullRefresh = _shouldPerformFullRefresh(actions);
       
-      if (needsFullRefresh) {
+      if (_changeFeedConnected) {
+        // 実行結果は変更フィードで届く
+      } else if (needsFullRefresh) {
         // 全体のリフレッシュが必要な場合
         await _fetchTodos();
       } else {
@@ -365,7 +394,7 @@ class _HomePageState extends State<HomePage> {
                               child: TodoListComponent(
                                 todos: todos,
                                 apiUrl: _api,
-                                onTodoUpdate: _fetchTodos,
+                                onTodoUpdate: _refreshAfterWrite,
                               ),
                             ),
                             const SizedBox(height: 16),
@@ -1,4 +1,5 @@
 import 'dart:convert';
+import 'dart:html' as html;
 import 'package:http/http.dart' as http;
 
 class TodoService {
@@ -12,8 +13,12 @@ class TodoService {
 
     final List<dynamic> data = jsonDecode(res.body);
     final tmpTodos = data.cast<Map<String, dynamic>>();
+    _sortByDate(tmpTodos);
+    return tmpTodos;
+  }
 
-    tmpTodos.sort((a, b) {
+  void _sortByDate(List<Map<String, dynamic>> todos) {
+    todos.sort((a, b) {
       final dateA = a['date'] != null ? DateTime.parse(a['date']) : null;
       final dateB = b['date'] != null ? DateTime.parse(b['date']) : null;
       
@@ -23,8 +28,55 @@ class TodoService {
       
       return dateA.compareTo(dateB);
     });
+  }
 
-    return tmpTodos;
+  /// サーバーの変更フィード（GET /todos/stream）を購読する
+  ///
+  /// changes イベントで作成・更新・削除されたタスクが届くので、書き込みのたびに
+  /// 一覧を取り直す必要はない。invalidate / reset（一括の変更や取りこぼし）が
+  /// 届いたときだけ onInvalidate で再取得する。切断時はブラウザが自動で再接続し、
+  /// Last-Event-ID から続きを受け取る。
+  html.EventSource subscribeChanges({
+    required void Function(List<Map<String, dynamic>> upserted, List<int> deleted) onChanges,
+    required void Function() onInvalidate,
+    void Function(bool connected)? onConnectionChange,
+  }) {
+    final source = html.EventSource('$apiUrl/todos/stream');
+    source.onOpen.listen((_) => onConnectionChange?.call(true));
+    source.onError.listen((_) => onConnectionChange?.call(false));
+    source.addEventListener('changes', (event) {
+      final data = jsonDecode((event as html.MessageEvent).data as String) as Map<String, dynamic>;
+      onChanges(
+        (data['upserted'] as List).cast<Map<String, dynamic>>(),
+        (data['deleted'] as List).cast<int>(),
+      );
+    });
+    source.addEventListener('invalidate', (_) => onInvalidate());
+    source.addEventListener('reset', (_) => onInvalidate());
+    return source;
+  }
+
+  /// 変更フィードの内容を手元の一覧に反映した新しい一覧を返す
+  ///
+  /// id しか無い更新（サーバー側で内容を読まなかったもの）が含まれていれば null
+  /// を返すので、その場合は一覧を取り直す。
+  List<Map<String, dynamic>>? applyChanges(
+    List<Map<String, dynamic>> todos,
+    List<Map<String, dynamic>> upserted,
+    List<int> deleted,
+  ) {
+    if (upserted.any((todo) => !todo.containsKey('title'))) return null;
+
+    final byId = {for (final todo in todos) todo['id'] as int: todo};
+    for (final id in deleted) {
+      byId.remove(id);
+    }
+    for (final todo in upserted) {
+      byId[todo['id'] as int] = todo;
+    }
+    final updated = byId.values.toList();
+    _sortByDate(updated);
+    return updated;
   }
 
   Map<DateTime, List<Map<String, dynamic>>> organizeEventsByDate(
@@ -95,23 +147,37 @@ class TodoService {
 
   /// 部分的なデータ更新をサポート
   Future<bool> updateTodosPartial(List<Map<String, dynamic>> updates) async {
-    // 複数のタスクの部分更新
-    // 現在は個別のupdateを順次実行
-    bool allSuccess = true;
-    
+    // 複数のタスクの部分更新を /batch の 1 リクエスト・1 トランザクションで送る
+    final operations = <Map<String, dynamic>>[];
     for (final update in updates) {
       final id = update['id'];
-      final done = update['done'];
-      
-      if (id != null && done != null) {
-        final success = await updateTodoDone(id, done);
-        if (!success) {
-          allSuccess = false;
-        }
-      }
+      if (id == null) continue;
+      final data = Map<String, dynamic>.from(update)..remove('id');
+      operations.add({'op': 'update', 'id': id, 'data': data});
+    }
+    if (operations.isEmpty) return true;
+
+    final result = await applyBatch(operations);
+    return result != null;
+  }
+
+  /// create / update / delete の操作列を 1 リクエストで適用する
+  ///
+  /// create に 'ref' を付けると、後続の操作の id / parent_id に "$ref" と書いて
+  /// そのタスクを参照できる。全件成功した場合のみ結果を返し、失敗時は null
+  /// （サーバー側で全体がロールバックされる）。
+  Future<Map<String, dynamic>?> applyBatch(List<Map<String, dynamic>> operations) async {
+    try {
+      final res = await http.post(
+        Uri.parse('$apiUrl/batch'),
+        headers: {'Content-Type': 'application/json; charset=utf-8'},
+        body: jsonEncode({'operations': operations}),
+      );
+      if (res.statusCode != 200) return null;
+      return jsonDecode(res.body) as Map<String, dynamic>;
+    } catch (e) {
+      return null;
     }
-    
-    return allSuccess;
   }
 
   /// キャッシュ機能のスケルトン